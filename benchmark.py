@@ -0,0 +1,351 @@
+"""
+Watermark Benchmark - 性能测试
+生成固定内容的合成图片（不需要显示器和网络），分别测量解码、水印合成、编码和预览渲染的耗时，
+以及不同进程数下的批量导出吞吐量；结果写入 JSON 文件，便于比较不同版本
+
+示例:
+    python benchmark.py -o bench.json
+    python benchmark.py --sizes 1,12 --formats JPEG --workers 1,4 --repeat 5 -o quick.json
+    python benchmark.py --sizes 50 --formats JPEG --blends pillow,numpy --skip-batch -o blend.json
+"""
+
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import warnings
+import PIL
+from PIL import Image
+
+import watermark_blend
+from watermark_encode import ENCODER_PROFILES, OUTPUT_FORMATS, get_profile, save_image
+from watermark_export import default_workers, export_batch, export_image
+from watermark_fonts import get_registry
+from watermark_metrics import configure_logging
+from watermark_preview import load_preview_base
+from watermark_render import Renderer, WatermarkSpec
+from watermark_stream import STREAM_MIN_PIXELS
+
+DEFAULT_SIZES = (1, 12, 50, 100)  # 百万像素
+INPUT_FORMATS = {
+    'JPEG': ('.jpg', {'quality': 90}),
+    'PNG': ('.png', {}),
+    'TIFF': ('.tif', {'compression': 'tiff_lzw'}),
+}
+PREVIEW_SIZE = (800, 600)
+BATCH_MEGAPIXELS = 12
+
+LOGO_NAME = 'logo.png'
+
+# 合成测试的水印设置（logo 的路径在运行时填入）
+COMPOSITE_CASES = {
+    'text': {'type': 'text', 'text': '© Photo Watermark 2024', 'font_size': 96,
+             'opacity': 60, 'position': 'bottom_right'},
+    'text_cjk': {'type': 'text', 'text': '© 版权所有 图片水印', 'font_size': 96,
+                 'opacity': 60, 'position': 'bottom_right'},
+    'logo': {'type': 'image', 'wm_scale': 100, 'img_opacity': 60, 'position': 'center'},
+    'text_rotated': {'type': 'text', 'text': '© Photo Watermark 2024', 'font_size': 96,
+                     'opacity': 60, 'rotation': 30, 'position': 'center'},
+    'logo_rotated': {'type': 'image', 'wm_scale': 100, 'img_opacity': 60, 'rotation': 45,
+                     'position': 'center'},
+    'logo_large': {'type': 'image', 'wm_scale': 600, 'img_opacity': 60, 'position': 'center'},
+    'text_tiled': {'type': 'text', 'text': '© Photo Watermark 2024', 'font_size': 96,
+                   'opacity': 40, 'rotation': 30, 'tiled': True, 'tile_spacing': 120},
+}
+
+
+def image_dimensions(megapixels):
+    """指定像素数的 3:2 图片尺寸"""
+    width = int(math.sqrt(megapixels * 1_000_000 * 1.5))
+    return width, int(width / 1.5)
+
+
+def synth_image(size):
+    """生成固定内容的 RGB 图片（分形纹理放大，压缩率接近真实照片）"""
+    tile = (512, 512)
+    channels = [
+        Image.effect_mandelbrot(tile, (-2.0, -1.5, 1.0, 1.5), 64),
+        Image.effect_mandelbrot(tile, (-1.2, -0.6, 0.0, 0.6), 128),
+        Image.linear_gradient('L').resize(tile).rotate(45),
+    ]
+    return Image.merge('RGB', channels).resize(size, Image.Resampling.BICUBIC)
+
+
+def synth_logo(path):
+    """生成带透明度渐变的水印图片"""
+    logo = synth_image((400, 200))
+    alpha = Image.linear_gradient('L').rotate(90).resize(logo.size)
+    logo.putalpha(alpha)
+    logo.save(path)
+
+
+def ensure_inputs(work_dir, sizes, formats):
+    """生成（或复用已生成的）测试图片，返回 [(名称, 路径, 像素数)]"""
+    os.makedirs(work_dir, exist_ok=True)
+    inputs = []
+    for megapixels in sizes:
+        size = image_dimensions(megapixels)
+        source = None
+        for input_format in formats:
+            ext, params = INPUT_FORMATS[input_format]
+            name = f"{input_format.lower()}_{megapixels}mp"
+            path = os.path.join(work_dir, name + ext)
+            if not os.path.exists(path):
+                if source is None:
+                    source = synth_image(size)
+                temp = path + '.tmp'
+                source.save(temp, input_format, **params)
+                os.replace(temp, path)
+            inputs.append((name, path, size[0] * size[1]))
+    logo = os.path.join(work_dir, LOGO_NAME)
+    if not os.path.exists(logo):
+        synth_logo(logo)
+    return inputs
+
+
+def progress(args, message):
+    """输出进度（写到 stderr）"""
+    if not args.quiet:
+        print(message, file=sys.stderr)
+
+
+def time_call(func, repeat, setup=None):
+    """多次调用 func，返回耗时统计；setup 的返回值作为 func 的参数且不计时"""
+    samples = []
+    for _ in range(repeat):
+        arg = setup() if setup else None
+        start = time.perf_counter()
+        func(arg) if setup else func()
+        samples.append(time.perf_counter() - start)
+    return {
+        'min': min(samples),
+        'median': statistics.median(samples),
+        'mean': statistics.fmean(samples),
+        'repeat': repeat,
+    }
+
+
+def load_image(path):
+    with Image.open(path) as image:
+        image.load()
+        return image
+
+
+def bench_input(name, path, pixels, args, logo):
+    """单张图片各阶段的耗时"""
+    results = []
+
+    def record(stage, case, timing, **extra):
+        results.append({'input': name, 'pixels': pixels, 'stage': stage, 'case': case,
+                        'seconds': timing, **extra})
+        label = '/'.join([case] + [value for value in extra.values() if isinstance(value, str)])
+        progress(args, f"{name:<12} {stage:<10} {label:<28} {timing['median'] * 1000:10.1f} ms")
+
+    # 解码
+    record('decode', 'full', time_call(lambda: load_image(path), args.repeat))
+    original = load_image(path)
+    rgba = original.convert('RGBA')
+    targets = {'rgba': rgba, 'rgb': original.convert('RGB')}
+
+    # 水印合成：每种设置、目标模式（导出 PNG 时为 RGBA，导出 JPEG/WebP 时为 RGB）和合成后端
+    # 使用独立的渲染器，先记录冷缓存（第一次，包括图层渲染），再记录热缓存
+    for case, config in COMPOSITE_CASES.items():
+        spec = WatermarkSpec.from_config(dict(config, image_path=logo))
+        for blend in args.blends:
+            for target, source in targets.items():
+                renderer = Renderer(blend=blend)
+
+                def composite(image):
+                    renderer.render(image, spec, in_place=True, keep_rgb=True)
+
+                record('composite', case + '_cold', time_call(composite, 1, setup=source.copy),
+                       target=target, blend=blend)
+                record('composite', case, time_call(composite, args.repeat, setup=source.copy),
+                       target=target, blend=blend)
+
+    # 编码：JPEG 从 RGB 编码，PNG/WebP 从 RGBA 编码（与导出时一致）
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for output_format in args.output_formats:
+            image = original.convert('RGB') if output_format == 'JPEG' else rgba
+            output = os.path.join(temp_dir, 'out')
+            for profile_name in args.profiles:
+                profile = get_profile(profile_name)
+                sizes = []
+
+                def encode():
+                    sizes.append(save_image(image, output, output_format, profile).nbytes)
+
+                timing = time_call(encode, args.repeat)
+                record('encode', f"{output_format.lower()}_{profile_name}", timing,
+                       bytes=sizes[-1])
+
+        # 超大 TIFF 的分块导出
+        if path.endswith('.tif') and pixels >= STREAM_MIN_PIXELS:
+            spec = WatermarkSpec.from_config(dict(COMPOSITE_CASES['text'], image_path=logo))
+            output = os.path.join(temp_dir, 'stream.png')
+            record('export', 'tiff_stream_png',
+                   time_call(lambda: export_image(path, output, 'PNG', spec), args.repeat))
+
+    # 预览：降分辨率解码 + 按预览比例渲染
+    spec = WatermarkSpec.from_config(dict(COMPOSITE_CASES['text'], image_path=logo))
+    renderer = Renderer()
+
+    def preview():
+        base, ratio = load_preview_base(path, *PREVIEW_SIZE)
+        renderer.render(base, spec, ratio)
+
+    record('preview', 'load_and_render', time_call(preview, args.repeat))
+    return results
+
+
+def bench_batch(args, work_dir, logo):
+    """批量导出吞吐量：同一张 12MP JPEG 复制多份，按不同进程数导出"""
+    path = ensure_inputs(work_dir, (BATCH_MEGAPIXELS,), ('JPEG',))[0][1]
+    pixels = image_dimensions(BATCH_MEGAPIXELS)
+    pixels = pixels[0] * pixels[1]
+    spec = WatermarkSpec.from_config(dict(COMPOSITE_CASES['text'], image_path=logo))
+    profile = get_profile(args.profiles[0])
+
+    results = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        sources = []
+        for i in range(args.batch_count):
+            source = os.path.join(temp_dir, f"batch_{i:04d}.jpg")
+            shutil.copyfile(path, source)
+            sources.append(source)
+
+        for output_format in args.output_formats:
+            # 单进程时分别测量流水线和逐张串行导出
+            runs = [(workers, pipeline) for workers in args.workers
+                    for pipeline in ((True, False) if workers <= 1 else (True,))]
+            for workers, pipeline in runs:
+                mode = 'pipeline' if pipeline else 'serial'
+                output_dir = os.path.join(temp_dir, f"out_{output_format}_{workers}_{mode}")
+                os.makedirs(output_dir)
+                jobs = [(source, os.path.join(output_dir, os.path.basename(source) + '.out'))
+                        for source in sources]
+
+                start = time.perf_counter()
+                errors = [result.error for result in
+                          export_batch(jobs, output_format, spec, workers, profile,
+                                       pipeline=pipeline)
+                          if result.error]
+                seconds = time.perf_counter() - start
+
+                results.append({
+                    'format': output_format,
+                    'profile': profile.name,
+                    'workers': workers,
+                    'pipeline': pipeline,
+                    'images': len(jobs),
+                    'errors': len(errors),
+                    'seconds': seconds,
+                    'images_per_second': len(jobs) / seconds,
+                    'megapixels_per_second': len(jobs) * pixels / 1_000_000 / seconds,
+                })
+                progress(args, f"batch {output_format:<5} workers={workers:<3} {mode:<8} "
+                               f"{len(jobs) / seconds:8.2f} 张/s")
+    return results
+
+
+def environment():
+    """运行环境信息（比较结果时确认条件相同）"""
+    face = get_registry().find(script='cjk')
+    return {
+        'python': platform.python_version(),
+        'pillow': PIL.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'cjk_font': face.path if face else None,
+    }
+
+
+def parse_list(value, cast=str):
+    return [cast(item) for item in value.split(',') if item.strip()]
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='benchmark',
+        description="图片水印工具 - 性能测试（解码/合成/编码/预览分阶段计时，批量导出吞吐量）")
+    parser.add_argument('-o', '--output', default='benchmark_results.json',
+                        help="结果 JSON 文件（默认 benchmark_results.json）")
+    parser.add_argument('--sizes', type=lambda v: parse_list(v, int), default=list(DEFAULT_SIZES),
+                        help="测试图片的百万像素数，逗号分隔（默认 1,12,50,100）")
+    parser.add_argument('--formats', type=lambda v: parse_list(v.upper()),
+                        default=list(INPUT_FORMATS), help="输入格式（默认 JPEG,PNG,TIFF）")
+    parser.add_argument('--output-formats', type=lambda v: parse_list(v.upper()),
+                        default=['PNG', 'JPEG'], help="编码/导出格式（默认 PNG,JPEG）")
+    parser.add_argument('--profiles', type=parse_list, default=['balanced'],
+                        help=f"编码配置（{'/'.join(ENCODER_PROFILES)}，默认 balanced）")
+    parser.add_argument('--blends', type=parse_list, default=[watermark_blend.default_backend()],
+                        help=f"水印合成后端（{'/'.join(watermark_blend.BLEND_BACKENDS)}，"
+                             f"逗号分隔；默认 {watermark_blend.default_backend()}）")
+    parser.add_argument('--workers', type=lambda v: parse_list(v, int),
+                        default=sorted({1, 2, 4, default_workers()}),
+                        help="批量导出的进程数，逗号分隔（默认 1,2,4,CPU 核心数）")
+    parser.add_argument('--batch-count', type=int, default=24, help="批量导出的图片数（默认 24）")
+    parser.add_argument('--repeat', type=int, default=3, help="每项重复次数（默认 3）")
+    parser.add_argument('--work-dir', default=os.path.join(tempfile.gettempdir(), 'watermark_bench'),
+                        help="测试图片缓存目录（生成一次后复用）")
+    parser.add_argument('--skip-batch', action='store_true', help="不测批量导出吞吐量")
+    parser.add_argument('-v', '--verbose', action='count', default=0,
+                        help="输出更多日志（-v 信息，-vv 调试）")
+    parser.add_argument('-q', '--quiet', action='store_true', help="不输出每项结果")
+    return parser
+
+
+def run(args):
+    """执行性能测试，返回退出码"""
+    unknown = [f for f in args.formats if f not in INPUT_FORMATS]
+    unknown += [f for f in args.output_formats if f not in OUTPUT_FORMATS]
+    unknown += [p for p in args.profiles if p not in ENCODER_PROFILES]
+    unknown += [b for b in args.blends if b not in watermark_blend.BLEND_BACKENDS or
+                (b == 'numpy' and watermark_blend.numpy is None)]
+    if unknown:
+        print(f"不支持的参数: {', '.join(unknown)}", file=sys.stderr)
+        return 2
+
+    # 100MP 的测试图片超过 Pillow 的默认像素数警告阈值
+    warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+
+    logo = os.path.join(args.work_dir, LOGO_NAME)
+    started = time.time()
+    report = {
+        'environment': environment(),
+        'arguments': {key: value for key, value in vars(args).items() if key != 'quiet'},
+        'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(started)),
+        'stages': [],
+        'batch': [],
+    }
+
+    progress(args, "准备测试图片...")
+    for name, path, pixels in ensure_inputs(args.work_dir, args.sizes, args.formats):
+        report['stages'].extend(bench_input(name, path, pixels, args, logo))
+    if not args.skip_batch:
+        report['batch'] = bench_batch(args, args.work_dir, logo)
+
+    report['elapsed'] = time.time() - started
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"结果已保存到 {args.output}（用时 {report['elapsed']:.1f}s）")
+    return 0
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    configure_logging(args.verbose)
+    return run(args)
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
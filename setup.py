@@ -10,10 +10,13 @@ build_exe_options = {
         "os",
         "json",
         "pathlib",
-        "traceback"
+        "logging",
+        "multiprocessing",
+        "concurrent.futures"
     ],
     "include_files": [],
-    "excludes": ["unittest", "test", "email", "html", "http", "urllib", "xml"],
+    # http.server 依赖 email/html/urllib，水印服务需要保留
+    "excludes": ["unittest", "test", "xml"],
     "optimize": 2,
 }
 
@@ -34,6 +37,12 @@ setup(
             base=base,
             target_name="图片水印工具.exe",
             icon=None
-        )
+        ),
+        # 本地 HTTP 水印服务（控制台程序）
+        Executable(
+            "watermark_server.py",
+            target_name="watermark_server.exe",
+            icon=None
+        ),
     ],
 )
@@ -0,0 +1,53 @@
+"""
+测试公共部分：把程序文件夹加入 sys.path，并提供生成测试图片的夹具
+"""
+
+import os
+import sys
+
+import pytest
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def make_image(path, size=(320, 240), mode='RGB', seed=0, **save_args):
+    """生成带渐变和色块的测试图片（内容随 seed 变化）并保存到 path，返回 path"""
+    width, height = size
+    image = Image.new('RGB', size)
+    image.putdata([((x * 7 + seed * 31) % 256, (y * 5 + seed * 17) % 256, (x + y + seed) % 256)
+                   for y in range(height) for x in range(width)])
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((width // 4, height // 4, width // 2, height // 2), fill=(250, 40, 40))
+    if mode == 'RGBA':
+        image = image.convert('RGBA')
+        image.putalpha(Image.linear_gradient('L').resize(size))
+    elif mode != 'RGB':
+        image = image.convert(mode)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    image.save(path, **save_args)
+    return path
+
+
+@pytest.fixture
+def logo(tmp_path):
+    """半透明的水印图片"""
+    path = str(tmp_path / 'logo.png')
+    image = Image.new('RGBA', (60, 30), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(image)
+    draw.ellipse((0, 0, 59, 29), fill=(20, 120, 220, 200))
+    draw.rectangle((20, 10, 40, 20), fill=(255, 255, 0, 255))
+    image.save(path)
+    return path
+
+
+@pytest.fixture
+def photos(tmp_path):
+    """输入文件夹：不同格式、模式的图片，含一层子文件夹"""
+    folder = tmp_path / 'photos'
+    make_image(str(folder / 'a.jpg'), seed=1, quality=90)
+    make_image(str(folder / 'b.png'), mode='RGBA', seed=2)
+    make_image(str(folder / 'c.png'), mode='L', seed=3)
+    make_image(str(folder / 'sub' / 'd.jpg'), size=(200, 300), seed=4)
+    make_image(str(folder / 'sub' / 'e.tif'), seed=5)
+    return str(folder)
@@ -0,0 +1,65 @@
+"""
+LRU 缓存：淘汰顺序、字节上限，命中/未命中只由有名称的缓存记录；预览底图缓存
+"""
+
+import os
+
+from PIL import Image
+
+from watermark_cache import LRUCache
+from watermark_metrics import collect
+from watermark_preview import PreviewBaseCache
+
+
+def test_evicts_least_recently_used():
+    cache = LRUCache(max_entries=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+
+
+def test_byte_limit_and_oversized_entries():
+    cache = LRUCache(max_bytes=10, sizeof=len)
+    cache.put('a', 'xxxx')
+    cache.put('b', 'yyyy')
+    cache.put('c', 'zzzz')
+    assert len(cache) == 2 and cache.get('a') is None
+    cache.put('big', 'x' * 11)
+    assert cache.get('big') is None and len(cache) == 2
+    cache.set_limits(max_bytes=4)
+    assert len(cache) == 1 and cache.get('c') == 'zzzz'
+
+
+def test_invalid_entries_count_as_misses():
+    cache = LRUCache(name='test')
+    cache.put('a', 1)
+    with collect() as metrics:
+        assert cache.get('a', valid=lambda value: value == 2) is None
+        assert cache.get('a', valid=lambda value: value == 1) == 1
+        assert cache.get('missing', default='none') == 'none'
+    assert metrics.counters == {'test.hit': 1, 'test.miss': 2}
+
+
+def test_unnamed_cache_records_nothing():
+    cache = LRUCache()
+    with collect() as metrics:
+        cache.get('a')
+    assert not metrics.counters
+
+
+def test_preview_base_is_cached_until_file_changes(tmp_path):
+    path = str(tmp_path / 'photo.png')
+    Image.new('RGB', (800, 600), (10, 20, 30)).save(path)
+    cache = PreviewBaseCache()
+    base, ratio = cache.get(path, 400, 400)
+    assert base.size == (400, 300) and ratio == 0.5
+    assert cache.get(path, 400, 400)[0] is base
+    assert cache.get(path, 200, 200)[0].size == (200, 150)
+
+    Image.new('RGB', (800, 600), (200, 20, 30)).save(path)
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 10 ** 9))
+    changed, _ = cache.get(path, 400, 400)
+    assert changed is not base and changed.getpixel((0, 0)) == (200, 20, 30)
@@ -0,0 +1,126 @@
+"""
+命令行：退出码、按子文件夹结构输出、增量导出和输出文件冲突
+"""
+
+import json
+import os
+
+import pytest
+
+from conftest import make_image
+from watermark_cli import main
+from watermark_templates import TemplateStore
+
+
+@pytest.fixture
+def templates_file(tmp_path):
+    path = str(tmp_path / 'templates.json')
+    TemplateStore(path).save('版权', {'text': 'CLI', 'encoder_profile': 'fast'})
+    return path
+
+
+def output_files(folder):
+    return sorted(os.path.relpath(os.path.join(root, name), folder).replace(os.sep, '/')
+                  for root, _, files in os.walk(folder) for name in files
+                  if not name.startswith('.'))
+
+
+def test_spec_export_mirrors_subfolders(tmp_path, photos, capsys):
+    output = str(tmp_path / 'out')
+    assert main([photos, '-s', '{"text": "WM"}', '-o', output, '-w', '1', '-q']) == 0
+    assert output_files(output) == ['a_wm.png', 'b_wm.png', 'c_wm.png',
+                                    'sub/d_wm.png', 'sub/e_wm.png']
+
+    # 再次运行时全部已是最新
+    assert main([photos, '-s', '{"text": "WM"}', '-o', output, '-w', '1', '-q']) == 0
+    assert "成功: 0 失败: 0 跳过: 0 已是最新: 5" in capsys.readouterr().out
+
+
+def test_template_export_with_pool(tmp_path, photos, templates_file, capsys):
+    output = str(tmp_path / 'out')
+    args = [photos, '-t', '版权', '--templates', templates_file, '-o', output,
+            '-f', 'jpeg', '--naming', 'prefix', '--affix', 'wm_', '-w', '2', '--report']
+    assert main(args) == 0
+    assert output_files(output) == ['sub/wm_d.jpg', 'sub/wm_e.jpg',
+                                    'wm_a.jpg', 'wm_b.jpg', 'wm_c.jpg']
+    out = capsys.readouterr().out
+    assert "成功: 5 失败: 0" in out
+    assert "text_layer" in out
+
+    # 编码配置改变后重新导出
+    assert main(args + ['--profile', 'archive']) == 0
+    assert "成功: 5 失败: 0" in capsys.readouterr().out
+
+
+def test_spec_file_and_force(tmp_path, photos, capsys):
+    spec_file = tmp_path / 'spec.json'
+    spec_file.write_text(json.dumps({'text': '版权', 'tiled': True}, ensure_ascii=False),
+                         encoding='utf-8')
+    output = str(tmp_path / 'out')
+    args = [os.path.join(photos, '*.png'), '-s', str(spec_file), '-o', output, '-w', '1', '-q']
+    assert main(args) == 0
+    assert output_files(output) == ['b_wm.png', 'c_wm.png']
+    capsys.readouterr()
+    assert main(args + ['--force']) == 0
+    assert "成功: 2" in capsys.readouterr().out
+
+
+@pytest.mark.parametrize('settings', [
+    ['-s', '{"color": "red"}'],
+    ['-s', '{"opacity": 500}'],
+    ['-s', 'not json'],
+    ['-s', '{"encoder_profile": "tiny"}'],
+    ['-s', '{"font_size": 1e999}'],
+    ['-s', '{"position": "custom", "offset_x": NaN}'],
+    ['-t', 'missing'],
+])
+def test_invalid_settings_exit_with_2(tmp_path, photos, templates_file, settings, capsys):
+    output = str(tmp_path / 'out')
+    assert main([photos, *settings, '--templates', templates_file, '-o', output]) == 2
+    assert "读取水印设置失败" in capsys.readouterr().err
+    assert not os.path.exists(output)
+
+
+def test_no_images_exit_with_2(tmp_path, capsys):
+    empty = tmp_path / 'empty'
+    empty.mkdir()
+    assert main([str(empty), '-s', '{}', '-o', str(tmp_path / 'out')]) == 2
+    assert "没有找到图片文件" in capsys.readouterr().err
+
+
+def test_usage_errors_exit_with_2(tmp_path, photos):
+    for argv in ([photos, '-o', str(tmp_path / 'out')],
+                 [photos, '-s', '{}', '-t', 'x', '-o', str(tmp_path / 'out')],
+                 [photos, '-s', '{}', '-o', str(tmp_path / 'out'), '-f', 'gif']):
+        with pytest.raises(SystemExit) as exc:
+            main(argv)
+        assert exc.value.code == 2
+
+
+def test_conflicts_and_errors_exit_with_1(tmp_path, photos, capsys):
+    make_image(os.path.join(photos, 'a.png'), seed=8)
+    with open(os.path.join(photos, 'broken.jpg'), 'wb') as f:
+        f.write(b'not an image')
+    output = str(tmp_path / 'out')
+    assert main([photos, '-s', '{}', '-o', output, '-w', '1', '-q']) == 1
+    captured = capsys.readouterr()
+    assert "成功: 5 失败: 1 跳过: 1" in captured.out
+    assert "的输出文件相同" in captured.err
+    assert "broken.jpg" in captured.err
+
+
+def test_output_inside_input_is_not_reexported(tmp_path, photos, capsys):
+    output = os.path.join(photos, 'out')
+    args = [photos, '-s', '{}', '-o', output, '-w', '1', '-q']
+    assert main(args) == 0
+    capsys.readouterr()
+    assert main(args) == 0
+    assert "已是最新: 5" in capsys.readouterr().out
+    assert not os.path.exists(os.path.join(output, 'out'))
+
+
+def test_original_names_into_input_folder_skip_sources(photos, capsys):
+    assert main([photos, '-s', '{}', '-o', photos, '--naming', 'original', '-w', '1', '-q']) == 1
+    captured = capsys.readouterr()
+    assert "输出文件与原图相同" in captured.err
+    assert "成功: 3 失败: 0 跳过: 2" in captured.out
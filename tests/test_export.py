@@ -0,0 +1,102 @@
+"""
+批量导出：各种导出方式的结果逐字节相同，单张图片失败不影响其他图片
+"""
+
+import os
+
+import pytest
+
+from conftest import make_image
+from watermark_encode import get_profile
+from watermark_export import export_batch, output_filename, plan_jobs
+from watermark_render import WatermarkSpec, get_renderer
+from watermark_scan import iter_image_entries
+
+
+SPECS = {
+    'text': WatermarkSpec(text='Sample', font_size=48, rotation=20, position='center'),
+    'tiled': WatermarkSpec(text='tile', tiled=True, tile_spacing=30),
+}
+
+# 导出方式 -> export_batch 参数；第一种为比较基准
+MODES = {
+    'serial': dict(workers=1, pipeline=False),
+    'pipeline': dict(workers=1, pipeline=True),
+    'pool': dict(workers=2),
+    'plan': dict(workers=1, pipeline=True),
+}
+
+
+def read_outputs(folder):
+    """输出文件夹中所有文件（不含导出清单）的 {相对路径: 内容}"""
+    outputs = {}
+    for root, _, files in os.walk(folder):
+        for name in files:
+            path = os.path.join(root, name)
+            with open(path, 'rb') as f:
+                outputs[os.path.relpath(path, folder)] = f.read()
+    return outputs
+
+
+def run_export(photos, output, output_format, spec, **options):
+    jobs, skipped = plan_jobs(iter_image_entries([photos]), output, output_format)
+    assert not skipped
+    results = list(export_batch(jobs, output_format, spec, profile=get_profile('balanced'),
+                                fingerprint=True, **options))
+    assert [result.error for result in results] == [None] * len(jobs)
+    return results
+
+
+def settings_for(mode, spec):
+    """导出方式使用的水印设置：plan 使用编译好的 RenderPlan"""
+    return get_renderer().compile(spec) if mode == 'plan' else spec
+
+
+@pytest.mark.parametrize('output_format', ['PNG', 'JPEG', 'WEBP'])
+@pytest.mark.parametrize('kind', list(SPECS))
+def test_export_modes_write_identical_files(tmp_path, photos, output_format, kind):
+    outputs = {}
+    for mode, options in MODES.items():
+        folder = str(tmp_path / mode)
+        run_export(photos, folder, output_format, settings_for(mode, SPECS[kind]), **options)
+        outputs[mode] = read_outputs(folder)
+
+    assert len(outputs['serial']) == 5
+    for mode in MODES:
+        assert outputs[mode] == outputs['serial'], mode
+
+
+def test_export_error_is_reported_per_image(tmp_path, photos):
+    broken = os.path.join(photos, 'broken.jpg')
+    with open(broken, 'wb') as f:
+        f.write(b'not an image')
+    jobs, _ = plan_jobs(iter_image_entries([photos]), str(tmp_path / 'out'), 'PNG')
+    for mode, options in MODES.items():
+        results = list(export_batch(jobs, 'PNG', SPECS['text'], **options))
+        errors = {result.image_path for result in results if result.error}
+        assert errors == {broken}, mode
+
+
+def test_output_filename_rules():
+    assert output_filename('a/b.jpg', 'PNG') == 'b_wm.png'
+    assert output_filename('a/b.jpg', 'JPEG', 'prefix', 'wm_') == 'wm_b.jpg'
+    assert output_filename('a/b.png', 'WEBP', 'original') == 'b.webp'
+
+
+def test_plan_jobs_mirrors_subfolders_and_skips_conflicts(tmp_path, photos):
+    make_image(os.path.join(photos, 'a.png'), seed=9)
+    output = str(tmp_path / 'out')
+    jobs, skipped = plan_jobs(iter_image_entries([photos]), output, 'PNG')
+
+    outputs = {os.path.relpath(output_path, output) for _, output_path in jobs}
+    assert os.path.join('sub', 'd_wm.png') in outputs
+    assert os.path.join('sub', 'e_wm.png') in outputs
+    # a.jpg 与 a.png 输出到同一个文件，后一张跳过
+    assert len(skipped) == 1
+    assert os.path.basename(skipped[0][0]) in ('a.jpg', 'a.png')
+
+
+def test_plan_jobs_never_overwrites_source(photos):
+    jobs, skipped = plan_jobs(iter_image_entries([photos]), photos, 'PNG', 'original')
+    assert {os.path.basename(path) for path, _ in skipped} == {'b.png', 'c.png'}
+    assert all(image_path != output_path for image_path, output_path in jobs)
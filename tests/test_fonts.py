@@ -0,0 +1,25 @@
+"""
+字体索引：扫描字体目录时跟随符号链接，但不会因符号链接成环而无限递归
+"""
+
+import os
+
+import pytest
+
+from watermark_fonts import _iter_font_files
+
+
+def test_symlink_loops_are_scanned_once(tmp_path):
+    fonts = tmp_path / 'fonts'
+    (fonts / 'sub').mkdir(parents=True)
+    (fonts / 'a.ttf').write_bytes(b'')
+    (fonts / 'sub' / 'b.OTF').write_bytes(b'')
+    (fonts / 'readme.txt').write_bytes(b'')
+    try:
+        os.symlink(str(fonts), str(fonts / 'sub' / 'loop'), target_is_directory=True)
+        os.symlink(str(fonts / 'sub'), str(fonts / 'alias'), target_is_directory=True)
+    except (OSError, NotImplementedError):
+        pytest.skip("不支持符号链接")
+
+    found = sorted(os.path.basename(path) for path in _iter_font_files(str(fonts)))
+    assert found == ['a.ttf', 'b.OTF']
@@ -0,0 +1,127 @@
+"""
+增量导出清单：已是最新的文件跳过，原图、设置或输出变化后重新导出
+"""
+
+import json
+import os
+
+import pytest
+
+from conftest import make_image
+from watermark_encode import get_profile
+from watermark_export import export_batch, plan_jobs
+from watermark_manifest import (MANIFEST_NAME, ExportManifest, settings_digest,
+                                source_fingerprint)
+from watermark_render import WatermarkSpec
+from watermark_scan import iter_image_entries
+
+SPEC = WatermarkSpec(text='manifest')
+
+
+def export_with_manifest(photos, output, spec=SPEC, output_format='PNG', profile=None):
+    """按命令行的方式增量导出，返回 (导出的原图集合, 已是最新的数量)"""
+    profile = profile or get_profile('balanced')
+    jobs, _ = plan_jobs(iter_image_entries([photos]), output, output_format)
+    manifest = ExportManifest(output)
+    digest = settings_digest(spec, output_format, profile)
+    jobs, up_to_date = manifest.pending(jobs, digest)
+    exported = set()
+    for result in export_batch(jobs, output_format, spec, profile=profile, fingerprint=True):
+        assert result.error is None
+        manifest.record(result.image_path, result.output_path, digest, result.fingerprint)
+        exported.add(os.path.relpath(result.image_path, photos))
+    manifest.save()
+    return exported, up_to_date
+
+
+@pytest.fixture
+def output(tmp_path):
+    return str(tmp_path / 'out')
+
+
+def test_second_run_skips_everything(photos, output):
+    exported, up_to_date = export_with_manifest(photos, output)
+    assert len(exported) == 5 and up_to_date == 0
+    assert export_with_manifest(photos, output) == (set(), 5)
+
+
+def test_keys_are_relative_output_paths(photos, output):
+    export_with_manifest(photos, output)
+    with open(os.path.join(output, MANIFEST_NAME), encoding='utf-8') as f:
+        entries = json.load(f)['entries']
+    assert set(entries) == {'a_wm.png', 'b_wm.png', 'c_wm.png', 'sub/d_wm.png', 'sub/e_wm.png'}
+    source = os.path.abspath(os.path.join(photos, 'sub', 'd.jpg'))
+    assert entries['sub/d_wm.png']['source'] == source
+
+
+def test_changed_source_is_exported_again(photos, output):
+    export_with_manifest(photos, output)
+    make_image(os.path.join(photos, 'sub', 'd.jpg'), size=(200, 300), seed=42)
+    assert export_with_manifest(photos, output) == ({os.path.join('sub', 'd.jpg')}, 4)
+
+
+def test_touched_source_with_same_content_is_current(photos, output):
+    export_with_manifest(photos, output)
+    path = os.path.join(photos, 'a.jpg')
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 5 * 10 ** 9))
+    assert export_with_manifest(photos, output) == (set(), 5)
+
+    # 重新计算哈希后记录新的修改时间
+    manifest = ExportManifest(output)
+    assert manifest.entries['a_wm.png']['source_mtime_ns'] == os.stat(path).st_mtime_ns
+
+
+@pytest.mark.parametrize('change', [
+    dict(spec=WatermarkSpec(text='other')),
+    dict(output_format='PNG', profile=get_profile('archive')),
+])
+def test_changed_settings_export_everything(photos, output, change):
+    export_with_manifest(photos, output)
+    exported, up_to_date = export_with_manifest(photos, output, **change)
+    assert len(exported) == 5 and up_to_date == 0
+
+
+def test_changed_logo_content_changes_digest(tmp_path, logo):
+    spec = WatermarkSpec(type='image', image_path=logo)
+    profile = get_profile('balanced')
+    before = settings_digest(spec, 'PNG', profile)
+    make_image(logo, size=(60, 30), mode='RGBA', seed=7)
+    assert settings_digest(spec, 'PNG', profile) != before
+
+
+def test_missing_or_changed_output_is_exported_again(photos, output):
+    export_with_manifest(photos, output)
+    os.remove(os.path.join(output, 'a_wm.png'))
+    with open(os.path.join(output, 'sub', 'e_wm.png'), 'ab') as f:
+        f.write(b'\0')
+    exported, up_to_date = export_with_manifest(photos, output)
+    assert exported == {'a.jpg', os.path.join('sub', 'e.tif')} and up_to_date == 3
+
+
+def test_source_of_and_unreadable_manifest(photos, output):
+    export_with_manifest(photos, output)
+    manifest = ExportManifest(output)
+    assert manifest.source_of(os.path.join(output, 'b_wm.png')) == \
+        os.path.abspath(os.path.join(photos, 'b.png'))
+    assert manifest.source_of(os.path.join(output, 'x_wm.png')) is None
+
+    with open(manifest.path, 'w', encoding='utf-8') as f:
+        f.write('{broken')
+    assert ExportManifest(output).entries == {}
+
+
+def test_record_fingerprint_matches_source(photos):
+    path = os.path.join(photos, 'b.png')
+    fingerprint = source_fingerprint(path)
+    manifest = ExportManifest(photos)
+    manifest.record(path, path, 'digest', fingerprint)
+    assert manifest.is_current(path, path, 'digest')
+    assert not manifest.is_current(path, path, 'other')
+
+
+def test_export_results_carry_source_fingerprint(photos, output):
+    jobs, _ = plan_jobs(iter_image_entries([photos]), output, 'PNG')
+    for options in (dict(workers=1, pipeline=False), dict(workers=2)):
+        for result in export_batch(jobs, 'PNG', SPEC, fingerprint=True, **options):
+            assert result.fingerprint == source_fingerprint(result.image_path)
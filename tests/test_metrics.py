@@ -0,0 +1,37 @@
+"""
+导出统计：各阶段耗时和缓存命中计数
+"""
+
+from PIL import Image
+
+from watermark_metrics import ExportReport, collect, stage
+from watermark_render import Renderer, WatermarkSpec
+
+
+def test_stages_accumulate_only_inside_collect():
+    with stage('decode'):
+        pass
+    with collect() as metrics:
+        with stage('decode'):
+            pass
+        with stage('decode'):
+            pass
+    assert list(metrics.stages) == ['decode']
+    assert metrics.as_dict()['stages']['decode'] >= 0
+
+
+def test_render_reports_each_cache_once():
+    renderer = Renderer()
+    image = Image.new('RGB', (200, 100))
+    spec = WatermarkSpec(text='metrics')
+    report = ExportReport()
+    for _ in range(3):
+        with collect() as metrics:
+            renderer.render(image, spec)
+        report.add(metrics.as_dict())
+    assert metrics.counters == {'text_layer.hit': 1, 'overlay.hit': 1}
+    assert report.counters['text_layer.miss'] == 1
+    assert report.counters['text_layer.hit'] == 2
+    lines = report.lines()
+    assert "缓存 text_layer: 命中 2 / 未命中 1" in lines
+    assert any(line.startswith("吞吐量") for line in lines)
@@ -0,0 +1,130 @@
+"""
+预览调度：一帧内的请求合并，渲染期间的新请求覆盖旧请求，比已显示的新的结果都会显示，cancel 后的结果丢弃
+"""
+
+import threading
+import time
+
+from watermark_preview import PreviewScheduler
+
+
+class FakeRoot:
+    """代替 Tk 根窗口：after 只记录回调，由测试在“Tk 线程”（测试线程）中执行"""
+
+    def __init__(self):
+        self.callbacks = []
+
+    def after(self, ms, callback):
+        self.callbacks.append(callback)
+        return len(self.callbacks)
+
+    def run_pending(self):
+        callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def pump(self, until, timeout=5.0):
+        """反复执行回调直到 until() 为真"""
+        deadline = time.monotonic() + timeout
+        while not until():
+            assert time.monotonic() < deadline, "等待预览结果超时"
+            self.run_pending()
+            time.sleep(0.002)
+
+
+class Recorder:
+    """记录渲染和显示的任务；gates 中的任务在放行前阻塞渲染"""
+
+    def __init__(self):
+        self.rendered = []
+        self.published = []
+        self.started = {}
+        self.gates = {}
+        self.stale_seen = {}
+
+    def block(self, job):
+        self.started[job] = threading.Event()
+        self.gates[job] = threading.Event()
+
+    def render(self, job, is_stale):
+        self.rendered.append(job)
+        if job in self.gates:
+            self.started[job].set()
+            self.gates[job].wait(5)
+        self.stale_seen[job] = is_stale()
+        return f"result-{job}"
+
+    def publish(self, job, result):
+        self.published.append((job, result))
+
+
+def make_scheduler():
+    root, recorder = FakeRoot(), Recorder()
+    return root, recorder, PreviewScheduler(root, recorder.render, recorder.publish)
+
+
+def test_requests_within_a_frame_are_coalesced():
+    root, recorder, scheduler = make_scheduler()
+    for job in 'abc':
+        scheduler.request(job)
+    root.pump(lambda: recorder.published)
+    root.pump(lambda: not root.callbacks)
+    assert recorder.rendered == ['c']
+    assert recorder.published == [('c', 'result-c')]
+
+
+def test_newer_request_replaces_queued_one_and_results_keep_coming():
+    root, recorder, scheduler = make_scheduler()
+    recorder.block('a')
+    recorder.block('c')
+    scheduler.request('a')
+    root.run_pending()
+    assert recorder.started['a'].wait(5)
+
+    # a 渲染期间连续拖动：b 被 c 覆盖，a 完成后仍然显示（比已显示的新），最后显示 c
+    for job in 'bc':
+        scheduler.request(job)
+        root.run_pending()
+    recorder.gates['a'].set()
+    root.pump(lambda: recorder.published)
+    assert recorder.started['c'].wait(5)
+    recorder.gates['c'].set()
+    root.pump(lambda: len(recorder.published) == 2)
+    root.pump(lambda: not root.callbacks)
+    assert recorder.rendered == ['a', 'c']
+    assert [job for job, _ in recorder.published] == ['a', 'c']
+    assert recorder.stale_seen == {'a': False, 'c': False}
+
+
+def test_cancel_drops_running_render():
+    root, recorder, scheduler = make_scheduler()
+    recorder.block('a')
+    scheduler.request('a')
+    root.run_pending()
+    assert recorder.started['a'].wait(5)
+
+    scheduler.cancel()
+    recorder.gates['a'].set()
+    root.pump(lambda: not root.callbacks)
+    assert recorder.published == []
+    assert recorder.stale_seen == {'a': True}
+
+    scheduler.request('b')
+    root.pump(lambda: recorder.published)
+    assert recorder.published == [('b', 'result-b')]
+
+
+def test_render_errors_do_not_stop_the_worker():
+    root, recorder, scheduler = make_scheduler()
+
+    def render(job, is_stale):
+        if job == 'bad':
+            raise ValueError(job)
+        return recorder.render(job, is_stale)
+
+    scheduler.render = render
+    scheduler.request('bad')
+    root.pump(lambda: not root.callbacks)
+    scheduler.request('good')
+    root.pump(lambda: recorder.published)
+    assert recorder.published == [('good', 'result-good')]
@@ -0,0 +1,182 @@
+"""
+渲染：与整幅合成的参考结果逐像素比较，RenderPlan 与 WatermarkSpec 的结果一致
+"""
+
+import os
+
+import pytest
+from PIL import Image, ImageChops, ImageDraw, ImageFont
+
+from conftest import make_image
+from watermark_render import (Renderer, WatermarkSpec, calculate_position, has_chinese,
+                              rotate_layer)
+
+
+def max_difference(a, b):
+    """两张同尺寸图片逐通道的最大差值"""
+    assert a.size == b.size and a.mode == b.mode
+    return max(high for _, high in ImageChops.difference(a, b).getextrema())
+
+
+def reference_render(renderer, image, spec, scale_ratio=1.0):
+    """优化前的合成方式：新建整幅 fill 颜色的透明图层，以水印自身为蒙版粘贴，再整幅 alpha_composite"""
+    image = image.convert('RGBA')
+    found = renderer.layer(spec, scale_ratio)
+    if found is None:
+        return image
+    layer, fill = found
+    frame = Image.new('RGBA', image.size, fill)
+    if spec.tiled:
+        spacing = max(0, int(spec.tile_spacing * scale_ratio))
+        pitch_x, pitch_y = layer.width + spacing, layer.height + spacing
+        stagger = pitch_x * (spec.tile_stagger % 100) // 100
+        for index in range(image.height // pitch_y + 1):
+            shift = stagger if index % 2 else 0
+            for x in range(shift - pitch_x, image.width, pitch_x):
+                frame.paste(layer, (x + spacing // 2, index * pitch_y + spacing // 2), layer)
+    else:
+        x, y = calculate_position(spec, image.width, image.height,
+                                  layer.width, layer.height, scale_ratio)
+        if spec.type == 'text':
+            x = max(0, min(x, image.width - layer.width))
+            y = max(0, min(y, image.height - layer.height))
+        frame.paste(layer, (int(x), int(y)), layer)
+    return Image.alpha_composite(image, frame)
+
+
+def baseline_text_layer(text, font_size, color, opacity, rotation):
+    """优化前逐次绘制的英文文本图层（默认位图字体按整数倍放大）"""
+    font = ImageFont.load_default()
+    scale_factor = max(1, font_size // 11)
+    bbox = ImageDraw.Draw(Image.new('RGBA', (1, 1))).textbbox((0, 0), text, font=font)
+    layer = Image.new('RGBA', (bbox[2] - bbox[0] + 20, bbox[3] - bbox[1] + 20), (0, 0, 0, 0))
+    r, g, b = (int(color[i:i + 2], 16) for i in (1, 3, 5))
+    ImageDraw.Draw(layer).text((10, 10), text, font=font, fill=(r, g, b, int(opacity * 2.55)))
+    layer = layer.crop(layer.getbbox())
+    if scale_factor > 1:
+        layer = layer.resize((layer.width * scale_factor, layer.height * scale_factor),
+                             Image.Resampling.NEAREST)
+    if rotation:
+        layer = layer.rotate(-rotation, expand=True, resample=Image.Resampling.NEAREST)
+    return layer
+
+
+TEXT_SPECS = [
+    dict(text='Copyright 2024', position='bottom_right'),
+    dict(text='Hello', font_size=80, color='#FF8000', opacity=80, position='center', rotation=30),
+    dict(text='edge', position='top_left', offset_x=-40, offset_y=-40),
+    dict(text='custom', position='custom', offset_x=300, offset_y=230, rotation=-45),
+    dict(text='tiny', font_size=5, opacity=100, position='bottom_left'),
+    dict(text='tiled', tiled=True, tile_spacing=20, tile_stagger=50, rotation=15),
+]
+
+IMAGE_SPECS = [
+    dict(position='top_right', wm_scale=150, img_opacity=70),
+    dict(position='custom', offset_x=290, offset_y=220, rotation=60),
+    dict(position='middle_left', offset_x=-30, wm_scale=40),
+    dict(tiled=True, tile_spacing=5, tile_stagger=30, wm_scale=80),
+]
+
+
+def all_specs(logo):
+    specs = [WatermarkSpec.from_config(config) for config in TEXT_SPECS]
+    specs += [WatermarkSpec.from_config(dict(config, type='image', image_path=logo))
+              for config in IMAGE_SPECS]
+    return specs
+
+
+@pytest.fixture
+def source(tmp_path):
+    return Image.open(make_image(str(tmp_path / 'source.png'), mode='RGBA'))
+
+
+@pytest.mark.parametrize('scale_ratio', [1.0, 0.45])
+def test_render_matches_full_frame_composite(source, logo, scale_ratio):
+    renderer = Renderer(blend='pillow')
+    for spec in all_specs(logo):
+        expected = reference_render(renderer, source, spec, scale_ratio)
+        assert max_difference(renderer.render(source, spec, scale_ratio), expected) == 0, spec
+
+
+def test_render_rgb_matches_rgba_path(source, logo):
+    """keep_rgb 直接在 RGB 缓冲区上合成，与经 RGBA 合成后转 RGB 相同（numpy 后端误差不超过 1）"""
+    image = source.convert('RGB')
+    for blend, tolerance in (('pillow', 0), ('numpy', 1)):
+        renderer = Renderer(blend=blend)
+        for spec in all_specs(logo):
+            expected = reference_render(renderer, image, spec).convert('RGB')
+            result = renderer.render(image, spec, keep_rgb=True)
+            assert result.mode == 'RGB'
+            assert max_difference(result, expected) <= tolerance, (blend, spec)
+
+
+def test_render_does_not_modify_source(source, logo):
+    before = source.copy()
+    renderer = Renderer()
+    for spec in all_specs(logo):
+        renderer.render(source, spec)
+    assert max_difference(source, before) == 0
+
+
+def test_text_layer_matches_baseline():
+    renderer = Renderer()
+    for config in TEXT_SPECS:
+        spec = WatermarkSpec.from_config(config)
+        assert not has_chinese(spec.text)
+        font_size = max(10, spec.font_size)
+        layer, _ = renderer.layer(spec)
+        expected = baseline_text_layer(spec.text, font_size, spec.color, spec.opacity,
+                                       spec.rotation)
+        assert max_difference(layer, expected) == 0, spec
+
+
+def test_tiles_in_strips_match_whole_image(source):
+    renderer = Renderer(blend='pillow')
+    spec = WatermarkSpec.from_config(TEXT_SPECS[-1])
+    whole = renderer.render(source, spec)
+    for top in range(0, source.height, 37):
+        band = source.crop((0, top, source.width, min(source.height, top + 37)))
+        renderer.composite_tiles(band, spec, top=top)
+        expected = whole.crop((0, top, source.width, top + band.height))
+        assert max_difference(band, expected) == 0, top
+
+
+@pytest.mark.parametrize('scale_ratio', [1.0, 0.37])
+def test_plan_matches_spec(source, logo, scale_ratio):
+    renderer = Renderer()
+    for spec in all_specs(logo):
+        plan = renderer.compile(spec)
+        expected = renderer.render(source, spec, scale_ratio)
+        assert max_difference(renderer.render(source, plan, scale_ratio), expected) == 0, spec
+
+
+def test_plan_keeps_logo_after_file_is_renamed(tmp_path, source, logo):
+    renderer = Renderer()
+    spec = WatermarkSpec(type='image', image_path=logo, position='center')
+    plan = renderer.compile(spec)
+    expected = renderer.render(source, spec)
+    os.rename(logo, str(tmp_path / 'moved.png'))
+    renderer.image_layers.clear()
+    assert max_difference(renderer.render(source, plan), expected) == 0
+    assert max_difference(renderer.render(source, plan, 0.5), source) > 0
+    # 直接使用设置时水印图片已不存在，不添加水印
+    assert max_difference(renderer.render(source, spec), source) == 0
+
+
+def test_missing_text_or_logo_returns_copy(source):
+    renderer = Renderer()
+    for spec in (WatermarkSpec(text=''), WatermarkSpec(type='image', image_path='missing.png')):
+        result = renderer.render(source, spec)
+        assert result is not source
+        assert max_difference(result, source) == 0
+
+
+def test_invalid_color_raises(source):
+    with pytest.raises(ValueError):
+        Renderer().render(source, WatermarkSpec(text='abc', color='red'))
+
+
+def test_rotate_layer_keeps_size_without_rotation():
+    layer = Image.new('RGBA', (10, 4), (255, 0, 0, 255))
+    assert rotate_layer(layer, 0, Image.Resampling.NEAREST) is layer
+    assert rotate_layer(layer, 90, Image.Resampling.NEAREST).size == (4, 10)
@@ -0,0 +1,166 @@
+"""
+HTTP 水印服务：各种请求的状态码，返回的图片与直接导出的结果相同
+"""
+
+import http.client
+import io
+import json
+import socket
+from urllib.parse import quote
+
+import pytest
+
+from conftest import make_image
+from watermark_encode import get_profile
+from watermark_export import encode_export
+from watermark_render import WatermarkSpec
+from watermark_server import start_server
+from watermark_templates import TemplateStore
+
+
+@pytest.fixture(scope='module')
+def templates_file(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('server') / 'templates.json')
+    TemplateStore(path).save('版权', {'text': 'Copyright', 'position': 'center',
+                                     'encoder_profile': 'fast'})
+    return path
+
+
+@pytest.fixture(scope='module')
+def server(templates_file):
+    server = start_server(templates_file=templates_file, workers=2)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def photo(tmp_path):
+    with open(make_image(str(tmp_path / 'photo.jpg'), quality=90), 'rb') as f:
+        return f.read()
+
+
+def request(server, method, path, body=None, headers=None):
+    """发送请求，返回 (状态码, 响应头, 响应体)"""
+    host, port = server.server_address
+    conn = http.client.HTTPConnection(host, port, timeout=30)
+    try:
+        conn.request(method, path, body=body, headers=headers or {})
+        response = conn.getresponse()
+        return response.status, response.headers, response.read()
+    finally:
+        conn.close()
+
+
+def watermark_path(**query):
+    return '/watermark?' + '&'.join(f"{key}={quote(str(value))}" for key, value in query.items())
+
+
+def test_health_and_unknown_paths(server):
+    assert request(server, 'GET', '/healthz')[0] == 200
+    assert request(server, 'GET', '/nothing')[0] == 404
+    assert request(server, 'POST', '/nothing', b'x')[0] == 404
+
+
+def test_template_result_matches_export(server, templates_file, photo):
+    status, headers, body = request(server, 'POST', watermark_path(template='版权'), photo)
+    assert status == 200
+    assert headers['Content-Type'] == 'image/jpeg'
+
+    template = TemplateStore(templates_file).template('版权')
+    expected, _ = encode_export(io.BytesIO(photo), 'JPEG', template.spec, template.profile)
+    assert body == expected
+
+
+def test_inline_spec_in_query_and_header(server, photo):
+    config = {'text': '版权 WM', 'color': '#FF0000', 'encoder_profile': 'archive'}
+    expected, _ = encode_export(io.BytesIO(photo), 'PNG', WatermarkSpec.from_config(config),
+                                get_profile('archive'))
+    raw = json.dumps(config, ensure_ascii=False)
+    for path, headers in (
+            (watermark_path(spec=raw, format='png'), {}),
+            (watermark_path(format='PNG'), {'X-Watermark-Spec': raw.encode('utf-8')}),
+            (watermark_path(format='PNG'), {'X-Watermark-Spec': quote(raw)})):
+        status, response_headers, body = request(server, 'POST', path, photo, headers)
+        assert status == 200, body
+        assert response_headers['Content-Type'] == 'image/png'
+        assert body == expected
+
+
+@pytest.mark.parametrize('path, headers, status', [
+    (watermark_path(), {}, 400),
+    (watermark_path(template='版权', spec='{}'), {}, 400),
+    (watermark_path(template='missing'), {}, 404),
+    (watermark_path(spec='{"color": "red"}'), {}, 400),
+    (watermark_path(spec='{"opacity": 500}'), {}, 400),
+    (watermark_path(spec='not json'), {}, 400),
+    (watermark_path(spec='[1]'), {}, 400),
+    (watermark_path(spec='{"encoder_profile": "tiny"}'), {}, 400),
+    (watermark_path(template='版权', profile='tiny'), {}, 400),
+    (watermark_path(template='版权', format='GIF'), {}, 400),
+    (watermark_path(), {'X-Watermark-Spec': b'{"text": "\xff"}'}, 400),
+    (watermark_path(spec='{"font_size": 1e999}'), {}, 400),
+    (watermark_path(spec='{"position": "custom", "offset_x": NaN}'), {}, 400),
+    (watermark_path(spec='{"offset_y": -Infinity}'), {}, 400),
+])
+def test_invalid_requests(server, photo, path, headers, status):
+    assert request(server, 'POST', path, photo, headers)[0] == status
+
+
+def test_image_spec_needs_a_readable_logo(server, photo, logo, tmp_path):
+    not_image = tmp_path / 'notes.txt'
+    not_image.write_text('not an image', encoding='utf-8')
+    for path in (str(tmp_path / 'missing.png'), str(not_image), ''):
+        spec = json.dumps({'type': 'image', 'image_path': path})
+        status, _, body = request(server, 'POST', watermark_path(spec=spec), photo)
+        assert status == 400
+        message = json.loads(body)['error']
+        assert 'image_path' in message
+        assert str(tmp_path) not in message
+
+    config = {'type': 'image', 'image_path': logo, 'position': 'center'}
+    status, _, body = request(server, 'POST', watermark_path(spec=json.dumps(config)), photo)
+    assert status == 200
+    expected, _ = encode_export(io.BytesIO(photo), 'JPEG', WatermarkSpec.from_config(config),
+                                get_profile(None))
+    assert body == expected
+
+
+def test_invalid_bodies(server):
+    path = watermark_path(template='版权')
+    assert request(server, 'POST', path, b'not an image')[0] == 400
+    assert request(server, 'POST', path, b'')[0] == 400
+
+
+def test_busy_service_returns_503(server, photo):
+    service = server.service
+    for _ in range(service.capacity):
+        assert service._slots.acquire(blocking=False)
+    try:
+        status, headers, _ = request(server, 'POST', watermark_path(template='版权'), photo)
+        assert status == 503
+        assert headers['Retry-After'] == '1'
+
+        # 繁忙时不等待接收请求体
+        with socket.create_connection(server.server_address, timeout=10) as sock:
+            sock.sendall(f"POST {watermark_path(template='版权')} HTTP/1.1\r\n"
+                         f"Host: test\r\nContent-Length: {100 * 1024 * 1024}\r\n\r\n"
+                         .encode('ascii'))
+            assert sock.recv(64).startswith(b'HTTP/1.1 503')
+    finally:
+        for _ in range(service.capacity):
+            service._slots.release()
+    assert request(server, 'POST', watermark_path(template='版权'), photo)[0] == 200
+
+
+def test_metrics_count_requests(server, photo):
+    before = json.loads(request(server, 'GET', '/metrics')[2])['statuses']
+    request(server, 'POST', watermark_path(template='版权'), photo)
+    request(server, 'POST', watermark_path(template='missing'), photo)
+    status, _, body = request(server, 'GET', '/metrics')
+    assert status == 200
+    metrics = json.loads(body)
+    for code in ('200', '404'):
+        assert metrics['statuses'][code] == before.get(code, 0) + 1
+    assert metrics['in_flight'] == 0
+    assert 'composite' in metrics['stages_ms']
@@ -0,0 +1,48 @@
+"""
+超大 TIFF 分块导出：与整幅加载导出的结果逐像素相同
+"""
+
+import pytest
+from PIL import Image, ImageChops
+
+import watermark_stream
+from conftest import make_image
+from watermark_encode import get_profile
+from watermark_export import export_image
+from watermark_render import WatermarkSpec
+
+SPECS = {
+    'text': WatermarkSpec(text='Sample', font_size=48, rotation=20, position='center'),
+    'tiled': WatermarkSpec(text='tile', tiled=True, tile_spacing=30),
+}
+
+
+@pytest.mark.parametrize('compression', [None, 'tiff_lzw', 'tiff_deflate'])
+@pytest.mark.parametrize('kind', list(SPECS))
+def test_tiff_stream_matches_in_memory_export(tmp_path, monkeypatch, compression, kind):
+    source = make_image(str(tmp_path / 'big.tif'), size=(300, 700), compression=compression,
+                        rowsperstrip=64)
+    spec = SPECS[kind]
+    profile = get_profile('balanced')
+
+    in_memory = str(tmp_path / 'memory.png')
+    export_image(source, in_memory, 'PNG', spec, profile)
+    assert watermark_stream.open_stream_source(source, 'PNG') is None
+
+    monkeypatch.setattr(watermark_stream, 'STREAM_MIN_PIXELS', 1)
+    assert watermark_stream.open_stream_source(source, 'PNG') is not None
+    streamed = str(tmp_path / 'stream.png')
+    export_image(source, streamed, 'PNG', spec, profile)
+
+    with Image.open(in_memory) as expected, Image.open(streamed) as result:
+        assert result.size == expected.size
+        assert ImageChops.difference(result.convert('RGBA'),
+                                     expected.convert('RGBA')).getbbox() is None
+
+
+def test_other_formats_are_not_streamed(tmp_path, monkeypatch):
+    monkeypatch.setattr(watermark_stream, 'STREAM_MIN_PIXELS', 1)
+    source = make_image(str(tmp_path / 'big.tif'))
+    assert watermark_stream.open_stream_source(source, 'JPEG') is None
+    png = make_image(str(tmp_path / 'big.png'))
+    assert watermark_stream.open_stream_source(png, 'PNG') is None
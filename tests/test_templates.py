@@ -0,0 +1,140 @@
+"""
+模板库：设置校验、按文件变化重新读取、保存时保留无效模板和其他程序写入的模板
+"""
+
+import json
+import os
+
+import pytest
+
+from watermark_render import RenderPlan, WatermarkSpec
+from watermark_templates import TemplateStore, settings_hash, validate_template
+
+
+@pytest.mark.parametrize('config, message', [
+    ([], "JSON 对象"),
+    ({'type': 'video'}, "未知的水印类型"),
+    ({'color': 'red'}, "#RRGGBB"),
+    ({'color': 123}, "#RRGGBB"),
+    ({'position': 'nowhere'}, "未知的位置"),
+    ({'offset_x': 'left'}, "offset_x"),
+    ({'offset_y': True}, "offset_y"),
+    ({'font_size': 0}, "font_size"),
+    ({'opacity': 101}, "opacity"),
+    ({'font_size': 'big'}, "数值设置无效"),
+    ({'text': 5}, "必须是字符串"),
+    ({'encoder_profile': 'tiny'}, "未知的编码配置"),
+    ({'encoder_profile': ['fast']}, "未知的编码配置"),
+    ({'font_size': float('inf')}, "数值设置无效"),
+    ({'rotation': float('-inf')}, "数值设置无效"),
+    ({'opacity': float('nan')}, "数值设置无效"),
+    ({'offset_x': float('nan')}, "有限的数字"),
+    ({'offset_y': float('inf')}, "有限的数字"),
+])
+def test_validate_template_rejects(config, message):
+    with pytest.raises(ValueError, match=message):
+        validate_template(config)
+
+
+def test_validate_template_fills_defaults():
+    settings = validate_template({'text': 'abc', 'font_size': 20.6, 'encoder_profile': 'fast'})
+    assert settings == dict(WatermarkSpec(text='abc', font_size=20).to_config(),
+                            encoder_profile='fast')
+    assert validate_template({})['encoder_profile'] is None
+
+
+def write_templates(path, templates):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(templates, f, ensure_ascii=False)
+
+
+@pytest.fixture
+def templates_file(tmp_path):
+    path = str(tmp_path / 'templates.json')
+    write_templates(path, {
+        '版权': {'text': 'copyright', 'encoder_profile': 'archive'},
+        'bad': {'color': 'blue'},
+    })
+    return path
+
+
+def test_store_skips_invalid_templates(templates_file):
+    store = TemplateStore(templates_file)
+    assert store.names() == ['版权']
+    assert 'bad' in store.errors
+    with pytest.raises(KeyError, match="无效"):
+        store.template('bad')
+    with pytest.raises(KeyError, match="不存在"):
+        store.get('missing')
+
+
+def test_out_of_range_numbers_do_not_break_the_store(tmp_path):
+    path = tmp_path / 'templates.json'
+    path.write_text('{"huge": {"font_size": 1e999}, "nan": {"position": "custom", '
+                    '"offset_x": NaN}, "ok": {"text": "ok"}}', encoding='utf-8')
+    store = TemplateStore(str(path))
+    assert store.names() == ['ok']
+    assert set(store.errors) == {'huge', 'nan'}
+
+
+def test_template_is_compiled_once(templates_file):
+    store = TemplateStore(templates_file)
+    template = store.template('版权')
+    assert isinstance(template.plan, RenderPlan)
+    assert template.spec == WatermarkSpec(text='copyright')
+    assert template.profile.name == 'archive'
+    assert store.template('版权') is template
+    assert template.digest == settings_hash(store.get('版权'))
+
+
+def test_store_reloads_changed_file(templates_file):
+    store = TemplateStore(templates_file)
+    first = store.template('版权')
+    assert not store.refresh()
+
+    write_templates(templates_file, {'版权': {'text': 'copyright', 'encoder_profile': 'archive'},
+                                     'new': {'text': 'new one'}})
+    os.utime(templates_file, ns=(0, os.stat(templates_file).st_mtime_ns + 10 ** 9))
+    assert store.names() == ['版权', 'new']
+    # 内容没变的模板沿用原来的编译结果
+    assert store.template('版权') is first
+    assert store.errors == {}
+
+
+def test_save_keeps_other_and_invalid_templates(templates_file):
+    store = TemplateStore(templates_file)
+    store.names()
+    other = TemplateStore(templates_file)
+    other.save('other', {'text': 'from another program'})
+
+    saved = store.save('mine', {'text': 'mine', 'opacity': 80})
+    assert saved['opacity'] == 80
+    with open(templates_file, encoding='utf-8') as f:
+        raw = json.load(f)
+    assert list(raw) == ['版权', 'bad', 'other', 'mine']
+    assert raw['bad'] == {'color': 'blue'}
+    assert not [name for name in os.listdir(os.path.dirname(templates_file))
+                if name.endswith('.tmp')]
+
+    with pytest.raises(ValueError):
+        store.save('broken', {'opacity': 500})
+    assert 'broken' not in store.names()
+
+
+def test_missing_or_unreadable_file(tmp_path):
+    assert TemplateStore(str(tmp_path / 'missing.json')).names() == []
+    path = tmp_path / 'broken.json'
+    path.write_text('[1, 2]', encoding='utf-8')
+    assert TemplateStore(str(path)).names() == []
+
+
+def test_compile_all_reads_logos(tmp_path, logo):
+    path = str(tmp_path / 'templates.json')
+    write_templates(path, {'logo': {'type': 'image', 'image_path': logo},
+                           'missing': {'type': 'image', 'image_path': logo + '.gone'},
+                           'text': {'text': 'ok'}})
+    store = TemplateStore(path)
+    assert store.compile_all() == {}
+    assert store.template('logo').plan.logo is not None
+    # 水印图片不存在时与界面一致：不添加水印
+    assert store.template('missing').plan.layer is None
@@ -0,0 +1,145 @@
+"""
+热文件夹：写入完成的图片按子文件夹结构导出，已导出和失败的图片不重复处理
+"""
+
+import os
+import threading
+import time
+
+import pytest
+
+import watermark_watch
+from conftest import make_image
+from watermark_encode import get_profile
+from watermark_render import WatermarkSpec
+from watermark_scan import path_key
+from watermark_watch import HotFolder, PollingWatcher
+
+SPEC = WatermarkSpec(text='watch')
+
+
+def images_in(folder):
+    return sorted(os.path.relpath(os.path.join(root, name), folder).replace(os.sep, '/')
+                  for root, _, files in os.walk(folder) for name in files
+                  if not name.startswith('.'))
+
+
+def hot_folder(photos, output, **options):
+    options.setdefault('poll', True)
+    return HotFolder([photos], output, 'PNG', SPEC, get_profile('fast'), **options)
+
+
+def all_images(photos):
+    return [os.path.join(root, name) for root, _, files in os.walk(photos) for name in files]
+
+
+def test_export_mirrors_subfolders_and_skips_exported(tmp_path, photos):
+    output = str(tmp_path / 'out')
+    folder = hot_folder(photos, output)
+    try:
+        results, up_to_date = folder.export(all_images(photos))
+        assert [result.error for result in results] == [None] * 5 and up_to_date == 0
+        assert images_in(output) == ['a_wm.png', 'b_wm.png', 'c_wm.png',
+                                     'sub/d_wm.png', 'sub/e_wm.png']
+    finally:
+        folder.close()
+
+    # 重启后清单中已导出的图片跳过
+    folder = hot_folder(photos, output)
+    try:
+        assert folder.export(all_images(photos)) == ([], 5)
+    finally:
+        folder.close()
+
+
+def test_conflicts_and_failures_are_not_retried(tmp_path, photos):
+    output = str(tmp_path / 'out')
+    folder = hot_folder(photos, output)
+    try:
+        folder.export([os.path.join(photos, 'a.jpg')])
+        other = make_image(os.path.join(photos, 'a.png'), seed=11)
+        broken = os.path.join(photos, 'broken.jpg')
+        with open(broken, 'wb') as f:
+            f.write(b'not an image')
+
+        results, _ = folder.export([other, broken])
+        assert [result.image_path for result in results] == [broken]
+        assert results[0].error
+        assert set(folder.failed) == {other, broken}
+    finally:
+        folder.close()
+
+
+def test_polling_watcher_sees_new_files_in_new_subfolders(tmp_path, photos):
+    output = os.path.join(photos, 'out')
+    os.makedirs(output)
+    make_image(os.path.join(output, 'old_wm.png'))
+    watcher = PollingWatcher([photos], exclude={path_key(output)}, interval=0)
+    assert len(watcher.scan()) == 5
+    assert watcher.changes(0) == []
+
+    time.sleep(0.01)
+    new = make_image(os.path.join(photos, 'sub', 'deeper', 'new.png'))
+    assert watcher.changes(0) == [new]
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_run_exports_settled_images(tmp_path, photos, monkeypatch, workers):
+    monkeypatch.setattr(watermark_watch, 'BATCH_WINDOW', 0.05)
+    monkeypatch.setattr(watermark_watch, 'CHECK_INTERVAL', 0.02)
+    output = str(tmp_path / 'out')
+    folder = hot_folder(photos, output, workers=workers, settle=0.1, interval=0.05)
+    stop = threading.Event()
+    batches = []
+
+    def on_batch(results, up_to_date):
+        batches.append((results, up_to_date))
+        if sum(len(results) for results, _ in batches) >= 6:
+            stop.set()
+
+    thread = threading.Thread(target=folder.run, args=(stop, on_batch))
+    thread.start()
+    try:
+        deadline = time.monotonic() + 30
+        while len(images_in(output)) < 5 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        make_image(os.path.join(photos, 'sub', 'late.jpg'), seed=12)
+        thread.join(30)
+        assert not thread.is_alive()
+    finally:
+        stop.set()
+        thread.join(30)
+        folder.close()
+
+    assert all(result.error is None for results, _ in batches for result in results)
+    assert 'sub/late_wm.png' in images_in(output)
+
+
+
+class CrashInWorker:
+    """子进程反序列化导出参数时直接退出，模拟导出时子进程崩溃（如内存不足被杀）"""
+
+    def __reduce__(self):
+        return os._exit, (1,)
+
+
+def test_pool_is_recreated_after_a_worker_dies(tmp_path, photos):
+    output = str(tmp_path / 'out')
+    folder = hot_folder(photos, output, workers=2)
+    images = sorted(all_images(photos))
+    try:
+        results, _ = folder.export(images[:1])
+        assert results[0].error is None
+        pool, profile = folder.pool, folder.profile
+
+        folder.profile = CrashInWorker()
+        results, _ = folder.export(images[1:3])
+        assert len(results) == 2 and all(result.error for result in results)
+        assert set(folder.failed) == set(images[1:3])
+        assert folder.pool is not pool
+
+        folder.profile = profile
+        results, _ = folder.export(images[3:])
+        assert [result.error for result in results] == [None, None]
+    finally:
+        folder.close()
@@ -6,11 +6,141 @@ Photo Watermark Tool - 图片水印工具
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, colorchooser
 from tkinterdnd2 import DND_FILES, TkinterDnD
-from PIL import Image, ImageDraw, ImageFont, ImageTk
+from PIL import ImageTk
 import os
+import collections
 import json
-from pathlib import Path
-import traceback
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+
+from watermark_encode import (DEFAULT_PROFILE, ENCODER_PROFILES, OUTPUT_FORMATS, EncodeSummary,
+                              get_profile)
+from watermark_export import default_workers, export_batch, plan_jobs
+from watermark_io import write_json_atomic
+from watermark_manifest import ExportManifest, settings_digest
+from watermark_metrics import ExportReport, configure_logging
+from watermark_preview import DEFAULT_PREVIEW_CACHE_MB, PreviewBaseCache, PreviewScheduler
+from watermark_render import WatermarkSpec, calculate_position, get_renderer
+from watermark_scan import iter_image_entries, path_key
+from watermark_templates import LAST_CONFIG_NAME, TemplateStore, app_file, validate_template
+from watermark_thumbs import DEFAULT_THUMB_CACHE_MB, ThumbnailCache, ThumbnailLoader
+
+logger = logging.getLogger(__name__)
+
+# 分批导入图片：每批最多插入的行数和占用事件循环的时间
+IMPORT_CHUNK_SIZE = 2000
+IMPORT_STEP_SECONDS = 0.03
+
+# 后台扫描线程至少每隔多久（秒）交出一批结果，扫描大文件夹时列表尽早开始显示
+IMPORT_SCAN_FLUSH_SECONDS = 0.05
+
+# 扫描结果还没到时再次检查的间隔（毫秒）
+IMPORT_WAIT_MS = 20
+
+
+class ThumbnailStrip:
+    """横向缩略图条：只为滚动到可见范围内的图片生成和显示缩略图"""
+
+    CELL_PADDING = 6
+
+    def __init__(self, parent, cache, on_select):
+        self.cache = cache
+        self.on_select = on_select
+        self.cell = cache.size[0] + self.CELL_PADDING * 2
+        self.paths = []
+        self.items = {}  # index -> (path, 画布对象, PhotoImage)
+        self.selected = None
+
+        self.canvas = tk.Canvas(parent, height=cache.size[1] + self.CELL_PADDING * 2,
+                                bg='#2b2b2b', highlightthickness=0)
+        scrollbar = ttk.Scrollbar(parent, orient=tk.HORIZONTAL, command=self.on_scroll)
+        self.canvas.configure(xscrollcommand=scrollbar.set)
+        self.canvas.pack(fill=tk.X)
+        scrollbar.pack(fill=tk.X)
+
+        self.canvas.bind('<Configure>', lambda e: self.refresh())
+        self.canvas.bind('<Button-1>', self.on_click)
+        self.selection_rect = self.canvas.create_rectangle(0, 0, 0, 0, outline='#4a9eff', width=2,
+                                                           state=tk.HIDDEN)
+
+        self.loader = ThumbnailLoader(parent, cache, self.on_thumbnail)
+
+    def set_paths(self, paths):
+        """更新图片列表（新增的图片追加在末尾）"""
+        self.paths = paths
+        self.canvas.configure(scrollregion=(0, 0, len(paths) * self.cell, 0))
+        self.refresh()
+
+    def clear(self):
+        """清空缩略图"""
+        for _, item, _ in self.items.values():
+            self.canvas.delete(item)
+        self.items = {}
+        self.selected = None
+        self.canvas.itemconfigure(self.selection_rect, state=tk.HIDDEN)
+        self.set_paths([])
+
+    def on_scroll(self, *args):
+        self.canvas.xview(*args)
+        self.refresh()
+
+    def visible_range(self):
+        """当前可见（含左右各一屏预取）的图片序号范围"""
+        width = max(self.canvas.winfo_width(), self.cell)
+        left = self.canvas.canvasx(0)
+        first = max(0, int(left // self.cell) - width // self.cell)
+        last = min(len(self.paths), int((left + width) // self.cell) + 1 + width // self.cell)
+        return first, last
+
+    def refresh(self):
+        """释放可见范围外的缩略图，请求生成可见范围内缺少的缩略图"""
+        first, last = self.visible_range()
+        for index in [i for i in self.items if not first <= i < last]:
+            self.canvas.delete(self.items.pop(index)[1])
+
+        missing = [(i, self.paths[i]) for i in range(first, last)
+                   if i not in self.items or self.items[i][0] != self.paths[i]]
+        self.loader.request(missing)
+
+    def on_thumbnail(self, index, path, image):
+        """缩略图生成后显示（仍在可见范围内才显示）"""
+        first, last = self.visible_range()
+        if not first <= index < last or index >= len(self.paths) or self.paths[index] != path:
+            return
+        if index in self.items:
+            self.canvas.delete(self.items[index][1])
+
+        photo = ImageTk.PhotoImage(image)
+        x = index * self.cell + self.cell // 2
+        item = self.canvas.create_image(x, self.CELL_PADDING + self.cache.size[1] // 2,
+                                        image=photo, anchor=tk.CENTER)
+        self.items[index] = (path, item, photo)
+        self.canvas.tag_raise(self.selection_rect)
+
+    def on_click(self, event):
+        index = int(self.canvas.canvasx(event.x) // self.cell)
+        if 0 <= index < len(self.paths):
+            self.on_select(index)
+
+    def set_selected(self, index):
+        """高亮选中的图片，并滚动到可见位置"""
+        self.selected = index
+        x0 = index * self.cell + 2
+        self.canvas.coords(self.selection_rect, x0, 2, x0 + self.cell - 4,
+                           self.cache.size[1] + self.CELL_PADDING * 2 - 2)
+        self.canvas.itemconfigure(self.selection_rect, state=tk.NORMAL)
+
+        if self.paths:
+            left = self.canvas.canvasx(0)
+            width = self.canvas.winfo_width()
+            if index * self.cell < left or (index + 1) * self.cell > left + width:
+                self.canvas.xview_moveto(max(0, index * self.cell - width // 2 + self.cell // 2)
+                                         / (len(self.paths) * self.cell))
+                self.refresh()
+
 
 class WatermarkApp:
     def __init__(self, root):
@@ -20,15 +150,35 @@ class WatermarkApp:
 
         # 数据存储
         self.images = []  # 存储图片路径
+        self.image_keys = set()  # 已导入图片的路径索引（去重）
+        self.image_folders = {}  # 文件夹导入的图片 -> 相对导入文件夹的子文件夹（导出时保持目录结构）
+        self.import_jobs = []  # 正在分批导入的任务
+        self.import_after_id = None
         self.current_image_index = 0
         self.watermark_config = self.default_config()
-        self.templates_file = "watermark_templates.json"
+        self.templates = TemplateStore()  # 模板库（程序文件夹中的模板文件，修改后自动重新读取）
+        self.last_config_file = app_file(LAST_CONFIG_NAME)
 
         # 缩放和位置相关
         self.current_scale_ratio = 1.0
         self.last_calculated_x = 50
         self.last_calculated_y = 50
 
+        # 预览底图缓存
+        self.preview_cache_mb = DEFAULT_PREVIEW_CACHE_MB
+        self.preview_cache = PreviewBaseCache(self.preview_cache_mb)
+
+        # 后台预览渲染（与串行导出共用同一个渲染器及其图层缓存）
+        self.renderer = get_renderer()
+        self.preview_canvas_size = None
+        self.preview_result = None  # 最近显示的 (job, result)，拖拽时复用其底图
+        self.drag_sprite = None
+        self.preview_scheduler = PreviewScheduler(self.root, self.render_preview, self.show_preview)
+
+        # 磁盘缩略图缓存
+        self.thumb_cache_mb = DEFAULT_THUMB_CACHE_MB
+        self.thumb_cache = ThumbnailCache(max_mb=self.thumb_cache_mb)
+
         # 创建UI
         self.create_ui()
 
@@ -116,10 +266,18 @@ class WatermarkApp:
         format_row.pack(fill=tk.X, pady=2)
         ttk.Label(format_row, text="格式:").pack(side=tk.LEFT)
         self.output_format = tk.StringVar(value='PNG')
-        ttk.Radiobutton(format_row, text="PNG", variable=self.output_format,
-                       value='PNG').pack(side=tk.LEFT, padx=5)
-        ttk.Radiobutton(format_row, text="JPEG", variable=self.output_format,
-                       value='JPEG').pack(side=tk.LEFT)
+        for output_format in OUTPUT_FORMATS:
+            ttk.Radiobutton(format_row, text=output_format, variable=self.output_format,
+                           value=output_format).pack(side=tk.LEFT, padx=(5, 0))
+
+        # 编码配置（速度与文件大小的取舍）
+        profile_row = ttk.Frame(export_frame)
+        profile_row.pack(fill=tk.X, pady=2)
+        ttk.Label(profile_row, text="编码:").pack(side=tk.LEFT)
+        self.encoder_profile = tk.StringVar(value=DEFAULT_PROFILE)
+        for profile in ENCODER_PROFILES.values():
+            ttk.Radiobutton(profile_row, text=profile.label, variable=self.encoder_profile,
+                           value=profile.name).pack(side=tk.LEFT, padx=(5, 0))
 
         # 文件命名
         ttk.Label(export_frame, text="文件名:").pack(anchor=tk.W, pady=(5, 0))
@@ -138,6 +296,24 @@ class WatermarkApp:
         self.custom_affix.insert(0, "_wm")
         self.custom_affix.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
 
+        # 并行导出进程数（1 为串行）
+        workers_row = ttk.Frame(export_frame)
+        workers_row.pack(fill=tk.X, pady=2)
+        ttk.Label(workers_row, text="进程数:").pack(side=tk.LEFT)
+        self.export_workers = tk.IntVar(value=default_workers())
+        ttk.Spinbox(workers_row, from_=1, to=64, textvariable=self.export_workers,
+                   width=6).pack(side=tk.LEFT, padx=5)
+
+        # 增量导出：跳过导出清单中原图和设置都没有变化的文件
+        self.skip_unchanged = tk.BooleanVar(value=True)
+        ttk.Checkbutton(export_frame, text="跳过未变化的图片",
+                       variable=self.skip_unchanged).pack(anchor=tk.W, pady=2)
+
+        # 性能统计
+        self.show_export_report = tk.BooleanVar(value=False)
+        ttk.Checkbutton(export_frame, text="导出后显示性能统计",
+                       variable=self.show_export_report).pack(anchor=tk.W, pady=2)
+
         # 导出按钮
         ttk.Button(export_frame, text="导出所有图片",
                   command=self.export_images).pack(fill=tk.X, pady=(5, 0))
@@ -146,6 +322,11 @@ class WatermarkApp:
         center_panel = ttk.Frame(main_container)
         center_panel.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=5)
 
+        # 缩略图条（先放在底部，预览区占用剩余空间）
+        thumb_frame = ttk.LabelFrame(center_panel, text="缩略图", padding=5)
+        thumb_frame.pack(side=tk.BOTTOM, fill=tk.X, pady=(5, 0))
+        self.thumb_strip = ThumbnailStrip(thumb_frame, self.thumb_cache, self.select_image)
+
         preview_frame = ttk.LabelFrame(center_panel, text="预览 (实时)", padding=10)
         preview_frame.pack(fill=tk.BOTH, expand=True)
 
@@ -154,6 +335,7 @@ class WatermarkApp:
         self.preview_canvas.pack(fill=tk.BOTH, expand=True)
         self.preview_canvas.bind('<Button-1>', self.on_canvas_click)
         self.preview_canvas.bind('<B1-Motion>', self.on_canvas_drag)
+        self.preview_canvas.bind('<ButtonRelease-1>', self.on_canvas_release)
 
         # 右侧面板 - 水印设置和导出
         right_panel = ttk.Frame(main_container, width=350)
@@ -275,12 +457,29 @@ class WatermarkApp:
                                   variable=self.rotation, command=lambda e: self.update_preview())
         rotation_scale.pack(fill=tk.X)
 
+        # 平铺（整幅重复水印，忽略预设位置和拖拽）
+        self.tiled = tk.BooleanVar(value=False)
+        ttk.Checkbutton(position_frame, text="平铺整幅图片", variable=self.tiled,
+                       command=self.update_preview).pack(anchor=tk.W, pady=(10, 0))
+
+        ttk.Label(position_frame, text="平铺间距:").pack(anchor=tk.W, pady=(5, 0))
+        self.tile_spacing = tk.IntVar(value=100)
+        tile_spacing_scale = ttk.Scale(position_frame, from_=0, to=500,
+                                      variable=self.tile_spacing, command=lambda e: self.update_preview())
+        tile_spacing_scale.pack(fill=tk.X)
+
+        ttk.Label(position_frame, text="隔行错开 (%):").pack(anchor=tk.W, pady=(5, 0))
+        self.tile_stagger = tk.IntVar(value=50)
+        tile_stagger_scale = ttk.Scale(position_frame, from_=0, to=100,
+                                      variable=self.tile_stagger, command=lambda e: self.update_preview())
+        tile_stagger_scale.pack(fill=tk.X)
+
     def select_images(self):
         """选择图片"""
         files = filedialog.askopenfilenames(
             title="选择图片",
             filetypes=[
-                ("图片文件", "*.jpg *.jpeg *.png *.bmp *.tiff"),
+                ("图片文件", "*.jpg *.jpeg *.png *.bmp *.tiff *.tif"),
                 ("所有文件", "*.*")
             ]
         )
@@ -288,63 +487,139 @@ class WatermarkApp:
             self.add_images(files)
 
     def select_folder(self):
-        """选择文件夹"""
+        """选择文件夹（包括子文件夹）"""
         folder = filedialog.askdirectory(title="选择文件夹")
         if folder:
-            image_files = []
-            for ext in ['*.jpg', '*.jpeg', '*.png', '*.bmp', '*.tiff', '*.JPG', '*.JPEG', '*.PNG']:
-                image_files.extend(Path(folder).glob(ext))
-            if image_files:
-                self.add_images([str(f) for f in image_files])
-            else:
-                messagebox.showinfo("提示", "文件夹中没有找到图片文件")
+            def on_done(added):
+                if not added:
+                    messagebox.showinfo("提示", "文件夹中没有找到图片文件")
+            self.import_images(iter_image_entries([folder]), on_done)
 
     def add_images(self, files):
         """添加图片到列表"""
-        for file in files:
-            if file not in self.images:
-                self.images.append(file)
-                self.image_listbox.insert(tk.END, os.path.basename(file))
-
-        if self.images:
-            self.image_listbox.selection_clear(0, tk.END)
-            self.image_listbox.selection_set(0)
-            self.current_image_index = 0
-            self.update_preview()
+        self.import_images((file, '') for file in files)
+
+    def import_images(self, paths, on_done=None):
+        """分批导入 (图片路径, 相对文件夹)（可以是边扫描边产出的迭代器）
+
+        迭代（扫描文件夹）在后台线程中进行，结果经队列交给 import_step 分批插入列表，
+        扫描和导入期间界面保持响应；on_done(added) 在全部导入后调用，added 为新增的图片数量
+        """
+        job = {'queue': queue.Queue(), 'chunk': collections.deque(), 'on_done': on_done,
+               'added': 0, 'cancelled': threading.Event()}
+        threading.Thread(target=self.scan_import, args=(paths, job),
+                         name='image-import', daemon=True).start()
+        self.import_jobs.append(job)
+        if self.import_after_id is None:
+            self.import_after_id = self.root.after(0, self.import_step)
+
+    @staticmethod
+    def scan_import(paths, job):
+        """遍历要导入的图片（后台线程），按批放入 job['queue']，结束时放入 None"""
+        chunk = []
+        flushed = time.perf_counter()
+        try:
+            for path, subfolder in paths:
+                if job['cancelled'].is_set():
+                    return
+                path = str(path)
+                chunk.append((path, subfolder, path_key(path)))
+                if (len(chunk) >= IMPORT_CHUNK_SIZE or
+                        time.perf_counter() - flushed >= IMPORT_SCAN_FLUSH_SECONDS):
+                    job['queue'].put(chunk)
+                    chunk = []
+                    flushed = time.perf_counter()
+        except Exception:
+            logger.exception("扫描图片错误")
+        finally:
+            if chunk:
+                job['queue'].put(chunk)
+            job['queue'].put(None)
+
+    def import_step(self):
+        """取出后台扫描到的一批图片插入列表，然后让出事件循环"""
+        self.import_after_id = None
+        deadline = time.perf_counter() + IMPORT_STEP_SECONDS
+        names = []
+        finished = []
+        waiting = False
+        was_empty = not self.images
+
+        while self.import_jobs and len(names) < IMPORT_CHUNK_SIZE and time.perf_counter() < deadline:
+            job = self.import_jobs[0]
+            if not job['chunk']:
+                try:
+                    chunk = job['queue'].get_nowait()
+                except queue.Empty:
+                    waiting = True  # 扫描还在进行
+                    break
+                if chunk is None:
+                    finished.append(self.import_jobs.pop(0))
+                    continue
+                job['chunk'].extend(chunk)
+
+            path, subfolder, key = job['chunk'].popleft()
+            if key in self.image_keys:
+                continue
+            self.image_keys.add(key)
+            self.images.append(path)
+            if subfolder:
+                self.image_folders[path] = subfolder
+            names.append(os.path.basename(path))
+            job['added'] += 1
+
+        if names:
+            self.image_listbox.insert(tk.END, *names)
+            self.thumb_strip.set_paths(self.images)
+            if was_empty:
+                self.select_image(0)
+
+        if self.import_jobs:
+            self.import_after_id = self.root.after(IMPORT_WAIT_MS if waiting else 1,
+                                                   self.import_step)
+
+        for job in finished:
+            if job['on_done']:
+                job['on_done'](job['added'])
 
     def clear_images(self):
         """清空图片列表"""
+        for job in self.import_jobs:
+            job['cancelled'].set()
+        self.import_jobs = []
         self.images = []
+        self.image_keys = set()
+        self.image_folders = {}
+        self.preview_scheduler.cancel()
+        self.preview_result = None
+        self.preview_cache.clear()
         self.image_listbox.delete(0, tk.END)
+        self.thumb_strip.clear()
         self.preview_canvas.delete('all')
         self.current_image_index = 0
 
     def on_drop(self, event):
-        """处理拖拽事件"""
-        files = self.root.tk.splitlist(event.data)
-        image_files = []
-
-        for file in files:
-            file = file.strip('{}')
-            if os.path.isdir(file):
-                # 如果是文件夹，递归查找图片
-                for ext in ['*.jpg', '*.jpeg', '*.png', '*.bmp', '*.tiff', '*.JPG', '*.JPEG', '*.PNG']:
-                    image_files.extend(Path(file).glob(ext))
-            elif os.path.isfile(file):
-                # 检查是否是图片文件
-                if file.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp', '.tiff')):
-                    image_files.append(file)
-
-        if image_files:
-            self.add_images([str(f) for f in image_files])
+        """处理拖拽事件（文件夹递归查找图片）"""
+        files = [file.strip('{}') for file in self.root.tk.splitlist(event.data)]
+        self.import_images(iter_image_entries(files))
 
     def on_image_select(self, event):
         """切换预览图片"""
         selection = self.image_listbox.curselection()
         if selection:
             self.current_image_index = selection[0]
+            self.thumb_strip.set_selected(self.current_image_index)
             self.update_preview()
 
+    def select_image(self, index):
+        """点击缩略图切换预览图片"""
+        self.image_listbox.selection_clear(0, tk.END)
+        self.image_listbox.selection_set(index)
+        self.image_listbox.see(index)
+        self.current_image_index = index
+        self.thumb_strip.set_selected(index)
+        self.update_preview()
+
     def select_watermark_image(self):
         """选择水印图片"""
         file = filedialog.askopenfilename(
@@ -376,11 +651,15 @@ class WatermarkApp:
         """记录鼠标点击位置"""
         self.drag_start_x = event.x
         self.drag_start_y = event.y
+        self.drag_sprite = None
 
     def on_canvas_drag(self, event):
         """拖拽水印"""
         if not hasattr(self, 'drag_start_x') or not hasattr(self, 'current_scale_ratio'):
             return
+        # 平铺水印没有单独的位置
+        if self.tiled.get():
+            return
 
         try:
             # 计算偏移（考虑图片缩放）
@@ -413,296 +692,181 @@ class WatermarkApp:
             self.drag_start_y = event.y
 
             self.watermark_config['position'] = 'custom'
+
+            # 拖拽时只移动单独显示的水印，松开鼠标后再完整合成
+            if self.drag_sprite is None:
+                self.drag_sprite = self.start_drag_sprite()
+            if self.drag_sprite:
+                self.move_drag_sprite()
+            else:
+                self.update_preview()
+        except Exception:
+            logger.exception("拖拽错误")
+
+    def on_canvas_release(self, event):
+        """结束拖拽，重新完整渲染预览"""
+        if self.drag_sprite:
+            self.drag_sprite = None
             self.update_preview()
-        except Exception as e:
-            print(f"拖拽错误: {e}")
-            traceback.print_exc()
 
-    def update_preview(self):
-        """更新预览"""
-        if not self.images or self.current_image_index >= len(self.images):
-            return
+    def start_drag_sprite(self):
+        """把预览拆成不带水印的底图和单独的水印画布对象，返回拖拽状态；无法拆分时返回 False"""
+        if self.preview_result is None:
+            return False
+
+        job, result = self.preview_result
+        if (self.current_image_index >= len(self.images) or
+                job['image_path'] != self.images[self.current_image_index]):
+            return False
+
+        base = result['base']
+        ratio = result['ratio']
+        overlay = self.renderer.overlay(base.size, self.get_watermark_spec(), ratio)
+        if overlay is None:
+            return False
+        overlay_img, _ = overlay
+
+        # 拖拽开始前尚未显示的渲染已经过时
+        self.preview_scheduler.cancel()
+
+        left, top = self.preview_origin(job, base)
+        self.photo = ImageTk.PhotoImage(base)
+        self.drag_photo = ImageTk.PhotoImage(overlay_img)
+        self.preview_canvas.delete('all')
+        self.preview_canvas.create_image(left, top, image=self.photo, anchor=tk.NW)
+        item = self.preview_canvas.create_image(left, top, image=self.drag_photo, anchor=tk.NW)
 
-        try:
-            # 加载原图
-            image_path = self.images[self.current_image_index]
-            original = Image.open(image_path)
+        return {
+            'item': item,
+            'origin': (left, top),
+            'image_size': base.size,
+            'overlay_size': overlay_img.size,
+            'ratio': ratio,
+        }
 
-            # 保持纵横比缩放以适应预览区
-            canvas_width = self.preview_canvas.winfo_width()
-            canvas_height = self.preview_canvas.winfo_height()
+    def move_drag_sprite(self):
+        """按当前自定义位置移动水印画布对象"""
+        sprite = self.drag_sprite
+        img_width, img_height = sprite['image_size']
+        wm_width, wm_height = sprite['overlay_size']
+        x, y = calculate_position(self.get_watermark_spec(), img_width, img_height,
+                                  wm_width, wm_height, sprite['ratio'])
+        left, top = sprite['origin']
+        self.preview_canvas.coords(sprite['item'], left + int(x), top + int(y))
+
+    def preview_origin(self, job, image):
+        """预览图在画布中居中显示时左上角的坐标"""
+        return ((job['canvas_width'] - image.width) // 2,
+                (job['canvas_height'] - image.height) // 2)
 
-            if canvas_width < 100:  # 初始化时
-                canvas_width = 800
-                canvas_height = 600
+    def update_preview(self):
+        """更新预览（短时间内的多次调用合并为一次，在后台线程渲染）"""
+        if not self.images or self.current_image_index >= len(self.images):
+            return
 
-            # 计算缩放比例
-            ratio = min(canvas_width / original.width, canvas_height / original.height)
-            ratio = min(ratio, 1.0)  # 不放大
+        # 预览区尺寸
+        canvas_width = self.preview_canvas.winfo_width()
+        canvas_height = self.preview_canvas.winfo_height()
 
-            # 保存当前缩放比例供拖拽使用
-            self.current_scale_ratio = ratio
+        if canvas_width < 100:  # 初始化时
+            canvas_width = 800
+            canvas_height = 600
 
-            new_width = int(original.width * ratio)
-            new_height = int(original.height * ratio)
+        # 渲染所需的全部参数在 Tk 线程中取好，后台线程不访问 Tk 变量
+        self.preview_scheduler.request({
+            'image_path': self.images[self.current_image_index],
+            'canvas_width': canvas_width,
+            'canvas_height': canvas_height,
+            'spec': self.get_watermark_spec(),
+        })
 
-            display_img = original.resize((new_width, new_height), Image.Resampling.LANCZOS)
+    def render_preview(self, job, is_stale):
+        """渲染预览图（后台线程）"""
+        try:
+            # 保持纵横比缩放后的底图（命中缓存时不再解码原图）
+            display_img, ratio = self.preview_cache.get(
+                job['image_path'], job['canvas_width'], job['canvas_height'])
+            if is_stale():
+                return None
+
+            # 添加水印，同时计算水印在原图中的位置（用于拖拽）
+            spec = job['spec']
+            try:
+                watermarked = self.renderer.render(display_img, spec, ratio)
+                position = self.renderer.locate(display_img.size, spec, ratio)
+            except Exception:
+                # 水印无法绘制时仍然显示原图
+                logger.exception("添加%s水印错误", "文本" if spec.type == 'text' else "图片")
+                watermarked, position = display_img, None
+
+            return {
+                'image': watermarked,
+                'base': display_img,
+                'ratio': ratio,
+                'position': position,
+            }
+
+        except Exception:
+            logger.exception("预览错误")
+            return None
+
+    def show_preview(self, job, result):
+        """显示渲染好的预览图（Tk 线程）"""
+        self.preview_result = (job, result)
+
+        # 拖拽中画布由 start_drag_sprite 接管
+        if self.drag_sprite:
+            return
 
-            # 添加水印
-            watermarked = self.add_watermark(display_img, ratio)
+        try:
+            # 保存当前缩放比例和水印位置供拖拽使用
+            self.current_scale_ratio = result['ratio']
+            if result['position'] is not None:
+                self.last_calculated_x, self.last_calculated_y = result['position']
 
             # 显示
-            self.photo = ImageTk.PhotoImage(watermarked)
+            self.photo = ImageTk.PhotoImage(result['image'])
             self.preview_canvas.delete('all')
             self.preview_canvas.create_image(
-                canvas_width // 2, canvas_height // 2,
-                image=self.photo, anchor=tk.CENTER
+                *self.preview_origin(job, result['image']),
+                image=self.photo, anchor=tk.NW
             )
 
-        except Exception as e:
-            print(f"预览错误: {e}")
-            traceback.print_exc()
-
-    def add_watermark(self, image, scale_ratio=1.0):
-        """添加水印到图片"""
-        # 转换为RGBA以支持透明度
-        if image.mode != 'RGBA':
-            image = image.convert('RGBA')
-
-        wm_type = self.watermark_type.get()
-
-        if wm_type == 'text':
-            return self.add_text_watermark(image, scale_ratio)
-        else:
-            return self.add_image_watermark(image, scale_ratio)
-
-    def has_chinese(self, text):
-        """检测文本中是否包含中文字符"""
-        for char in text:
-            if '\u4e00' <= char <= '\u9fff':
-                return True
-        return False
-
-    def load_chinese_font(self, size):
-        """尝试加载支持中文的字体"""
-        font_paths = [
-            "C:\\Windows\\Fonts\\msyh.ttc",      # 微软雅黑
-            "C:\\Windows\\Fonts\\msyhbd.ttc",    # 微软雅黑粗体
-            "C:\\Windows\\Fonts\\simhei.ttf",    # 黑体
-            "C:\\Windows\\Fonts\\simsun.ttc",    # 宋体
-            "C:\\Windows\\Fonts\\simkai.ttf",    # 楷体
-            "C:\\Windows\\Fonts\\simfang.ttf",   # 仿宋
-        ]
-
-        for font_path in font_paths:
-            try:
-                if os.path.exists(font_path):
-                    font = ImageFont.truetype(font_path, size)
-                    print(f"使用字体: {font_path}")
-                    return font
-            except Exception as e:
-                continue
-
-        return None
+        except Exception:
+            logger.exception("预览错误")
 
-    def add_text_watermark(self, image, scale_ratio=1.0):
-        """添加文本水印 - 支持中英文"""
-        try:
-            # 获取文本
-            text = self.text_entry.get()
-            if not text:
-                return image
-
-            # 获取用户设置的字体大小
-            user_font_size = int(self.font_size.get() * scale_ratio)
-            if user_font_size < 10:
-                user_font_size = 10
-
-            # 检测是否包含中文
-            has_cn = self.has_chinese(text)
-
-            # 选择字体
-            if has_cn:
-                # 中文：尝试加载系统中文字体
-                font = self.load_chinese_font(user_font_size)
-                if font is None:
-                    print("警告: 无法加载中文字体，中文可能无法显示")
-                    font = ImageFont.load_default()
-                    scale_factor = max(1, user_font_size // 11)
-                else:
-                    scale_factor = 1  # TrueType字体已经是正确大小
-            else:
-                # 英文：使用默认位图字体并放大
-                font = ImageFont.load_default()
-                scale_factor = max(1, user_font_size // 11)
-
-            # 创建临时画布来测量文本
-            temp_img = Image.new('RGBA', (1, 1))
-            temp_draw = ImageDraw.Draw(temp_img)
-            bbox = temp_draw.textbbox((0, 0), text, font=font)
-            base_text_width = bbox[2] - bbox[0]
-            base_text_height = bbox[3] - bbox[1]
-
-            if base_text_width <= 0 or base_text_height <= 0:
-                print(f"文本大小无效: {base_text_width}x{base_text_height}")
-                return image
-
-            # 创建文本图层（留出足够空间）
-            text_layer = Image.new('RGBA', (base_text_width + 20, base_text_height + 20), (0, 0, 0, 0))
-            draw = ImageDraw.Draw(text_layer)
-
-            # 颜色和透明度
-            color = self.color_var.get()
-            r = int(color[1:3], 16)
-            g = int(color[3:5], 16)
-            b = int(color[5:7], 16)
-            opacity = int(self.opacity.get() * 2.55)
-
-            # 绘制文本
-            draw.text((10, 10), text, font=font, fill=(r, g, b, opacity))
-
-            # 裁剪到实际内容
-            bbox = text_layer.getbbox()
-            if not bbox:
-                print("文本bbox为空")
-                return image
-
-            text_layer = text_layer.crop(bbox)
-
-            # 如果是位图字体，需要放大
-            if scale_factor > 1:
-                scaled_width = text_layer.width * scale_factor
-                scaled_height = text_layer.height * scale_factor
-                if scaled_width > 0 and scaled_height > 0:
-                    text_layer = text_layer.resize(
-                        (scaled_width, scaled_height),
-                        Image.Resampling.NEAREST
-                    )
-
-            # 旋转
-            rotation = self.rotation.get()
-            if rotation != 0:
-                # 中文用BICUBIC，英文用NEAREST保持像素风格
-                resample = Image.Resampling.BICUBIC if has_cn else Image.Resampling.NEAREST
-                text_layer = text_layer.rotate(-rotation, expand=True, resample=resample)
-
-            # 计算位置
-            wm_width = text_layer.width
-            wm_height = text_layer.height
-            x, y = self.calculate_position(image.width, image.height, wm_width, wm_height, scale_ratio)
-
-            # 确保位置不超出边界
-            x = int(max(0, min(x, image.width - wm_width)))
-            y = int(max(0, min(y, image.height - wm_height)))
-
-            # 创建最终图层并粘贴
-            final_layer = Image.new('RGBA', image.size, (0, 0, 0, 0))
-            final_layer.paste(text_layer, (x, y), text_layer)
-
-            # 合并到原图
-            result = Image.alpha_composite(image, final_layer)
-
-            print(f"文本水印已添加: '{text}' at ({x}, {y}), size: {wm_width}x{wm_height}, 中文: {has_cn}")
-            return result
-
-        except Exception as e:
-            print(f"添加文本水印错误: {e}")
-            import traceback
-            traceback.print_exc()
-            return image
-
-    def add_image_watermark(self, image, scale_ratio=1.0):
-        """添加图片水印"""
-        wm_path = self.watermark_config.get('image_path', '')
-        if not wm_path or not os.path.exists(wm_path):
-            return image
+    def on_window_resize(self, event):
+        """窗口大小变化时更新预览（移动窗口等不改变预览区大小的事件忽略）"""
+        if event.widget != self.root:
+            return
+        size = (self.preview_canvas.winfo_width(), self.preview_canvas.winfo_height())
+        if size != self.preview_canvas_size:
+            self.preview_canvas_size = size
+            self.update_preview()
 
-        try:
-            # 加载水印图片
-            watermark = Image.open(wm_path)
-            if watermark.mode != 'RGBA':
-                watermark = watermark.convert('RGBA')
-
-            # 缩放水印
-            scale = self.wm_scale.get() / 100.0 * scale_ratio
-            wm_width = int(watermark.width * scale)
-            wm_height = int(watermark.height * scale)
-            watermark = watermark.resize((wm_width, wm_height), Image.Resampling.LANCZOS)
-
-            # 调整透明度
-            opacity = self.img_opacity.get() / 100.0
-            alpha = watermark.split()[3]
-            alpha = alpha.point(lambda p: int(p * opacity))
-            watermark.putalpha(alpha)
-
-            # 旋转
-            rotation = self.rotation.get()
-            if rotation != 0:
-                watermark = watermark.rotate(-rotation, expand=True, resample=Image.Resampling.BICUBIC)
-
-            # 计算位置
-            x, y = self.calculate_position(image.width, image.height,
-                                          watermark.width, watermark.height, scale_ratio)
-
-            # 创建透明图层
-            txt_layer = Image.new('RGBA', image.size, (255, 255, 255, 0))
-            txt_layer.paste(watermark, (int(x), int(y)), watermark)
-
-            # 合并
-            result = Image.alpha_composite(image, txt_layer)
-            return result
-
-        except Exception as e:
-            print(f"添加图片水印错误: {e}")
-            return image
-
-    def calculate_position(self, img_width, img_height, wm_width, wm_height, scale_ratio=1.0):
-        """计算水印位置"""
-        position = self.watermark_config.get('position', 'bottom_right')
-
-        # 如果是自定义位置，使用原始图片坐标，然后根据缩放比例调整
-        if position == 'custom':
-            x_original = int(self.watermark_config.get('offset_x', 50))
-            y_original = int(self.watermark_config.get('offset_y', 50))
-
-            # 根据缩放比例调整位置（用于预览）
-            x = int(x_original * scale_ratio)
-            y = int(y_original * scale_ratio)
-
-            # 确保位置在图片范围内
-            x = max(0, min(x, img_width - max(1, wm_width)))
-            y = max(0, min(y, img_height - max(1, wm_height)))
-
-            # 保存计算的位置（用于拖拽）
-            self.last_calculated_x = x_original
-            self.last_calculated_y = y_original
-
-            return (x, y)
-
-        # 预设位置的偏移量需要根据缩放比例调整
-        offset_x = int(self.watermark_config.get('offset_x', 50) * scale_ratio)
-        offset_y = int(self.watermark_config.get('offset_y', 50) * scale_ratio)
-
-        positions = {
-            'top_left': (offset_x, offset_y),
-            'top_center': ((img_width - wm_width) // 2, offset_y),
-            'top_right': (img_width - wm_width - offset_x, offset_y),
-            'middle_left': (offset_x, (img_height - wm_height) // 2),
-            'center': ((img_width - wm_width) // 2, (img_height - wm_height) // 2),
-            'middle_right': (img_width - wm_width - offset_x, (img_height - wm_height) // 2),
-            'bottom_left': (offset_x, img_height - wm_height - offset_y),
-            'bottom_center': ((img_width - wm_width) // 2, img_height - wm_height - offset_y),
-            'bottom_right': (img_width - wm_width - offset_x, img_height - wm_height - offset_y),
+    def get_watermark_settings(self):
+        """收集当前水印设置（普通字典，即模板文件中保存的格式）"""
+        return {
+            'type': self.watermark_type.get(),
+            'text': self.text_entry.get(),
+            'font_size': self.font_size.get(),
+            'color': self.color_var.get(),
+            'opacity': self.opacity.get(),
+            'position': self.watermark_config['position'],
+            'offset_x': self.watermark_config.get('offset_x', 50),
+            'offset_y': self.watermark_config.get('offset_y', 50),
+            'rotation': self.rotation.get(),
+            'image_path': self.watermark_config.get('image_path', ''),
+            'wm_scale': self.wm_scale.get(),
+            'img_opacity': self.img_opacity.get(),
+            'tiled': self.tiled.get(),
+            'tile_spacing': self.tile_spacing.get(),
+            'tile_stagger': self.tile_stagger.get()
         }
 
-        result = positions.get(position, positions['bottom_right'])
-
-        # 保存计算的位置（转换回原始坐标）
-        if scale_ratio > 0:
-            self.last_calculated_x = int(result[0] / scale_ratio)
-            self.last_calculated_y = int(result[1] / scale_ratio)
-
-        return result
+    def get_watermark_spec(self):
+        """当前水印设置的不可变快照（WatermarkSpec）"""
+        return WatermarkSpec.from_config(self.get_watermark_settings())
 
     def export_images(self):
         """导出所有图片"""
@@ -724,6 +888,38 @@ class WatermarkApp:
         # 导出格式
         output_format = self.output_format.get()
 
+        # 水印设置快照和输出路径在主进程中确定，子进程不访问 Tk 变量
+        spec = self.get_watermark_spec()
+        profile = get_profile(self.encoder_profile.get())
+
+        # 文件夹导入的图片按子文件夹结构输出；会写到同一个输出文件的图片跳过
+        entries = ((image_path, self.image_folders.get(image_path, ''))
+                   for image_path in self.images)
+        jobs, conflicts = plan_jobs(entries, output_folder, output_format,
+                                    self.filename_rule.get(), self.custom_affix.get())
+        if conflicts:
+            details = "\n".join(f"{os.path.basename(image_path)}: {reason}"
+                                for image_path, reason in conflicts[:10])
+            if len(conflicts) > 10:
+                details += f"\n……共 {len(conflicts)} 张"
+            if not jobs:
+                messagebox.showwarning("警告", f"图片的输出文件冲突，没有可导出的图片:\n{details}")
+                return
+            if not messagebox.askyesno(
+                    "警告", f"以下图片的输出文件冲突，将被跳过:\n{details}\n\n是否导出其余图片？"):
+                return
+
+        # 增量导出：已按相同原图和设置导出过的文件不再导出
+        manifest = ExportManifest(output_folder)
+        digest = settings_digest(spec, output_format, profile)
+        up_to_date = 0
+        if self.skip_unchanged.get():
+            jobs, up_to_date = manifest.pending(jobs, digest)
+            if not jobs:
+                manifest.save()
+                messagebox.showinfo("完成", f"全部 {up_to_date} 张图片已是最新，无需导出")
+                return
+
         # 进度窗口
         progress_window = tk.Toplevel(self.root)
         progress_window.title("导出进度")
@@ -736,67 +932,56 @@ class WatermarkApp:
 
         progress_bar = ttk.Progressbar(progress_window, length=350, mode='determinate')
         progress_bar.pack(pady=10)
-        progress_bar['maximum'] = len(self.images)
+        progress_bar['maximum'] = len(jobs)
+
+        try:
+            workers = int(self.export_workers.get())
+        except (tk.TclError, ValueError):
+            workers = 1
 
         success_count = 0
         error_count = 0
+        summary = EncodeSummary()
+        report = ExportReport()
 
-        for i, image_path in enumerate(self.images):
-            try:
-                # 加载原图
-                original = Image.open(image_path)
-
-                # 添加水印
-                watermarked = self.add_watermark(original, scale_ratio=1.0)
-
-                # 转换为RGB（如果导出为JPEG）
-                if output_format == 'JPEG':
-                    watermarked = watermarked.convert('RGB')
-
-                # 生成输出文件名
-                output_filename = self.generate_output_filename(image_path, output_format)
-                output_path = os.path.join(output_folder, output_filename)
-
-                # 保存
-                if output_format == 'JPEG':
-                    watermarked.save(output_path, 'JPEG', quality=95)
+        results = export_batch(jobs, output_format, spec, workers, profile, fingerprint=True)
+        try:
+            for i, result in enumerate(results):
+                if result.error is None:
+                    success_count += 1
+                    summary.add(result.stats)
+                    report.add(result.metrics)
+                    manifest.record(result.image_path, result.output_path, digest,
+                                    result.fingerprint)
+                    manifest.save_if_due()
                 else:
-                    watermarked.save(output_path, 'PNG')
-
-                success_count += 1
-
-            except Exception as e:
-                print(f"导出错误 {image_path}: {e}")
-                error_count += 1
+                    logger.error("导出错误 %s: %s", result.image_path, result.error)
+                    error_count += 1
 
-            # 更新进度
-            progress_bar['value'] = i + 1
-            progress_label.config(text=f"正在导出 {i+1}/{len(self.images)}")
-            progress_window.update()
+                # 更新进度
+                progress_bar['value'] = i + 1
+                progress_label.config(text=f"正在导出 {i+1}/{len(jobs)}")
+                progress_window.update()
+        finally:
+            # 导出中断时也保存已完成的部分，下次接着导出
+            manifest.save()
 
         progress_window.destroy()
+        report.finish()
+        for line in report.lines():
+            logger.info("导出统计 %s", line)
 
         # 显示结果
-        messagebox.showinfo("完成",
-                           f"导出完成！\n成功: {success_count}\n失败: {error_count}")
-
-    def generate_output_filename(self, original_path, output_format):
-        """生成输出文件名"""
-        basename = os.path.basename(original_path)
-        name, _ = os.path.splitext(basename)
-
-        rule = self.filename_rule.get()
-        custom = self.custom_affix.get()
-
-        if rule == 'original':
-            new_name = name
-        elif rule == 'prefix':
-            new_name = custom + name
-        else:  # suffix
-            new_name = name + custom
-
-        ext = '.jpg' if output_format == 'JPEG' else '.png'
-        return new_name + ext
+        message = f"导出完成！\n成功: {success_count}\n失败: {error_count}"
+        if conflicts:
+            message += f"\n输出文件冲突（跳过）: {len(conflicts)}"
+        if up_to_date:
+            message += f"\n已是最新（跳过）: {up_to_date}"
+        if summary.lines():
+            message += "\n\n" + "\n".join(summary.lines())
+        if self.show_export_report.get() and report.images:
+            message += "\n\n" + "\n".join(report.lines())
+        messagebox.showinfo("完成", message)
 
     def save_template(self):
         """保存模板"""
@@ -804,152 +989,155 @@ class WatermarkApp:
         if not template_name:
             return
 
-        # 收集当前配置
-        config = {
-            'type': self.watermark_type.get(),
-            'text': self.text_entry.get(),
-            'font_size': self.font_size.get(),
-            'color': self.color_var.get(),
-            'opacity': self.opacity.get(),
-            'position': self.watermark_config['position'],
-            'offset_x': self.watermark_config.get('offset_x', 50),
-            'offset_y': self.watermark_config.get('offset_y', 50),
-            'rotation': self.rotation.get(),
-            'image_path': self.watermark_config.get('image_path', ''),
-            'wm_scale': self.wm_scale.get(),
-            'img_opacity': self.img_opacity.get()
-        }
-
-        # 加载现有模板
-        templates = {}
-        if os.path.exists(self.templates_file):
-            try:
-                with open(self.templates_file, 'r', encoding='utf-8') as f:
-                    templates = json.load(f)
-            except:
-                pass
-
-        # 添加新模板
-        templates[template_name] = config
+        # 收集当前配置（包括导出编码配置）
+        config = self.get_watermark_settings()
+        config['encoder_profile'] = self.encoder_profile.get()
 
-        # 保存
-        with open(self.templates_file, 'w', encoding='utf-8') as f:
-            json.dump(templates, f, ensure_ascii=False, indent=2)
+        try:
+            self.templates.save(template_name, config)
+        except (OSError, ValueError) as e:
+            messagebox.showerror("错误", f"保存模板失败: {e}")
+            return
 
         messagebox.showinfo("成功", f"模板 '{template_name}' 已保存")
 
     def load_template(self):
         """加载模板"""
-        if not os.path.exists(self.templates_file):
+        names = self.templates.names()
+        if not names:
             messagebox.showinfo("提示", "没有保存的模板")
             return
 
-        try:
-            with open(self.templates_file, 'r', encoding='utf-8') as f:
-                templates = json.load(f)
-
-            if not templates:
-                messagebox.showinfo("提示", "没有保存的模板")
-                return
-
-            # 显示模板列表
-            template_window = tk.Toplevel(self.root)
-            template_window.title("选择模板")
-            template_window.geometry("300x400")
-            template_window.transient(self.root)
-
-            ttk.Label(template_window, text="选择一个模板:").pack(pady=10)
-
-            listbox = tk.Listbox(template_window)
-            listbox.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+        # 显示模板列表
+        template_window = tk.Toplevel(self.root)
+        template_window.title("选择模板")
+        template_window.geometry("300x400")
+        template_window.transient(self.root)
 
-            for name in templates.keys():
-                listbox.insert(tk.END, name)
+        ttk.Label(template_window, text="选择一个模板:").pack(pady=10)
 
-            def apply_template():
-                selection = listbox.curselection()
-                if not selection:
-                    return
+        listbox = tk.Listbox(template_window)
+        listbox.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
 
-                template_name = listbox.get(selection[0])
-                config = templates[template_name]
-
-                # 应用配置
-                self.watermark_type.set(config.get('type', 'text'))
-                self.text_entry.delete(0, tk.END)
-                self.text_entry.insert(0, config.get('text', ''))
-                self.font_size.set(config.get('font_size', 36))
-                self.color_var.set(config.get('color', '#FFFFFF'))
-                self.color_display.config(bg=config.get('color', '#FFFFFF'))
-                self.opacity.set(config.get('opacity', 50))
-                self.rotation.set(config.get('rotation', 0))
-                self.wm_scale.set(config.get('wm_scale', 100))
-                self.img_opacity.set(config.get('img_opacity', 50))
-
-                self.watermark_config['position'] = config.get('position', 'bottom_right')
-                self.watermark_config['offset_x'] = config.get('offset_x', 50)
-                self.watermark_config['offset_y'] = config.get('offset_y', 50)
-                self.watermark_config['image_path'] = config.get('image_path', '')
-
-                if self.watermark_config['image_path']:
-                    self.wm_image_label.config(
-                        text=os.path.basename(self.watermark_config['image_path']),
-                        foreground='black'
-                    )
+        for name in names:
+            listbox.insert(tk.END, name)
 
-                self.update_preview()
-                template_window.destroy()
-                messagebox.showinfo("成功", f"已加载模板 '{template_name}'")
+        def apply_template():
+            selection = listbox.curselection()
+            if not selection:
+                return
 
-            ttk.Button(template_window, text="应用", command=apply_template).pack(pady=10)
+            template_name = listbox.get(selection[0])
+            try:
+                config = self.templates.get(template_name)
+            except KeyError as e:
+                messagebox.showerror("错误", f"加载模板失败: {e.args[0]}")
+                return
 
-        except Exception as e:
-            messagebox.showerror("错误", f"加载模板失败: {e}")
+            # 应用配置
+            self.apply_settings(config)
+            self.update_preview()
+            template_window.destroy()
+            messagebox.showinfo("成功", f"已加载模板 '{template_name}'")
+
+        ttk.Button(template_window, text="应用", command=apply_template).pack(pady=10)
+
+    def apply_settings(self, config):
+        """把水印设置（模板或上次配置，已补全默认值）应用到界面控件"""
+        self.watermark_type.set(config['type'])
+        self.text_entry.delete(0, tk.END)
+        self.text_entry.insert(0, config['text'])
+        self.font_size.set(config['font_size'])
+        self.color_var.set(config['color'])
+        self.color_display.config(bg=config['color'])
+        self.opacity.set(config['opacity'])
+        self.rotation.set(config['rotation'])
+        self.wm_scale.set(config['wm_scale'])
+        self.img_opacity.set(config['img_opacity'])
+        self.tiled.set(config['tiled'])
+        self.tile_spacing.set(config['tile_spacing'])
+        self.tile_stagger.set(config['tile_stagger'])
+        if config.get('encoder_profile') in ENCODER_PROFILES:
+            self.encoder_profile.set(config['encoder_profile'])
+
+        self.watermark_config['position'] = config['position']
+        self.watermark_config['offset_x'] = config['offset_x']
+        self.watermark_config['offset_y'] = config['offset_y']
+        self.watermark_config['image_path'] = config['image_path']
+
+        if self.watermark_config['image_path']:
+            self.wm_image_label.config(
+                text=os.path.basename(self.watermark_config['image_path']),
+                foreground='black'
+            )
 
     def load_last_config(self):
-        """加载上次的配置"""
-        config_file = "last_config.json"
-        if os.path.exists(config_file):
-            try:
-                with open(config_file, 'r', encoding='utf-8') as f:
-                    config = json.load(f)
-
-                self.watermark_type.set(config.get('type', 'text'))
-                self.text_entry.delete(0, tk.END)
-                self.text_entry.insert(0, config.get('text', '© 版权所有'))
-                self.font_size.set(config.get('font_size', 36))
-                self.color_var.set(config.get('color', '#FFFFFF'))
-                self.color_display.config(bg=config.get('color', '#FFFFFF'))
-                self.opacity.set(config.get('opacity', 50))
-                self.rotation.set(config.get('rotation', 0))
+        """加载上次的配置（水印设置与模板的校验方式相同，无效时保持默认设置）"""
+        try:
+            with open(self.last_config_file, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+        except (OSError, ValueError):
+            return
+        if not isinstance(config, dict):
+            return
 
-            except:
-                pass
+        try:
+            self.apply_settings(validate_template(config))
+        except ValueError as e:
+            logger.warning("上次的水印设置无效，使用默认设置: %s", e)
+
+        if config.get('output_format') in OUTPUT_FORMATS:
+            self.output_format.set(config['output_format'])
+        if config.get('filename_rule') in ('original', 'prefix', 'suffix'):
+            self.filename_rule.set(config['filename_rule'])
+        if isinstance(config.get('custom_affix'), str):
+            self.custom_affix.delete(0, tk.END)
+            self.custom_affix.insert(0, config['custom_affix'])
+        for key, variable in (('skip_unchanged', self.skip_unchanged),
+                              ('show_export_report', self.show_export_report)):
+            if isinstance(config.get(key), bool):
+                variable.set(config[key])
+        # 缓存大小（MB）必须是正整数，无效时（如手工修改为 "abc"、0 或 true）使用默认值
+        cache_mb = {}
+        for key, default in (('preview_cache_mb', DEFAULT_PREVIEW_CACHE_MB),
+                             ('thumb_cache_mb', DEFAULT_THUMB_CACHE_MB)):
+            value = config.get(key, default)
+            if isinstance(value, bool) or not isinstance(value, int) or value <= 0:
+                logger.warning("上次的 %s 无效，使用默认值 %s: %r", key, default, value)
+                value = default
+            cache_mb[key] = value
+        self.preview_cache_mb = cache_mb['preview_cache_mb']
+        self.preview_cache.set_max_mb(self.preview_cache_mb)
+        self.thumb_cache_mb = cache_mb['thumb_cache_mb']
+        self.thumb_cache.max_bytes = self.thumb_cache_mb * 1024 * 1024
 
     def save_last_config(self):
-        """保存当前配置"""
-        config = {
-            'type': self.watermark_type.get(),
-            'text': self.text_entry.get(),
-            'font_size': self.font_size.get(),
-            'color': self.color_var.get(),
-            'opacity': self.opacity.get(),
-            'rotation': self.rotation.get()
-        }
+        """保存当前配置（完整的水印设置和导出选项）"""
+        config = self.get_watermark_settings()
+        config.update({
+            'encoder_profile': self.encoder_profile.get(),
+            'output_format': self.output_format.get(),
+            'filename_rule': self.filename_rule.get(),
+            'custom_affix': self.custom_affix.get(),
+            'skip_unchanged': self.skip_unchanged.get(),
+            'show_export_report': self.show_export_report.get(),
+            'preview_cache_mb': self.preview_cache_mb,
+            'thumb_cache_mb': self.thumb_cache_mb
+        })
 
         try:
-            with open("last_config.json", 'w', encoding='utf-8') as f:
-                json.dump(config, f, ensure_ascii=False, indent=2)
-        except:
-            pass
+            write_json_atomic(self.last_config_file, config)
+        except OSError as e:
+            logger.warning("保存配置失败: %s", e)
 
 def main():
+    configure_logging()
     try:
         root = TkinterDnD.Tk()
         app = WatermarkApp(root)
 
         # 绑定窗口大小变化事件
-        root.bind('<Configure>', lambda e: app.update_preview() if e.widget == root else None)
+        root.bind('<Configure>', app.on_window_resize)
 
         # 关闭时保存配置
         def on_closing():
@@ -959,10 +1147,11 @@ def main():
         root.protocol("WM_DELETE_WINDOW", on_closing)
 
         root.mainloop()
-    except Exception as e:
-        print(f"程序错误: {e}")
-        traceback.print_exc()
+    except Exception:
+        logger.exception("程序错误")
         input("按回车键退出...")
 
 if __name__ == "__main__":
+    # 打包为 exe 后多进程导出需要
+    multiprocessing.freeze_support()
     main()
@@ -0,0 +1,88 @@
+"""
+Watermark Cache - 缓存工具
+线程安全的 LRU 缓存，可按条目数和/或占用字节数限制；有名称的缓存把每次查询的命中/未命中
+记到当前图片的统计中（导出统计中的缓存命中即来自这里）
+"""
+
+import threading
+from collections import OrderedDict
+
+from watermark_metrics import cache_result
+
+_MISSING = object()
+
+
+def image_nbytes(image):
+    """估算 PIL 图片占用的内存字节数"""
+    return image.width * image.height * len(image.getbands())
+
+
+class LRUCache:
+    """最近最少使用缓存
+
+    max_entries / max_bytes 为 None 表示不限制；
+    sizeof(value) 用于计算单个条目的字节数（仅在限制字节数时需要）；
+    name 为统计中的缓存名称（见 watermark_metrics.cache_result），None 时不记录
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None, sizeof=None, name=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.name = name
+        self._data = OrderedDict()
+        self._sizes = {}
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None, valid=None):
+        """读取缓存，命中时移到最近使用的位置；valid(value) 为 False 的条目（如已过期）按未命中处理"""
+        with self._lock:
+            value = self._data.get(key, _MISSING)
+            hit = value is not _MISSING and (valid is None or valid(value))
+            if hit:
+                self._data.move_to_end(key)
+        if self.name is not None:
+            cache_result(self.name, hit)
+        return value if hit else default
+
+    def put(self, key, value):
+        """写入缓存并按限制淘汰最久未使用的条目"""
+        size = self.sizeof(value) if self.sizeof else 0
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            # 单个条目超过上限时不缓存
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            self._data[key] = value
+            self._sizes[key] = size
+            self._total_bytes += size
+            self._evict()
+
+    def set_limits(self, max_entries=None, max_bytes=None):
+        """修改缓存上限并立即淘汰超出部分"""
+        with self._lock:
+            self.max_entries = max_entries
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self._total_bytes = 0
+
+    def _remove(self, key):
+        del self._data[key]
+        self._total_bytes -= self._sizes.pop(key)
+
+    def _evict(self):
+        while self._data and (
+                (self.max_entries is not None and len(self._data) > self.max_entries) or
+                (self.max_bytes is not None and self._total_bytes > self.max_bytes)):
+            self._remove(next(iter(self._data)))
@@ -0,0 +1,254 @@
+"""
+Watermark CLI - 命令行批量处理
+无需图形界面，按模板或 JSON 水印设置批量导出，结果与界面导出相同；
+不带参数运行时启动图形界面（界面相关模块只在此时导入）
+
+示例:
+    python watermark_cli.py photos/*.jpg -t 版权 -o out --format JPEG --workers 8
+    python watermark_cli.py photos -s spec.json -o out --naming prefix --affix wm_
+    python watermark_cli.py photos -t 版权 -o out --format WEBP --profile fast
+    python watermark_cli.py photos -t 版权 -o out --report -v
+    python watermark_cli.py hotfolder -t 版权 -o out --watch
+"""
+
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+
+from watermark_encode import ENCODER_PROFILES, OUTPUT_FORMATS, EncodeSummary, get_profile
+from watermark_export import default_workers, export_batch, plan_jobs
+from watermark_manifest import ExportManifest, settings_digest
+from watermark_metrics import ExportReport, configure_logging
+from watermark_render import get_renderer, spec_of
+from watermark_scan import iter_image_entries, path_key
+from watermark_templates import TEMPLATES_NAME, TemplateStore, validate_template
+from watermark_watch import POLL_INTERVAL, SETTLE_SECONDS, HotFolder
+
+
+def expand_inputs(inputs, recursive=True):
+    """展开输入：支持通配符、文件和文件夹，按路径去重，产出 (图片路径, 相对文件夹)"""
+    paths = []
+    for item in inputs:
+        if glob.has_magic(item):
+            paths.extend(sorted(glob.glob(item, recursive=True)))
+        else:
+            paths.append(item)
+
+    seen = set()
+    for path, subfolder in iter_image_entries(paths, recursive):
+        key = path_key(path)
+        if key not in seen:
+            seen.add(key)
+            yield path, subfolder
+
+
+def load_spec(spec):
+    """读取 JSON 水印设置：可以是 JSON 文件路径或 JSON 字符串"""
+    if os.path.isfile(spec):
+        with open(spec, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return json.loads(spec)
+
+
+def resolve_settings(args):
+    """读取模板/JSON 设置，返回 (RenderPlan, EncoderProfile)
+
+    模板使用模板库编译好的 RenderPlan，JSON 设置校验后同样编译，批量导出时不再逐张查找图层；
+    编码配置优先使用 --profile，其次使用设置中的 encoder_profile
+    """
+    if args.template:
+        template = TemplateStore(args.templates).template(args.template)
+        plan, profile = template.plan, template.profile
+    else:
+        # 与模板相同的校验：设置无效时不导出，避免写出没有水印的图片
+        config = validate_template(load_spec(args.spec))
+        plan = get_renderer().compile(config)
+        profile = get_profile(config['encoder_profile'])
+    if args.profile:
+        profile = get_profile(args.profile)
+    return plan, profile
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='watermark_cli',
+        description="图片水印工具 - 命令行批量处理（不带参数运行时启动图形界面）")
+    parser.add_argument('inputs', nargs='+',
+                        help="输入图片、文件夹或通配符（如 photos/*.jpg）")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('-t', '--template', help="使用模板文件中的模板名称")
+    source.add_argument('-s', '--spec', help="JSON 水印设置（文件路径或 JSON 字符串）")
+    parser.add_argument('--templates',
+                        help=f"模板文件（默认为程序文件夹中的 {TEMPLATES_NAME}）")
+    parser.add_argument('-o', '--output', required=True, help="输出文件夹")
+    parser.add_argument('-f', '--format', default='PNG', type=str.upper, choices=OUTPUT_FORMATS,
+                        help="输出格式（默认 PNG）")
+    parser.add_argument('-p', '--profile', choices=list(ENCODER_PROFILES),
+                        help="编码配置（默认使用模板中的配置，没有时为 balanced）")
+    parser.add_argument('--naming', default='suffix', choices=['original', 'prefix', 'suffix'],
+                        help="文件命名规则（默认 suffix）")
+    parser.add_argument('--affix', default='_wm', help="前缀/后缀内容（默认 _wm）")
+    parser.add_argument('-w', '--workers', type=int, default=default_workers(),
+                        help="并行进程数（默认 CPU 核心数）")
+    parser.add_argument('--no-recursive', action='store_true', help="不扫描子文件夹")
+    parser.add_argument('--force', action='store_true',
+                        help="全部重新导出（默认跳过导出清单中已是最新的文件）")
+    parser.add_argument('--report', action='store_true',
+                        help="导出后输出性能统计（各阶段 p50/p95、吞吐量、缓存命中）")
+    watch = parser.add_argument_group("监视模式")
+    watch.add_argument('--watch', action='store_true',
+                       help="持续监视输入文件夹，新图片写入完成后自动导出（Ctrl+C 停止）")
+    watch.add_argument('--settle', type=float, default=SETTLE_SECONDS,
+                       help=f"文件大小不变多少秒认为写入完成（默认 {SETTLE_SECONDS:g}）")
+    watch.add_argument('--poll', action='store_true',
+                       help="使用轮询扫描（网络共享等不支持 inotify 的文件夹）")
+    watch.add_argument('--interval', type=float, default=POLL_INTERVAL,
+                       help=f"轮询扫描间隔秒数（默认 {POLL_INTERVAL:g}）")
+    parser.add_argument('-v', '--verbose', action='count', default=0,
+                        help="输出更多日志（-v 信息，-vv 调试）")
+    parser.add_argument('-q', '--quiet', action='store_true', help="只输出错误和汇总")
+    return parser
+
+
+def run(args):
+    """执行批量导出，返回退出码"""
+    try:
+        spec, profile = resolve_settings(args)
+    except (OSError, ValueError, KeyError, OverflowError) as e:
+        message = e.args[0] if isinstance(e, KeyError) else e
+        print(f"读取水印设置失败: {message}", file=sys.stderr)
+        return 2
+
+    if args.watch:
+        return watch(args, spec, profile)
+
+    images = list(expand_inputs(args.inputs, recursive=not args.no_recursive))
+    if path_key(args.output) not in {path_key(path) for path in args.inputs}:
+        # 输出文件夹是输入文件夹的子文件夹时不导出其中已有的结果
+        output_prefix = os.path.join(path_key(args.output), '')
+        images = [(path, subfolder) for path, subfolder in images
+                  if not path_key(path).startswith(output_prefix)]
+    if not images:
+        print("没有找到图片文件", file=sys.stderr)
+        return 2
+
+    os.makedirs(args.output, exist_ok=True)
+
+    # 文件夹中的图片按子文件夹结构输出；不覆盖原图，也不让两张图片写到同一个输出文件
+    jobs, conflicts = plan_jobs(images, args.output, args.format, args.naming, args.affix)
+    for image_path, reason in conflicts:
+        print(f"跳过 {image_path}: {reason}", file=sys.stderr)
+    skipped = len(conflicts)
+
+    # 增量导出：跳过原图和设置都没有变化的文件
+    manifest = ExportManifest(args.output)
+    digest = settings_digest(spec_of(spec), args.format, profile)
+    up_to_date = 0
+    if not args.force:
+        jobs, up_to_date = manifest.pending(jobs, digest)
+
+    success_count = 0
+    error_count = 0
+    summary = EncodeSummary()
+    report = ExportReport()
+    start = time.perf_counter()
+
+    results = export_batch(jobs, args.format, spec, args.workers, profile, fingerprint=True)
+    try:
+        for i, result in enumerate(results):
+            if result.error is None:
+                success_count += 1
+                summary.add(result.stats)
+                report.add(result.metrics)
+                manifest.record(result.image_path, result.output_path, digest, result.fingerprint)
+                manifest.save_if_due()
+            else:
+                print(f"导出错误 {result.image_path}: {result.error}", file=sys.stderr)
+                error_count += 1
+            if not args.quiet:
+                print(f"正在导出 {i + 1}/{len(jobs)}", end='\r', flush=True)
+    finally:
+        # 中断（如 Ctrl+C）时也保存已完成的部分，下次接着导出
+        manifest.save()
+
+    elapsed = time.perf_counter() - start
+    report.finish()
+    if not args.quiet:
+        print()
+    print(f"导出完成！成功: {success_count} 失败: {error_count} 跳过: {skipped} "
+          f"已是最新: {up_to_date} 用时: {elapsed:.1f}s")
+    for line in summary.lines():
+        print(line)
+    if args.report:
+        for line in report.lines():
+            print(line)
+    return 1 if error_count or skipped else 0
+
+
+def watch(args, spec, profile):
+    """监视模式：持续导出输入文件夹中新出现的图片，直到 Ctrl+C 或 SIGTERM"""
+    folders = [path for path in args.inputs if os.path.isdir(path)]
+    if len(folders) != len(args.inputs):
+        print("监视模式的输入必须是文件夹", file=sys.stderr)
+        return 2
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    totals = {'success': 0, 'error': 0}
+    report = ExportReport()
+
+    def on_batch(results, up_to_date):
+        success = 0
+        for result in results:
+            if result.error is None:
+                success += 1
+                report.add(result.metrics)
+            else:
+                print(f"导出错误 {result.image_path}: {result.error}", file=sys.stderr)
+        totals['success'] += success
+        totals['error'] += len(results) - success
+        if not args.quiet and (results or up_to_date):
+            print(f"{time.strftime('%H:%M:%S')} 导出 {len(results)} 张，成功: {success} "
+                  f"失败: {len(results) - success} 已是最新: {up_to_date}", flush=True)
+
+    hot_folder = HotFolder(folders, args.output, args.format, spec, profile, args.naming,
+                           args.affix, args.workers, not args.no_recursive, args.settle,
+                           args.poll, args.interval)
+    if not args.quiet:
+        print(f"正在监视 {', '.join(folders)}，导出到 {args.output}（Ctrl+C 停止）", flush=True)
+    try:
+        hot_folder.run(stop, on_batch)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        hot_folder.close()
+
+    report.finish()
+    print(f"监视结束！成功: {totals['success']} 失败: {totals['error']}")
+    if args.report:
+        for line in report.lines():
+            print(line)
+    return 0
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        # 不带参数时启动图形界面
+        import watermark_app
+        watermark_app.main()
+        return 0
+    args = build_parser().parse_args(argv)
+    configure_logging(args.verbose)
+    return run(args)
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,148 @@
+"""
+Watermark Encode - 编码配置
+导出时的编码参数按命名配置（fast / balanced / archive）管理，在导出速度和文件大小之间取舍；
+保存时记录编码耗时和输出大小，供导出汇总使用
+"""
+
+import io
+import time
+from collections import namedtuple
+from dataclasses import dataclass
+from PIL import JpegImagePlugin, features
+
+from watermark_metrics import stage
+
+# 支持的输出格式（WebP 需要 Pillow 编译时带 libwebp）
+OUTPUT_FORMATS = ('PNG', 'JPEG') + (('WEBP',) if features.check('webp') else ())
+
+FORMAT_EXTENSIONS = {
+    'PNG': '.png',
+    'JPEG': '.jpg',
+    'WEBP': '.webp',
+}
+
+
+@dataclass(frozen=True)
+class EncoderProfile:
+    """一组编码参数（不可变，可直接传给导出子进程）"""
+    name: str
+    label: str
+    png_compress_level: int = 6
+    jpeg_quality: int = 95
+    jpeg_subsampling: str = None    # None 时使用 Pillow 默认值（4:2:0）
+    jpeg_optimize: bool = False
+    jpeg_progressive: bool = False
+    keep_jpeg_tables: bool = False  # 原图为 JPEG 时沿用其量化表和色度抽样
+    webp_quality: int = 90
+    webp_method: int = 4            # 0 最快，6 压缩率最高
+    webp_lossless: bool = False
+
+
+ENCODER_PROFILES = {profile.name: profile for profile in (
+    # 编码最快，文件较大
+    EncoderProfile('fast', "快速", png_compress_level=1, jpeg_quality=90,
+                   webp_quality=80, webp_method=0),
+    # 与以前的固定编码参数相同
+    EncoderProfile('balanced', "均衡"),
+    # 文件最小或画质最好，编码最慢
+    EncoderProfile('archive', "归档", png_compress_level=9, jpeg_subsampling='4:4:4',
+                   jpeg_optimize=True, jpeg_progressive=True, keep_jpeg_tables=True,
+                   webp_method=6, webp_lossless=True),
+)}
+
+DEFAULT_PROFILE = 'balanced'
+
+# 单张图片的编码结果
+EncodeStats = namedtuple('EncodeStats', ['profile', 'format', 'seconds', 'nbytes'])
+
+
+def get_profile(name):
+    """按名称获取编码配置，名称为空时使用默认配置"""
+    name = name or DEFAULT_PROFILE
+    if name not in ENCODER_PROFILES:
+        raise ValueError(f"未知的编码配置 '{name}'，可用配置: {', '.join(ENCODER_PROFILES)}")
+    return ENCODER_PROFILES[name]
+
+
+def jpeg_source_tables(image):
+    """读取 JPEG 原图的量化表和色度抽样，供 keep_jpeg_tables 使用；不是 JPEG 时返回 None"""
+    if image.format not in ('JPEG', 'MPO') or not getattr(image, 'quantization', None):
+        return None
+    return image.quantization, JpegImagePlugin.get_sampling(image)
+
+
+def save_params(output_format, profile, jpeg_tables=None):
+    """编码配置对应的 Image.save 参数"""
+    if output_format == 'JPEG':
+        if profile.keep_jpeg_tables and jpeg_tables is not None:
+            qtables, sampling = jpeg_tables
+            params = {'qtables': qtables}
+            if sampling != -1:
+                params['subsampling'] = sampling
+        else:
+            params = {'quality': profile.jpeg_quality}
+            if profile.jpeg_subsampling is not None:
+                params['subsampling'] = profile.jpeg_subsampling
+        if profile.jpeg_optimize:
+            params['optimize'] = True
+        if profile.jpeg_progressive:
+            params['progressive'] = True
+        return params
+
+    if output_format == 'WEBP':
+        if profile.webp_lossless:
+            return {'lossless': True, 'method': profile.webp_method}
+        return {'quality': profile.webp_quality, 'method': profile.webp_method}
+
+    return {'compress_level': profile.png_compress_level}
+
+
+def encode_image(image, output_format, profile, jpeg_tables=None):
+    """按编码配置把图片编码到内存，返回 (编码后的数据, EncodeStats)"""
+    buffer = io.BytesIO()
+    with stage('encode'):
+        start = time.perf_counter()
+        image.save(buffer, output_format, **save_params(output_format, profile, jpeg_tables))
+        seconds = time.perf_counter() - start
+    data = buffer.getbuffer()
+    return data, EncodeStats(profile.name, output_format, seconds, len(data))
+
+
+def write_output(output_path, data):
+    """把编码后的数据写入输出文件"""
+    with stage('write'):
+        with open(output_path, 'wb') as f:
+            f.write(data)
+
+
+def save_image(image, output_path, output_format, profile, jpeg_tables=None):
+    """按编码配置保存图片，返回 EncodeStats
+
+    先编码到内存再写入文件，编码耗时和写入耗时分开统计
+    """
+    data, stats = encode_image(image, output_format, profile, jpeg_tables)
+    write_output(output_path, data)
+    return stats
+
+
+class EncodeSummary:
+    """按 (编码配置, 格式) 汇总编码耗时和输出大小"""
+
+    def __init__(self):
+        self._totals = {}  # (配置, 格式) -> [张数, 秒, 字节]
+
+    def add(self, stats):
+        if stats is None:
+            return
+        total = self._totals.setdefault((stats.profile, stats.format), [0, 0.0, 0])
+        total[0] += 1
+        total[1] += stats.seconds
+        total[2] += stats.nbytes
+
+    def lines(self):
+        """每个编码配置一行的汇总文字"""
+        lines = []
+        for (profile, output_format), (count, seconds, nbytes) in self._totals.items():
+            lines.append(f"{profile}/{output_format}: {count} 张，编码 {seconds:.2f}s，"
+                         f"共 {nbytes / (1024 * 1024):.1f} MB")
+        return lines
@@ -0,0 +1,304 @@
+"""
+Watermark Export - 批量导出
+单张导出、单进程流水线导出（读盘/合成/写盘重叠）与多进程并行导出，
+子进程只接收不可变的水印设置 WatermarkSpec
+"""
+
+import hashlib
+import io
+import multiprocessing
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from PIL import Image
+
+from watermark_encode import (FORMAT_EXTENSIONS, encode_image, get_profile, jpeg_source_tables,
+                              write_output)
+from watermark_manifest import make_fingerprint, source_fingerprint
+from watermark_metrics import ImageMetrics, collect, stage
+from watermark_pipeline import run_pipeline
+from watermark_render import RenderPlan, WatermarkSpec, get_renderer, spec_of
+from watermark_scan import path_key
+from watermark_stream import export_png_stream, open_stream_source
+
+
+def output_filename(original_path, output_format, rule='suffix', custom='_wm'):
+    """生成输出文件名：rule 为 original（原名）/ prefix（加前缀）/ suffix（加后缀）"""
+    basename = os.path.basename(original_path)
+    name, _ = os.path.splitext(basename)
+
+    if rule == 'original':
+        new_name = name
+    elif rule == 'prefix':
+        new_name = custom + name
+    else:  # suffix
+        new_name = name + custom
+
+    return new_name + FORMAT_EXTENSIONS.get(output_format, '.png')
+
+
+def plan_jobs(entries, output_folder, output_format, rule='suffix', custom='_wm'):
+    """由 (原图, 相对文件夹) 生成导出任务，返回 (任务列表, 跳过的 [(原图, 原因)])
+
+    输出文件放在 output_folder 中与原图相同的相对子文件夹里；输出文件就是原图本身，
+    或与前面的图片输出到同一个文件（如同名的 a.jpg 和 a.png）时跳过，不覆盖
+    """
+    jobs = []
+    skipped = []
+    outputs = {}  # 输出文件 -> 原图
+    for image_path, subfolder in entries:
+        output_path = os.path.join(output_folder, subfolder,
+                                   output_filename(image_path, output_format, rule, custom))
+        key = path_key(output_path)
+        if key == path_key(image_path):
+            skipped.append((image_path, "输出文件与原图相同"))
+        elif key in outputs:
+            skipped.append((image_path, f"与 {outputs[key]} 的输出文件相同"))
+        else:
+            outputs[key] = image_path
+            jobs.append((image_path, output_path))
+    return jobs, skipped
+
+
+def make_output_folders(jobs):
+    """创建输出文件所在的子文件夹；无法创建时不报错，由导出该文件时报告失败"""
+    for folder in {os.path.dirname(output_path) for _, output_path in jobs}:
+        try:
+            os.makedirs(folder, exist_ok=True)
+        except OSError:
+            pass
+
+
+def process_context():
+    """导出进程池使用的启动方式：spawn
+
+    界面中的预览、缩略图线程可能正持有渲染器缓存或字体索引的锁，fork 出的子进程继承到已被持有的锁，
+    第一次使用时就会死锁；spawn 启动的子进程重新导入模块，与各平台（Windows/macOS 默认）一致
+    """
+    return multiprocessing.get_context('spawn')
+
+
+def default_workers():
+    """默认导出进程数（CPU 核心数）"""
+    return os.cpu_count() or 1
+
+
+# 导出 JPEG/WebP 时可以直接转为 RGB 合成的不透明模式
+OPAQUE_MODES = ('RGB', 'L', 'CMYK', 'YCbCr')
+
+# 不需要透明通道的输出格式
+RGB_FORMATS = ('JPEG', 'WEBP')
+
+# 单张导出结果：error 为错误信息或 None，stats 为 EncodeStats，
+# fingerprint 为原图指纹（仅在要求时计算，用于增量导出清单），
+# metrics 为各阶段耗时和缓存计数（ImageMetrics.as_dict()，供 ExportReport 汇总）
+ExportResult = namedtuple('ExportResult',
+                          ['image_path', 'output_path', 'error', 'stats', 'fingerprint',
+                           'metrics'])
+
+
+def export_image(image_path, output_path, output_format, spec, profile=None):
+    """导出单张图片：加载、添加水印、保存，返回 EncodeStats
+
+    spec 为 WatermarkSpec、模板格式的字典或 RenderPlan，profile 为 EncoderProfile（None 时使用默认配置）
+    """
+    spec = _plan_or_spec(spec)
+    profile = profile or get_profile(None)
+
+    # 超大 TIFF 导出 PNG：分块读写，不整幅加载
+    with stage('open'):
+        strips = open_stream_source(image_path, output_format)
+    if strips is not None:
+        return export_png_stream(strips, output_path, spec, profile)
+
+    data, stats = encode_export(image_path, output_format, spec, profile)
+    write_output(output_path, data)
+    return stats
+
+
+def encode_export(source, output_format, spec, profile=None):
+    """加载原图、添加水印并按编码配置编码到内存，返回 (编码后的数据, EncodeStats)
+
+    source 为原图路径或文件对象（流水线导出时为已读入内存的原图）；
+    spec 为 RenderPlan 时直接使用其中的图层，不再逐张查找缓存
+    """
+    spec = _plan_or_spec(spec)
+    profile = profile or get_profile(None)
+    renderer = get_renderer()
+
+    # 加载原图
+    with stage('open'):
+        original = Image.open(source)
+    with stage('decode'):
+        original.load()
+    jpeg_tables = jpeg_source_tables(original) if output_format == 'JPEG' else None
+
+    if output_format in RGB_FORMATS and original.mode in OPAQUE_MODES:
+        # 不透明图片导出 JPEG/WebP：在 RGB 缓冲区上直接合成，
+        # 省去整幅 RGBA 往返转换（结果与经 RGBA 合成后转 RGB 相同）
+        if original.mode != 'RGB':
+            with stage('convert'):
+                original = original.convert('RGB')
+        watermarked = renderer.render(original, spec, in_place=True, keep_rgb=True)
+    else:
+        # 添加水印
+        watermarked = renderer.render(original, spec, in_place=True)
+
+    # 转换为RGB（如果导出为JPEG）
+    if watermarked.mode != 'RGB' and output_format == 'JPEG':
+        with stage('convert'):
+            watermarked = watermarked.convert('RGB')
+
+    # 编码
+    return encode_image(watermarked, output_format, profile, jpeg_tables)
+
+
+def _plan_or_spec(spec):
+    """RenderPlan 原样返回，其他转为 WatermarkSpec"""
+    return spec if isinstance(spec, RenderPlan) else WatermarkSpec.from_config(spec)
+
+
+def _export_task(image_path, output_path, output_format, spec, profile, fingerprint):
+    """子进程任务：返回 ExportResult，异常转成字符串避免无法序列化
+
+    fingerprint 为 True 时导出后顺便计算原图指纹（原图刚读过，通常还在系统缓存中）
+    """
+    try:
+        with collect() as metrics:
+            stats = export_image(image_path, output_path, output_format, spec, profile)
+        source = source_fingerprint(image_path) if fingerprint else None
+        return ExportResult(image_path, output_path, None, stats, source, metrics.as_dict())
+    except Exception as e:
+        return ExportResult(image_path, output_path, str(e), None, None, None)
+
+
+# 流水线导出的读取/写入线程数（合成在一个线程中进行）
+PIPELINE_READERS = 2
+PIPELINE_WRITERS = 1
+
+
+class _PipelineJob:
+    """流水线中的一张图片：原图数据依次变为编码后的数据，处理完的阶段立即释放"""
+
+    __slots__ = ('image_path', 'output_path', 'source', 'data', 'stats', 'fingerprint',
+                 'metrics')
+
+    def __init__(self, image_path, output_path):
+        self.image_path = image_path
+        self.output_path = output_path
+        self.source = None        # 读入内存的原图文件内容（超大 TIFF 分块导出时为 None）
+        self.data = None          # 编码后的输出数据
+        self.stats = None
+        self.fingerprint = None
+        self.metrics = ImageMetrics()
+
+
+def export_pipeline(jobs, output_format, spec, profile=None, fingerprint=False):
+    """单进程流水线导出：读取线程预读原图，合成线程解码/加水印/编码，写入线程写出结果
+
+    磁盘读写与合成重叠进行；阶段之间为有界队列，内存中最多只有几张图片。
+    参数和产出与 export_batch 相同
+    """
+    spec = _plan_or_spec(spec)
+    profile = profile or get_profile(None)
+
+    def read(job):
+        with collect(job.metrics):
+            with stage('read'):
+                # 超大 TIFF 不读入内存，合成阶段直接分块读写
+                if open_stream_source(job.image_path, output_format) is not None:
+                    return job
+                stat = os.stat(job.image_path)
+                with open(job.image_path, 'rb') as f:
+                    job.source = f.read()
+        if fingerprint:
+            job.fingerprint = make_fingerprint(stat, hashlib.sha256(job.source).hexdigest())
+        return job
+
+    def encode(job):
+        with collect(job.metrics):
+            if job.source is None:
+                job.stats = export_image(job.image_path, job.output_path, output_format,
+                                         spec, profile)
+                if fingerprint:
+                    job.fingerprint = source_fingerprint(job.image_path)
+            else:
+                job.data, job.stats = encode_export(io.BytesIO(job.source), output_format,
+                                                    spec, profile)
+                job.source = None
+        return job
+
+    def write(job):
+        if job.data is not None:
+            with collect(job.metrics):
+                write_output(job.output_path, job.data)
+            job.data = None
+        return job
+
+    stages = [(read, PIPELINE_READERS), (encode, 1), (write, PIPELINE_WRITERS)]
+    items = (_PipelineJob(image_path, output_path) for image_path, output_path in jobs)
+    for job, error in run_pipeline(items, stages):
+        if error is not None:
+            yield ExportResult(job.image_path, job.output_path, str(error), None, None, None)
+        else:
+            yield ExportResult(job.image_path, job.output_path, None, job.stats,
+                               job.fingerprint, job.metrics.as_dict())
+
+
+def export_batch(jobs, output_format, spec, workers=1, profile=None, fingerprint=False,
+                 pipeline=True, pool=None):
+    """批量导出
+
+    jobs 为 (源文件, 输出文件) 列表（见 plan_jobs，输出文件所在的子文件夹自动创建），spec 为 WatermarkSpec 或 RenderPlan（多进程导出时
+    只把其中的 WatermarkSpec 传给子进程），profile 为 EncoderProfile；
+    逐个产出 ExportResult，产出顺序即完成顺序，调用方据此更新进度。
+    workers <= 1 时在当前进程内导出：pipeline 为 True 时使用流水线，否则逐张串行执行。
+    pool 为调用方创建的 ProcessPoolExecutor 时在其中导出（监视模式跨批次复用进程，
+    子进程中的字体和水印图层缓存保持有效），此时忽略 workers
+    """
+    profile = profile or get_profile(None)
+    make_output_folders(jobs)
+    if pool is not None:
+        yield from _export_in_pool(pool, jobs, output_format, spec_of(spec), profile, fingerprint)
+        return
+    if workers <= 1 or len(jobs) <= 1:
+        if pipeline:
+            yield from export_pipeline(jobs, output_format, spec, profile, fingerprint)
+            return
+        for image_path, output_path in jobs:
+            yield _export_task(image_path, output_path, output_format, spec, profile, fingerprint)
+        return
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(jobs)),
+                             mp_context=process_context()) as pool:
+        yield from _export_in_pool(pool, jobs, output_format, spec_of(spec), profile, fingerprint)
+
+
+def _export_in_pool(pool, jobs, output_format, spec, profile, fingerprint):
+    """在进程池中并行导出，按完成顺序产出 ExportResult
+
+    子进程异常退出（如内存不足被杀、解码时崩溃）后进程池不再可用：已提交和未能提交的图片都按失败产出，
+    不抛出 BrokenProcessPool（常驻进程池由调用方重新创建）
+    """
+    futures = {}
+    unsubmitted = []
+    for index, (image_path, output_path) in enumerate(jobs):
+        try:
+            future = pool.submit(_export_task, image_path, output_path, output_format, spec,
+                                 profile, fingerprint)
+        except BrokenProcessPool as e:
+            unsubmitted = jobs[index:]
+            broken = e
+            break
+        futures[future] = (image_path, output_path)
+    for future in as_completed(futures):
+        try:
+            yield future.result()
+        except BrokenProcessPool as e:
+            yield ExportResult(*futures[future], f"导出进程异常退出: {e}", None, None, None)
+        except Exception as e:
+            yield ExportResult(*futures[future], f"导出进程异常: {e}", None, None, None)
+    for image_path, output_path in unsubmitted:
+        yield ExportResult(image_path, output_path, f"导出进程异常退出: {broken}",
+                           None, None, None)
@@ -0,0 +1,316 @@
+"""
+Watermark Fonts - 字体索引
+扫描系统字体目录，按字体族名和文字覆盖范围建立索引（只建立一次），
+并按 (字体, 字号) 缓存已加载的 FreeTypeFont 对象
+"""
+
+import os
+import struct
+import sys
+import threading
+from collections import namedtuple
+from PIL import ImageFont
+
+from watermark_cache import LRUCache
+
+FONT_EXTENSIONS = ('.ttf', '.ttc', '.otf', '.otc')
+
+# 判断文字覆盖范围时检查的字符
+SCRIPT_SAMPLES = {
+    'latin': 'Aaz',
+    'cjk': '中文字版权',
+}
+
+# 中文字体优先顺序（按文件名），找不到时再用任意覆盖中文的字体
+PREFERRED_CJK_FILES = [
+    'msyh.ttc',                    # 微软雅黑
+    'msyhbd.ttc',                  # 微软雅黑粗体
+    'simhei.ttf',                  # 黑体
+    'simsun.ttc',                  # 宋体
+    'simkai.ttf',                  # 楷体
+    'simfang.ttf',                 # 仿宋
+    'notosanscjk-regular.ttc',     # Noto Sans CJK
+    'notosanscjksc-regular.otf',
+    'sourcehansanssc-regular.otf',  # 思源黑体
+    'wqy-microhei.ttc',            # 文泉驿微米黑
+    'wqy-zenhei.ttc',              # 文泉驿正黑
+    'droidsansfallbackfull.ttf',
+    'pingfang.ttc',                # 苹方
+    'stheiti medium.ttc',
+    'hiragino sans gb.ttc',
+    'arial unicode.ttf',
+]
+
+FONT_CACHE_SIZE = 64
+
+# 一个字体文件中的一个字体（TTC 集合中有多个）
+FontFace = namedtuple('FontFace', ['path', 'index', 'families', 'scripts'])
+
+
+def system_font_dirs():
+    """当前平台的字体目录"""
+    home = os.path.expanduser('~')
+    if sys.platform == 'win32':
+        windir = os.environ.get('WINDIR', 'C:\\Windows')
+        dirs = [os.path.join(windir, 'Fonts')]
+        local = os.environ.get('LOCALAPPDATA')
+        if local:
+            dirs.append(os.path.join(local, 'Microsoft', 'Windows', 'Fonts'))
+    elif sys.platform == 'darwin':
+        dirs = ['/System/Library/Fonts', '/Library/Fonts',
+                os.path.join(home, 'Library', 'Fonts')]
+    else:
+        # fontconfig 默认目录
+        data_home = os.environ.get('XDG_DATA_HOME') or os.path.join(home, '.local', 'share')
+        data_dirs = os.environ.get('XDG_DATA_DIRS') or '/usr/local/share:/usr/share'
+        dirs = [os.path.join(data_home, 'fonts'), os.path.join(home, '.fonts')]
+        dirs += [os.path.join(d, 'fonts') for d in data_dirs.split(':') if d]
+
+    result = []
+    for folder in dirs:
+        if folder not in result and os.path.isdir(folder):
+            result.append(folder)
+    return result
+
+
+def _iter_font_files(folder, visited=None):
+    """递归列出目录下的字体文件
+
+    跟随指向目录的符号链接（字体目录中常见），按 (设备, inode) 记录已扫描的目录，
+    符号链接成环或指向已扫描的目录时不重复进入
+    """
+    if visited is None:
+        visited = set()
+    try:
+        info = os.stat(folder)
+        if (info.st_dev, info.st_ino) in visited:
+            return
+        visited.add((info.st_dev, info.st_ino))
+        entries = list(os.scandir(folder))
+    except OSError:
+        return
+    for entry in entries:
+        try:
+            if entry.is_dir():
+                yield from _iter_font_files(entry.path, visited)
+            elif entry.name.lower().endswith(FONT_EXTENSIONS):
+                yield entry.path
+        except OSError:
+            continue
+
+
+def _read_table_dir(f, offset):
+    """读取 sfnt 表目录，返回 {表名: (偏移, 长度)}"""
+    f.seek(offset)
+    num_tables = struct.unpack('>4xH6x', f.read(12))[0]
+    data = f.read(16 * num_tables)
+    tables = {}
+    for i in range(num_tables):
+        tag, _, table_offset, length = struct.unpack('>4sIII', data[16 * i:16 * i + 16])
+        tables[tag] = (table_offset, length)
+    return tables
+
+
+def _read_families(f, table):
+    """从 name 表读取字体族名（含中文名等本地化名称）"""
+    if table is None:
+        return ()
+    offset, length = table
+    f.seek(offset)
+    data = f.read(length)
+    _, count, string_offset = struct.unpack('>HHH', data[:6])
+
+    families = []
+    for i in range(count):
+        platform_id, _, _, name_id, name_len, name_offset = struct.unpack(
+            '>HHHHHH', data[6 + 12 * i:18 + 12 * i])
+        if name_id not in (1, 16):  # 字体族名 / 排版用字体族名
+            continue
+        raw = data[string_offset + name_offset:string_offset + name_offset + name_len]
+        try:
+            if platform_id in (0, 3):
+                name = raw.decode('utf-16-be')
+            elif platform_id == 1:
+                name = raw.decode('latin-1')
+            else:
+                continue
+        except UnicodeDecodeError:
+            continue
+        name = name.strip().lower()
+        if name and name not in families:
+            families.append(name)
+    return tuple(families)
+
+
+def _read_cmap_ranges(f, table):
+    """从 cmap 表读取 Unicode 码位区间列表 [(起始, 结束), ...]"""
+    if table is None:
+        return []
+    offset, length = table
+    f.seek(offset)
+    data = f.read(length)
+    num_subtables = struct.unpack('>2xH', data[:4])[0]
+
+    # 选择子表：优先完整 Unicode（format 12），其次 BMP（format 4）
+    best = None
+    for i in range(num_subtables):
+        platform_id, encoding_id, sub_offset = struct.unpack('>HHI', data[4 + 8 * i:12 + 8 * i])
+        if platform_id not in (0, 3) or sub_offset + 2 > len(data):
+            continue
+        fmt = struct.unpack('>H', data[sub_offset:sub_offset + 2])[0]
+        if fmt == 12 or (fmt == 4 and (best is None or best[0] != 12)):
+            best = (fmt, sub_offset)
+
+    if best is None:
+        return []
+    fmt, sub_offset = best
+    ranges = []
+    if fmt == 12:
+        num_groups = struct.unpack('>I', data[sub_offset + 12:sub_offset + 16])[0]
+        pos = sub_offset + 16
+        for i in range(num_groups):
+            start, end = struct.unpack('>II', data[pos + 12 * i:pos + 12 * i + 8])
+            ranges.append((start, end))
+    else:
+        seg_count = struct.unpack('>H', data[sub_offset + 6:sub_offset + 8])[0] // 2
+        ends_pos = sub_offset + 14
+        starts_pos = ends_pos + 2 * seg_count + 2
+        ends = struct.unpack(f'>{seg_count}H', data[ends_pos:ends_pos + 2 * seg_count])
+        starts = struct.unpack(f'>{seg_count}H', data[starts_pos:starts_pos + 2 * seg_count])
+        ranges = [(s, e) for s, e in zip(starts, ends) if s != 0xFFFF]
+    return ranges
+
+
+def _covers(ranges, text):
+    """码位区间是否覆盖文本中的全部字符"""
+    for char in text:
+        cp = ord(char)
+        if not any(start <= cp <= end for start, end in ranges):
+            return False
+    return True
+
+
+def read_font_faces(path):
+    """解析字体文件，返回其中每个字体的 FontFace"""
+    faces = []
+    with open(path, 'rb') as f:
+        header = f.read(12)
+        if header[:4] == b'ttcf':
+            num_fonts = struct.unpack('>I', header[8:12])[0]
+            offsets = struct.unpack(f'>{num_fonts}I', f.read(4 * num_fonts))
+        else:
+            offsets = (0,)
+
+        for index, offset in enumerate(offsets):
+            tables = _read_table_dir(f, offset)
+            families = _read_families(f, tables.get(b'name'))
+            ranges = _read_cmap_ranges(f, tables.get(b'cmap'))
+            scripts = frozenset(script for script, sample in SCRIPT_SAMPLES.items()
+                                if _covers(ranges, sample))
+            faces.append(FontFace(path, index, families, scripts))
+    return faces
+
+
+class FontRegistry:
+    """系统字体索引
+
+    字体文件列表和字体信息都在第一次使用时建立，之后查找字体只是字典查询
+    """
+
+    def __init__(self, font_dirs=None):
+        self.font_dirs = font_dirs
+        self._files = None      # 文件名（小写） -> 路径
+        self._faces = None      # 全部 FontFace
+        self._by_family = None  # 字体族名（小写） -> [FontFace]
+        self._by_script = None  # 文字 -> [FontFace]
+        self._resolved = {}     # (族名, 文字) -> FontFace 或 None
+        self._fonts = LRUCache(max_entries=FONT_CACHE_SIZE)
+        self._lock = threading.RLock()
+
+    def _scan_files(self):
+        """列出字体目录中的全部字体文件"""
+        with self._lock:
+            if self._files is None:
+                files = {}
+                visited = set()
+                dirs = self.font_dirs if self.font_dirs is not None else system_font_dirs()
+                for folder in dirs:
+                    for path in _iter_font_files(folder, visited):
+                        files.setdefault(os.path.basename(path).lower(), path)
+                self._files = files
+            return self._files
+
+    def _build_index(self):
+        """解析全部字体文件，按字体族名和文字覆盖范围建立索引"""
+        with self._lock:
+            if self._faces is None:
+                faces = []
+                for path in self._scan_files().values():
+                    try:
+                        faces.extend(read_font_faces(path))
+                    except (OSError, struct.error):
+                        continue
+                by_family = {}
+                by_script = {}
+                for face in faces:
+                    for family in face.families:
+                        by_family.setdefault(family, []).append(face)
+                    for script in face.scripts:
+                        by_script.setdefault(script, []).append(face)
+                self._faces = faces
+                self._by_family = by_family
+                self._by_script = by_script
+
+    def find(self, family=None, script=None):
+        """按字体族名和/或文字覆盖范围查找字体，返回 FontFace 或 None"""
+        key = (family.lower() if family else None, script)
+        with self._lock:
+            if key not in self._resolved:
+                self._resolved[key] = self._find(*key)
+            return self._resolved[key]
+
+    def _find(self, family, script):
+        if family is None and script == 'cjk':
+            # 先按常用中文字体文件名查找，不必解析全部字体
+            files = self._scan_files()
+            for name in PREFERRED_CJK_FILES:
+                if name in files:
+                    try:
+                        faces = read_font_faces(files[name])
+                    except (OSError, struct.error):
+                        continue
+                    for face in faces:
+                        if 'cjk' in face.scripts:
+                            return face
+
+        self._build_index()
+        if family is not None:
+            candidates = self._by_family.get(family, [])
+        else:
+            candidates = self._faces
+        for face in candidates:
+            if script is None or script in face.scripts:
+                return face
+        return None
+
+    def get_font(self, face, size):
+        """按 (字体, 字号) 缓存的 FreeTypeFont"""
+        key = (face.path, face.index, size)
+        font = self._fonts.get(key)
+        if font is None:
+            font = ImageFont.truetype(face.path, size, index=face.index)
+            self._fonts.put(key, font)
+        return font
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """进程内共享的字体索引"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = FontRegistry()
+        return _registry
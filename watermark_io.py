@@ -0,0 +1,23 @@
+"""
+Watermark IO - 文件写入工具
+模板库、导出清单和上次使用的设置共用的原子写入
+"""
+
+import json
+import os
+import threading
+
+
+def write_json_atomic(path, data):
+    """原子写入 JSON：先写临时文件并落盘，再替换原文件，写入中断不会留下损坏的文件"""
+    temp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(temp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, path)
+    except BaseException:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
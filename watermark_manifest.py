@@ -0,0 +1,163 @@
+"""
+Watermark Manifest - 增量导出清单
+在输出文件夹中记录每个输出文件对应的原图哈希和水印/编码设置哈希，
+再次导出时跳过已是最新的文件，中断的批量导出可以接着完成；清单通过替换临时文件原子写入
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+from dataclasses import asdict
+
+from watermark_io import write_json_atomic
+
+MANIFEST_NAME = '.watermark_manifest.json'
+MANIFEST_VERSION = 1
+
+# 导出过程中保存清单的最短间隔（秒），崩溃时最多重做这段时间内完成的图片
+MANIFEST_SAVE_INTERVAL = 2.0
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+def file_digest(path):
+    """文件内容的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def source_fingerprint(path):
+    """原图指纹：大小、修改时间和内容哈希（先取文件状态再读取，避免记录到修改后的时间）"""
+    stat = os.stat(path)
+    return make_fingerprint(stat, file_digest(path))
+
+
+def make_fingerprint(stat, digest):
+    """由读取前取得的文件状态和内容哈希组成原图指纹（已把文件读入内存时使用）"""
+    return {
+        'source_size': stat.st_size,
+        'source_mtime_ns': stat.st_mtime_ns,
+        'source_hash': digest,
+    }
+
+
+def settings_digest(spec, output_format, profile):
+    """影响输出结果的全部设置的哈希：水印设置、输出格式、编码配置以及水印图片内容"""
+    settings = {
+        'version': MANIFEST_VERSION,
+        'spec': spec.to_config(),
+        'format': output_format,
+        'profile': asdict(profile),
+    }
+    if spec.type != 'text' and spec.image_path and os.path.exists(spec.image_path):
+        settings['logo_hash'] = file_digest(spec.image_path)
+    data = json.dumps(settings, sort_keys=True, ensure_ascii=False).encode('utf-8')
+    return hashlib.sha256(data).hexdigest()
+
+
+class ExportManifest:
+    """输出文件夹中的导出清单，按输出文件相对输出文件夹的路径记录
+
+    判断是否最新时先比较原图大小和修改时间，只有变化时才重新计算内容哈希
+    """
+
+    def __init__(self, output_folder):
+        self.folder = output_folder
+        self.path = os.path.join(output_folder, MANIFEST_NAME)
+        self.entries = {}
+        self._dirty = False
+        self._saved_at = time.monotonic()
+        self.load()
+
+    def load(self):
+        """读取清单；文件不存在或无法解析时从空清单开始"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if isinstance(data, dict) and data.get('version') == MANIFEST_VERSION:
+            self.entries = data.get('entries', {})
+
+    def is_current(self, image_path, output_path, digest):
+        """输出文件是否已按相同原图和设置导出过"""
+        entry = self.entries.get(self._key(output_path))
+        if (not entry or entry.get('settings_hash') != digest or
+                entry.get('source') != os.path.abspath(image_path)):
+            return False
+        try:
+            if os.path.getsize(output_path) != entry.get('output_size'):
+                return False
+            stat = os.stat(image_path)
+        except OSError:
+            return False
+
+        if (stat.st_size == entry.get('source_size') and
+                stat.st_mtime_ns == entry.get('source_mtime_ns')):
+            return True
+
+        # 修改时间变了（如复制、touch）：内容没变仍然算最新
+        if stat.st_size != entry.get('source_size'):
+            return False
+        try:
+            fingerprint = source_fingerprint(image_path)
+        except OSError:
+            return False
+        if fingerprint['source_hash'] != entry.get('source_hash'):
+            return False
+        entry.update(fingerprint)
+        self._dirty = True
+        return True
+
+    def source_of(self, output_path):
+        """清单中记录的导出该输出文件的原图，没有记录时返回 None"""
+        entry = self.entries.get(self._key(output_path))
+        return entry.get('source') if entry else None
+
+    def pending(self, jobs, digest):
+        """筛选需要导出的任务，返回 (待导出任务列表, 已是最新的数量)"""
+        pending = [(image_path, output_path) for image_path, output_path in jobs
+                   if not self.is_current(image_path, output_path, digest)]
+        return pending, len(jobs) - len(pending)
+
+    def record(self, image_path, output_path, digest, fingerprint):
+        """记录一个导出完成的文件；fingerprint 为导出时计算的 source_fingerprint"""
+        try:
+            output_size = os.path.getsize(output_path)
+        except OSError:
+            return
+        self.entries[self._key(output_path)] = {
+            'source': os.path.abspath(image_path),
+            **fingerprint,
+            'settings_hash': digest,
+            'output_size': output_size,
+        }
+        self._dirty = True
+
+    def _key(self, output_path):
+        """清单中的键：输出文件相对输出文件夹的路径（以 / 分隔，直接位于输出文件夹中时即文件名）"""
+        return os.path.relpath(output_path, self.folder).replace(os.sep, '/')
+
+    def save_if_due(self):
+        """距离上次保存超过 MANIFEST_SAVE_INTERVAL 时保存（导出过程中定期调用）"""
+        if self._dirty and time.monotonic() - self._saved_at >= MANIFEST_SAVE_INTERVAL:
+            self.save()
+
+    def save(self):
+        """原子写入清单（write_json_atomic：先写临时文件并落盘，再替换原文件）"""
+        if not self._dirty:
+            return
+        try:
+            write_json_atomic(self.path, {'version': MANIFEST_VERSION, 'entries': self.entries})
+        except OSError as e:
+            logger.warning("导出清单保存失败: %s", e)
+            return
+        self._dirty = False
+        self._saved_at = time.monotonic()
@@ -0,0 +1,143 @@
+"""
+Watermark Metrics - 性能统计
+按图片记录各阶段耗时（读取、打开、解码、转换、渲染图层、合成、编码、写入）和缓存命中计数，
+批量导出结束后汇总为各阶段 p50/p95 和吞吐量；没有在收集时记录操作几乎没有开销
+"""
+
+import contextvars
+import logging
+import math
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+# 导出时各阶段的显示顺序
+STAGES = ('read', 'open', 'decode', 'convert', 'render', 'composite', 'encode', 'write')
+
+STAGE_LABELS = {
+    'read': "读取",
+    'open': "打开",
+    'decode': "解码",
+    'convert': "转换",
+    'render': "渲染图层",
+    'composite': "合成",
+    'encode': "编码",
+    'write': "写入",
+}
+
+# 当前正在收集统计的图片（每个线程/上下文独立，预览线程中不收集）
+_current = contextvars.ContextVar('watermark_metrics', default=None)
+
+
+class ImageMetrics:
+    """一张图片的各阶段耗时（秒）和计数"""
+
+    def __init__(self):
+        self.stages = defaultdict(float)
+        self.counters = Counter()
+
+    def as_dict(self):
+        """转为普通字典（可从导出子进程返回）"""
+        return {'stages': dict(self.stages), 'counters': dict(self.counters)}
+
+
+@contextmanager
+def collect(metrics=None):
+    """在 with 块内收集统计，as 得到 ImageMetrics；传入 metrics 时继续累加到该对象
+    （流水线中同一张图片的各阶段在不同线程中依次执行）"""
+    if metrics is None:
+        metrics = ImageMetrics()
+    token = _current.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def stage(name):
+    """记录 with 块的耗时到当前图片的 name 阶段（同一阶段多次进入时累加）"""
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.stages[name] += time.perf_counter() - start
+
+
+def count(name, n=1):
+    """当前图片的计数加 n（如缓存命中/未命中）"""
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.counters[name] += n
+
+
+def cache_result(name, hit):
+    """记录一次缓存查询结果"""
+    count(f"{name}.{'hit' if hit else 'miss'}")
+
+
+def percentile(values, p):
+    """最近秩百分位数（values 已排序）"""
+    if not values:
+        return 0.0
+    rank = max(1, math.ceil(p / 100 * len(values)))
+    return values[rank - 1]
+
+
+class ExportReport:
+    """汇总一次批量导出的统计：各阶段 p50/p95、吞吐量和缓存命中"""
+
+    def __init__(self):
+        self.stages = defaultdict(list)
+        self.counters = Counter()
+        self.images = 0
+        self._start = time.perf_counter()
+        self.elapsed = None
+
+    def add(self, metrics):
+        """加入一张图片的统计（ImageMetrics.as_dict() 的结果）"""
+        if not metrics:
+            return
+        self.images += 1
+        for name, seconds in metrics['stages'].items():
+            self.stages[name].append(seconds)
+        self.counters.update(metrics['counters'])
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self._start
+
+    def lines(self):
+        """汇总文字，每项一行"""
+        if self.elapsed is None:
+            self.finish()
+        lines = []
+        if self.images and self.elapsed > 0:
+            lines.append(f"吞吐量: {self.images / self.elapsed:.2f} 张/s "
+                         f"（{self.images} 张，{self.elapsed:.1f}s）")
+
+        names = [name for name in STAGES if name in self.stages]
+        names += sorted(name for name in self.stages if name not in STAGES)
+        for name in names:
+            values = sorted(self.stages[name])
+            lines.append(f"{STAGE_LABELS.get(name, name)}: "
+                         f"p50 {percentile(values, 50) * 1000:.1f}ms  "
+                         f"p95 {percentile(values, 95) * 1000:.1f}ms")
+
+        caches = sorted({key.rsplit('.', 1)[0] for key in self.counters
+                         if key.endswith(('.hit', '.miss'))})
+        for cache in caches:
+            hits = self.counters[f"{cache}.hit"]
+            misses = self.counters[f"{cache}.miss"]
+            lines.append(f"缓存 {cache}: 命中 {hits} / 未命中 {misses}")
+        return lines
+
+
+def configure_logging(verbose=0):
+    """配置日志输出到 stderr：默认只显示警告和错误，verbose 为 1 时显示信息，2 及以上显示调试"""
+    levels = {0: logging.WARNING, 1: logging.INFO}
+    logging.basicConfig(level=levels.get(verbose, logging.DEBUG),
+                        format='%(levelname)s %(name)s: %(message)s')
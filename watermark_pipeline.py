@@ -0,0 +1,98 @@
+"""
+Watermark Pipeline - 分阶段流水线
+每个阶段由若干线程处理，相邻阶段之间用有界队列连接：读盘、合成、写盘同时进行，
+下游处理不过来时上游阻塞等待，同时在内存中的项数有上限
+"""
+
+import queue
+import threading
+
+# 相邻阶段之间的队列最多排队的项数
+PIPELINE_DEPTH = 2
+
+# 取消后线程检查停止标志的间隔（秒）
+_POLL_SECONDS = 0.1
+
+_DONE = object()  # 阶段结束标记
+
+
+def _put(target, item, stop):
+    """放入队列，队列满时等待；已取消时返回 False"""
+    while not stop.is_set():
+        try:
+            target.put(item, timeout=_POLL_SECONDS)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _get(source, stop):
+    """从队列取出一项，队列空时等待；已取消时返回结束标记"""
+    while not stop.is_set():
+        try:
+            return source.get(timeout=_POLL_SECONDS)
+        except queue.Empty:
+            pass
+    return _DONE
+
+
+def run_pipeline(items, stages, depth=PIPELINE_DEPTH):
+    """按阶段并发处理 items，逐个产出 (结果, 异常或 None)，产出顺序即完成顺序
+
+    stages 为 [(函数, 线程数)]：每个阶段的函数接收上一阶段返回的对象，返回交给下一阶段的对象；
+    某个阶段抛出异常时该项跳过后续阶段，带着异常直接产出。
+    同时在处理的项数不超过 各阶段线程数之和 + 队列容量；调用方提前停止迭代时各线程随即退出
+    """
+    stop = threading.Event()
+    queues = [queue.Queue(maxsize=depth) for _ in stages]
+    results = queue.Queue()
+    outputs = queues[1:] + [results]
+
+    def feed():
+        for item in items:
+            if not _put(queues[0], (item, None), stop):
+                return
+        for _ in range(stages[0][1]):
+            _put(queues[0], _DONE, stop)
+
+    def work(index, func, remaining, lock):
+        source, target = queues[index], outputs[index]
+        while True:
+            entry = _get(source, stop)
+            if entry is _DONE:
+                break
+            item, error = entry
+            if error is None:
+                try:
+                    item = func(item)
+                except Exception as e:
+                    error = e
+            if not _put(target, (item, error), stop):
+                return
+
+        # 本阶段最后一个退出的线程通知下一阶段结束
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            next_threads = stages[index + 1][1] if index + 1 < len(stages) else 1
+            for _ in range(next_threads):
+                _put(target, _DONE, stop)
+
+    threads = [threading.Thread(target=feed, daemon=True)]
+    for index, (func, count) in enumerate(stages):
+        remaining, lock = [count], threading.Lock()
+        threads += [threading.Thread(target=work, args=(index, func, remaining, lock), daemon=True)
+                    for _ in range(count)]
+    for thread in threads:
+        thread.start()
+
+    try:
+        while True:
+            entry = results.get()
+            if entry is _DONE:
+                break
+            yield entry
+    finally:
+        stop.set()
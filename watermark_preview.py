@@ -0,0 +1,198 @@
+"""
+Watermark Preview - 预览底图与渲染调度
+按预览区大小降分辨率解码原图并缓存，拖动滑块或水印时只需重新叠加水印；
+预览在后台线程渲染，连续的修改合并为一次，只显示比当前预览更新的结果
+"""
+
+import logging
+import os
+import threading
+from PIL import Image
+
+from watermark_cache import LRUCache, image_nbytes
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PREVIEW_CACHE_MB = 256
+
+# 先按整数倍 reduce 再做 LANCZOS，3.0 时与直接 LANCZOS 几乎无差别
+PREVIEW_REDUCING_GAP = 3.0
+
+
+def _select_reduced_tiff_page(image, target_size):
+    """多分辨率 TIFF（金字塔/缩略页）：切换到不小于目标尺寸的最小页面"""
+    n_frames = getattr(image, 'n_frames', 1)
+    if n_frames <= 1:
+        return
+
+    full_width, full_height = image.size
+    best_frame, best_width = 0, full_width
+    for frame in range(1, n_frames):
+        image.seek(frame)
+        width, height = image.size
+        # 只接受与主图纵横比一致的缩小页面（允许 1 像素取整误差）
+        same_aspect = abs(width * full_height - height * full_width) <= full_width + full_height
+        if (same_aspect and width < best_width and
+                width >= target_size[0] and height >= target_size[1]):
+            best_frame, best_width = frame, width
+    image.seek(best_frame)
+
+
+def decode_reduced(image, target_size):
+    """按目标尺寸降分辨率解码已打开的图片，并缩放到 target_size
+
+    JPEG 使用 draft 在 DCT 域直接按 1/2、1/4、1/8 解码；
+    多分辨率 TIFF 选用合适的缩小页面；其余格式解码后先整数倍 reduce 再精确缩放
+    """
+    if image.format in ('JPEG', 'MPO'):
+        image.draft(None, target_size)
+    elif image.format == 'TIFF':
+        _select_reduced_tiff_page(image, target_size)
+
+    return image.resize(target_size, Image.Resampling.LANCZOS,
+                        reducing_gap=PREVIEW_REDUCING_GAP)
+
+
+def load_preview_base(image_path, canvas_width, canvas_height):
+    """加载原图并保持纵横比缩放到预览区大小，返回 (预览底图, 缩放比例)"""
+    with Image.open(image_path) as original:
+        # 按原图尺寸计算缩放比例（降分辨率解码前）
+        ratio = min(canvas_width / original.width, canvas_height / original.height)
+        ratio = min(ratio, 1.0)  # 不放大
+
+        new_width = max(1, int(original.width * ratio))
+        new_height = max(1, int(original.height * ratio))
+
+        display_img = decode_reduced(original, (new_width, new_height))
+
+    return display_img, ratio
+
+
+class PreviewBaseCache:
+    """预览底图缓存，按 (路径, 修改时间, 预览区尺寸) 索引，按内存占用淘汰"""
+
+    def __init__(self, max_mb=DEFAULT_PREVIEW_CACHE_MB):
+        self._cache = LRUCache(max_bytes=int(max_mb * 1024 * 1024),
+                               sizeof=lambda entry: image_nbytes(entry[0]))
+
+    def set_max_mb(self, max_mb):
+        """修改内存上限（MB）"""
+        self._cache.set_limits(max_bytes=int(max_mb * 1024 * 1024))
+
+    def get(self, image_path, canvas_width, canvas_height):
+        """获取预览底图，返回 (预览底图, 缩放比例)；返回的图片为共享对象，不可原地修改"""
+        mtime = os.stat(image_path).st_mtime_ns
+        key = (image_path, mtime, canvas_width, canvas_height)
+
+        entry = self._cache.get(key)
+        if entry is None:
+            entry = load_preview_base(image_path, canvas_width, canvas_height)
+            self._cache.put(key, entry)
+        return entry
+
+    def clear(self):
+        """清空缓存"""
+        self._cache.clear()
+
+
+class PreviewScheduler:
+    """预览渲染调度器
+
+    request() 在 Tk 线程调用：一帧（frame_ms）内的多次请求合并为一次，
+    交给后台线程执行 render(job, is_stale)；渲染期间到达的新请求会覆盖尚未开始的旧请求。
+    渲染完成的结果只要比已显示的新就通过 publish(job, result) 在 Tk 线程显示
+    （连续拖动滑块、单次渲染比事件间隔还慢时预览仍然跟着更新），比已显示的旧或已被 cancel 作废的结果丢弃。
+    render 可在耗时步骤之间调用 is_stale() 提前放弃，返回 None 表示不显示
+    """
+
+    def __init__(self, root, render, publish, frame_ms=16, poll_ms=10):
+        self.root = root
+        self.render = render
+        self.publish = publish
+        self.frame_ms = frame_ms
+        self.poll_ms = poll_ms
+
+        # 以下只在 Tk 线程读写
+        self._pending = None       # 等待派发的最新请求
+        self._dispatch_id = None
+        self._poll_id = None
+        self._dispatched = 0       # 最近派发给后台线程的请求编号
+
+        # 以下由后台线程和 Tk 线程共享（只在 Tk 线程修改）
+        self._generation = 0       # 最新请求编号
+        self._shown = 0            # 已显示的结果的请求编号；cancel 时设为最新编号，之前的渲染都作废
+        self._cond = threading.Condition()
+        self._queued = None        # 等待后台线程处理的请求 (编号, job)
+        self._done = None          # 最近完成的渲染 (编号, job, result)
+        self._finished = 0         # 后台线程处理完（含丢弃）的最大请求编号
+
+        self._thread = threading.Thread(target=self._worker, name='preview-renderer', daemon=True)
+        self._thread.start()
+
+    def request(self, job):
+        """请求渲染预览（Tk 线程）"""
+        self._generation += 1
+        self._pending = (self._generation, job)
+        if self._dispatch_id is None:
+            self._dispatch_id = self.root.after(self.frame_ms, self._dispatch)
+
+    def cancel(self):
+        """作废所有未显示的渲染（Tk 线程）"""
+        self._generation += 1
+        self._shown = self._generation
+        self._pending = None
+
+    def is_stale(self, generation):
+        """渲染结果是否已经不会显示（不比已显示的结果新，或已被 cancel 作废）"""
+        return generation <= self._shown
+
+    def _dispatch(self):
+        self._dispatch_id = None
+        if self._pending is None:
+            return
+        with self._cond:
+            # 覆盖后台线程尚未开始的旧请求
+            self._queued = self._pending
+            self._cond.notify()
+        self._dispatched = self._pending[0]
+        self._pending = None
+        self._schedule_poll()
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while self._queued is None:
+                    self._cond.wait()
+                generation, job = self._queued
+                self._queued = None
+
+            result = None
+            if not self.is_stale(generation):
+                try:
+                    result = self.render(job, lambda: self.is_stale(generation))
+                except Exception:
+                    logger.exception("预览错误")
+
+            with self._cond:
+                if result is not None:
+                    self._done = (generation, job, result)
+                self._finished = max(self._finished, generation)
+
+    def _schedule_poll(self):
+        if self._poll_id is None:
+            self._poll_id = self.root.after(self.poll_ms, self._poll)
+
+    def _poll(self):
+        """在 Tk 线程检查后台渲染结果"""
+        self._poll_id = None
+        with self._cond:
+            done, self._done = self._done, None
+            finished = self._finished
+
+        if done is not None and not self.is_stale(done[0]):
+            self._shown = done[0]
+            self.publish(done[1], done[2])
+
+        # 还有派发出去但未完成的渲染时继续检查
+        if finished < self._dispatched:
+            self._schedule_poll()
@@ -0,0 +1,650 @@
+"""
+Watermark Renderer - 水印渲染
+不依赖 Tk 的水印渲染引擎：不可变的水印设置 WatermarkSpec 和持有字体/图层缓存的 Renderer，
+预览、导出、导出子进程和命令行共用同一份实现
+"""
+
+import dataclasses
+import logging
+import os
+import threading
+from dataclasses import asdict, dataclass
+from PIL import Image, ImageDraw, ImageFont
+
+from watermark_blend import PreparedOverlay, blend_rgb, default_backend
+from watermark_cache import LRUCache
+from watermark_fonts import get_registry
+from watermark_metrics import stage
+
+logger = logging.getLogger(__name__)
+
+# 渲染好的文本水印图层缓存：批量导出时相同设置只渲染一次
+TEXT_LAYER_CACHE_SIZE = 32
+
+# 水印图片缓存：解码后的原图，以及缩放/透明度/旋转后的图层
+LOGO_CACHE_SIZE = 4
+IMAGE_LAYER_CACHE_SIZE = 32
+
+# 平铺水印的整行叠加层缓存（每项约为 图片宽度 x 行高 x 4 字节）
+TILE_ROW_CACHE_SIZE = 4
+
+# 预先生成的叠加层缓存（每像素 4 字节，numpy 后端另加 12 字节）
+PREPARED_CACHE_MB = 128
+
+# 水印图层粘贴到的透明底色（与原整幅透明图层的底色一致，影响半透明边缘的颜色）
+TEXT_FILL = (0, 0, 0, 0)
+IMAGE_FILL = (255, 255, 255, 0)
+
+
+@dataclass(frozen=True)
+class WatermarkSpec:
+    """水印设置（不可变、可哈希，可作为缓存键，也可直接传给导出子进程）
+
+    字段与模板中的键相同，默认值与界面控件的初始值一致
+    """
+    type: str = 'text'
+    text: str = '© 版权所有'
+    font_size: int = 36
+    color: str = '#FFFFFF'
+    opacity: int = 50
+    position: str = 'bottom_right'
+    offset_x: float = 50
+    offset_y: float = 50
+    rotation: int = 0
+    image_path: str = ''
+    wm_scale: int = 100
+    img_opacity: int = 50
+    tiled: bool = False     # 平铺整幅图片（忽略位置设置）
+    tile_spacing: int = 100  # 平铺时相邻水印之间的间距（原图像素）
+    tile_stagger: int = 50   # 平铺时奇数行水平错开的比例（%）
+
+    @classmethod
+    def from_config(cls, config):
+        """由模板/界面设置字典创建（补全默认值并取整）；传入 WatermarkSpec 时原样返回"""
+        if isinstance(config, cls):
+            return config
+        return cls(**normalize_settings(config))
+
+    def to_config(self):
+        """转为普通字典（模板文件中保存的格式）"""
+        return asdict(self)
+
+
+@dataclass(frozen=True, eq=False)
+class RenderPlan:
+    """编译好的水印设置（Renderer.compile 的结果，不可变）
+
+    持有解析好的字体、读取好的水印图片、按 scale_ratio 渲染好的图层和预先生成的叠加层：
+    缩放比例相同时 render 直接使用图层和叠加层，不再查找缓存；缩放比例不同时用其中的字体和水印图片
+    重新生成图层，不再查找字体或读取水印图片。只在创建它的进程内有效，不传给导出子进程
+    """
+    spec: WatermarkSpec
+    scale_ratio: float = 1.0
+    font: object = None      # 文本水印使用的 FontFace（None 为像素位图字体）
+    logo: object = None      # 图片水印的原图（RGBA），水印图片不存在时为 None
+    logo_mtime: int = None   # 读取水印图片时的修改时间（图层缓存键的一部分）
+    layer: object = None     # 水印图层，无需绘制时为 None
+    fill: tuple = None       # 图层合成底色
+    prepared: object = None  # 图层对应的 PreparedOverlay（平铺水印为 None）
+
+
+def spec_of(spec):
+    """RenderPlan、WatermarkSpec 或设置字典对应的 WatermarkSpec"""
+    if isinstance(spec, RenderPlan):
+        return spec.spec
+    return WatermarkSpec.from_config(spec)
+
+
+# 水印设置的默认值（与界面控件的初始值一致）
+DEFAULT_SETTINGS = WatermarkSpec().to_config()
+
+# 界面中用整数变量保存的设置
+INT_SETTINGS = ('font_size', 'opacity', 'rotation', 'wm_scale', 'img_opacity',
+                'tile_spacing', 'tile_stagger')
+
+
+def normalize_settings(config):
+    """补全默认值，并按界面控件的取值方式取整，得到与界面导出时相同的设置"""
+    settings = dict(DEFAULT_SETTINGS)
+    settings.update((key, config[key]) for key in DEFAULT_SETTINGS if key in config)
+    for key in INT_SETTINGS:
+        settings[key] = int(float(settings[key]))
+    settings['tiled'] = bool(settings['tiled'])
+    return settings
+
+
+def has_chinese(text):
+    """检测文本中是否包含中文字符"""
+    for char in text:
+        if '\u4e00' <= char <= '\u9fff':
+            return True
+    return False
+
+
+def rotate_layer(layer, rotation, resample):
+    """旋转水印图层（顺时针），90/180/270 度使用无损转置"""
+    rotation = rotation % 360
+    if rotation == 0:
+        return layer
+    if rotation == 90:
+        return layer.transpose(Image.Transpose.ROTATE_270)
+    if rotation == 180:
+        return layer.transpose(Image.Transpose.ROTATE_180)
+    if rotation == 270:
+        return layer.transpose(Image.Transpose.ROTATE_90)
+    return layer.rotate(-rotation, expand=True, resample=resample)
+
+
+class Renderer:
+    """水印渲染器：把 (图片, WatermarkSpec) 渲染为加水印的图片
+
+    持有字体索引以及文本图层、水印图片、图片图层缓存（线程安全），渲染没有其他副作用；
+    同一进程内的预览线程和串行导出共用 get_renderer() 返回的实例，
+    也可以单独创建实例以隔离缓存（如性能测试）
+    """
+
+    def __init__(self, fonts=None, text_cache_size=TEXT_LAYER_CACHE_SIZE,
+                 logo_cache_size=LOGO_CACHE_SIZE, image_cache_size=IMAGE_LAYER_CACHE_SIZE,
+                 tile_cache_size=TILE_ROW_CACHE_SIZE, blend=None):
+        self._fonts = fonts  # None 时第一次绘制中文时使用进程内共享的字体索引
+        self.blend = blend or default_backend()  # 合成后端：'numpy' 或 'pillow'
+        self.text_layers = LRUCache(max_entries=text_cache_size, name='text_layer')
+        self.logos = LRUCache(max_entries=logo_cache_size, name='logo')
+        self.image_layers = LRUCache(max_entries=image_cache_size, name='image_layer')
+        self.tile_rows = LRUCache(max_entries=tile_cache_size, name='tile_row')
+        self.overlays = LRUCache(max_bytes=PREPARED_CACHE_MB * 1024 * 1024,
+                                 sizeof=lambda item: item[1].nbytes, name='overlay')
+
+    @property
+    def fonts(self):
+        if self._fonts is None:
+            self._fonts = get_registry()
+        return self._fonts
+
+    def compile(self, spec, scale_ratio=1.0):
+        """把水印设置编译为 RenderPlan：解析字体、读取水印图片、渲染图层并生成叠加层
+
+        图层等来自缓存，RenderPlan 持有它们的引用，之后缓存淘汰也不影响；
+        水印图片无法读取时抛出 OSError
+        """
+        spec = WatermarkSpec.from_config(spec)
+        font = logo = logo_mtime = None
+        if spec.type == 'text':
+            font = self.find_text_font(spec.text)
+        elif spec.image_path and os.path.exists(spec.image_path):
+            logo, logo_mtime = self.load_logo(spec.image_path)
+        plan = RenderPlan(spec, scale_ratio, font, logo, logo_mtime)
+        found = self.layer(spec, scale_ratio, plan)
+        layer, fill = found if found is not None else (None, None)
+        prepared = None
+        if layer is not None and not spec.tiled:
+            prepared = self.prepare(layer, fill)
+        return dataclasses.replace(plan, layer=layer, fill=fill, prepared=prepared)
+
+    def render(self, image, spec, scale_ratio=1.0, in_place=False, keep_rgb=False):
+        """添加水印，返回结果图片
+
+        spec 为 WatermarkSpec 或 compile 得到的 RenderPlan（缩放比例相同时直接使用其中的图层，
+        不同时使用其中的字体和水印图片）；
+        scale_ratio 为预览缩放比例；in_place 为 True 时允许直接修改传入的图片（调用方独占该图片时使用）；
+        keep_rgb 为 True 时 RGB 图片不转 RGBA，直接在 RGB 缓冲区上合成（结果为 RGB）；
+        水印无法绘制（如颜色格式无效）时抛出异常，由调用方决定按失败处理还是显示原图
+        """
+        with stage('convert'):
+            if keep_rgb and image.mode == 'RGB':
+                if not in_place:
+                    image = image.copy()
+            # 转换为RGBA以支持透明度（convert 已经生成新图片）
+            elif image.mode != 'RGBA':
+                image = image.convert('RGBA')
+            elif not in_place:
+                image = image.copy()
+
+        plan = _matching_plan(spec, scale_ratio)
+        source, spec = spec, spec_of(spec)
+        if spec.tiled:
+            return self.composite_tiles(image, source, scale_ratio)
+
+        placement = self.place(image.size, source, scale_ratio)
+        if placement is None:
+            return image
+        layer, (x, y), fill = placement
+
+        # 只在水印区域内合并到原图
+        with stage('composite'):
+            if plan is not None:
+                result = composite_layer(image, layer, (x, y), fill, prepared=plan.prepared)
+            else:
+                result = self.composite(image, layer, (x, y), fill)
+
+        if spec.type == 'text':
+            logger.debug("文本水印已添加: '%s' at (%d, %d), size: %dx%d",
+                         spec.text, x, y, layer.width, layer.height)
+        return result
+
+    def layer(self, spec, scale_ratio=1.0, plan=None):
+        """水印图层及其合成底色，返回 (图层, fill)；无需绘制时返回 None
+
+        plan 为该设置的 RenderPlan 时使用其中的字体和水印图片，不再查找字体或读取文件；
+        图层为缓存中的共享对象，不可原地修改
+        """
+        if spec.type == 'text':
+            if not spec.text:
+                return None
+            # 获取用户设置的字体大小
+            font_size = max(10, int(spec.font_size * scale_ratio))
+            face = plan.font if plan is not None else self.find_text_font(spec.text)
+            layer = self.text_layer(spec.text, font_size, spec.color, spec.opacity,
+                                    spec.rotation, face)
+            return (layer, TEXT_FILL) if layer is not None else None
+
+        if plan is not None:
+            if plan.logo is None:
+                return None
+            logo = (plan.logo, plan.logo_mtime)
+        elif spec.image_path and os.path.exists(spec.image_path):
+            logo = None
+        else:
+            return None
+        scale = spec.wm_scale / 100.0 * scale_ratio
+        layer = self.image_layer(spec.image_path, scale, spec.img_opacity, spec.rotation, logo)
+        return layer, IMAGE_FILL
+
+    def place(self, image_size, spec, scale_ratio=1.0):
+        """水印图层及其在图片中的位置，返回 (图层, (x, y), fill)；无需绘制或为平铺水印时返回 None
+
+        spec 可以是 RenderPlan（缩放比例相同时使用其中的图层，不同时使用其中的字体和水印图片）
+        """
+        source, spec = spec, spec_of(spec)
+        if spec.tiled:
+            return None
+        found = self._plan_layer(source, scale_ratio)
+        if found is None:
+            return None
+        layer, fill = found
+
+        img_width, img_height = image_size
+        x, y = calculate_position(spec, img_width, img_height,
+                                  layer.width, layer.height, scale_ratio)
+        if spec.type == 'text':
+            # 文本水印不超出图片边界
+            x = max(0, min(x, img_width - layer.width))
+            y = max(0, min(y, img_height - layer.height))
+        return layer, (int(x), int(y)), fill
+
+    def _plan_layer(self, spec, scale_ratio):
+        """spec（WatermarkSpec 或 RenderPlan）在该缩放比例下的 (图层, fill)，无需绘制时返回 None"""
+        plan = _matching_plan(spec, scale_ratio)
+        if plan is not None:
+            return (plan.layer, plan.fill) if plan.layer is not None else None
+        plan = spec if isinstance(spec, RenderPlan) else None
+        with stage('render'):
+            return self.layer(spec_of(spec), scale_ratio, plan)
+
+    def locate(self, image_size, spec, scale_ratio=1.0):
+        """水印在原图坐标系中的位置 (x, y)（拖拽时作为自定义位置的起点）；没有水印或为平铺水印时返回 None"""
+        if spec.tiled:
+            return None
+        found = self.layer(spec, scale_ratio)
+        if found is None:
+            return None
+        layer, _ = found
+
+        if spec.position == 'custom':
+            return int(spec.offset_x), int(spec.offset_y)
+        if scale_ratio <= 0:
+            return None
+        x, y = calculate_position(spec, image_size[0], image_size[1],
+                                  layer.width, layer.height, scale_ratio)
+        # 转换回原始坐标
+        return int(x / scale_ratio), int(y / scale_ratio)
+
+    def overlay(self, image_size, spec, scale_ratio=1.0):
+        """水印叠加层及其位置，返回 (叠加层, (x, y))；没有水印时返回 None
+
+        叠加层按该位置直接 alpha 合成到图片上即与 render 的结果一致，
+        预览拖拽时作为独立的画布对象显示
+        """
+        placement = self.place(image_size, spec, scale_ratio)
+        if placement is None:
+            return None
+        layer, position, fill = placement
+        return make_overlay(layer, fill), position
+
+    def composite(self, image, layer, position, fill=TEXT_FILL):
+        """用当前合成后端把水印图层合成到 image 上（原地修改 image 并返回），同 composite_layer"""
+        return composite_layer(image, layer, position, fill,
+                               prepared=self.prepare(layer, fill))
+
+    def prepare(self, source, fill=None):
+        """图层对应的 PreparedOverlay（带缓存），fill 为 None 时 source 本身就是叠加层
+
+        source 应为缓存中的共享图层：按对象身份缓存，图层对象不变时叠加层一定有效
+        """
+        key = (id(source), fill)
+        cached = self.overlays.get(key, valid=lambda item: item[0] is source)
+        if cached is not None:
+            return cached[1]
+        overlay = source if fill is None else make_overlay(source, fill)
+        prepared = PreparedOverlay(overlay, use_numpy=self.blend == 'numpy')
+        self.overlays.put(key, (source, prepared))
+        return prepared
+
+    def tile_row(self, spec, scale_ratio, width):
+        """平铺水印的一整行叠加层（带缓存），返回 (叠加层, 水平间隔, 行高, 错开像素)；无需绘制时返回 None
+
+        spec 可以是 RenderPlan；叠加层宽度为 width 加一个水平间隔，各行按错开像素平移后合成即可覆盖整幅图片；
+        叠加层为缓存中的共享对象，不可原地修改
+        """
+        found = self._plan_layer(spec, scale_ratio)
+        spec = spec_of(spec)
+        with stage('render'):
+            if found is None:
+                return None
+            layer, fill = found
+            if layer.width <= 0 or layer.height <= 0:
+                return None
+
+            spacing = max(0, int(spec.tile_spacing * scale_ratio))
+            pitch_x = layer.width + spacing
+            pitch_y = layer.height + spacing
+            stagger = pitch_x * (spec.tile_stagger % 100) // 100
+
+            # 图层本身来自缓存，同一设置下只要图层对象没变，整行叠加层就可以复用
+            key = (spec, scale_ratio, width)
+            cached = self.tile_rows.get(key, valid=lambda item: item[0] is layer)
+            if cached is not None:
+                row = cached[1]
+            else:
+                row = _build_tile_row(layer, fill, spacing, width + pitch_x)
+                self.tile_rows.put(key, (layer, row))
+        return row, pitch_x, pitch_y, stagger
+
+    def composite_tiles(self, image, spec, scale_ratio=1.0, top=0):
+        """把平铺水印合成到 image 上（原地修改 image 并返回）
+
+        spec 可以是 RenderPlan；image 可以是整幅图片中从第 top 行开始、宽度相同的一个条带（分块导出时使用），
+        结果与整幅合成后取出该条带相同；每行只做一次合成，总耗时接近一次整幅合成
+        """
+        tiles = self.tile_row(spec, scale_ratio, image.width)
+        if tiles is None:
+            return image
+        row, pitch_x, pitch_y, stagger = tiles
+        prepared = self.prepare(row)
+
+        with stage('composite'):
+            for index in range(top // pitch_y, (top + image.height - 1) // pitch_y + 1):
+                shift = stagger if index % 2 else 0
+                composite_overlay(image, prepared, (shift - pitch_x, index * pitch_y - top))
+        return image
+
+    def find_text_font(self, text):
+        """选择文本使用的字体：含中文时返回系统中文字体，否则返回 None（使用像素位图字体）"""
+        if not has_chinese(text):
+            return None
+        return self.fonts.find(script='cjk')
+
+    def text_layer(self, text, font_size, color, opacity, rotation, face):
+        """渲染旋转后的文本水印图层（带缓存）
+
+        font_size 为实际像素字号（已乘预览缩放比例），face 为 find_text_font 选择的字体；
+        返回的图层为共享对象，不可原地修改；文本无法绘制时返回 None
+        """
+        key = (text, font_size, color, opacity, rotation, face)
+        layer = self.text_layers.get(key)
+        if layer is None:
+            layer = self._build_text_layer(text, font_size, color, opacity, rotation, face)
+            if layer is not None:
+                self.text_layers.put(key, layer)
+        return layer
+
+    def _build_text_layer(self, text, font_size, color, opacity, rotation, face):
+        """绘制文本水印图层"""
+        # 检测是否包含中文
+        has_cn = has_chinese(text)
+
+        # 选择字体
+        if has_cn:
+            # 中文：使用系统中文字体
+            if face is None:
+                logger.warning("无法加载中文字体，中文可能无法显示")
+                font = ImageFont.load_default()
+                scale_factor = max(1, font_size // 11)
+            else:
+                font = self.fonts.get_font(face, font_size)
+                scale_factor = 1  # TrueType字体已经是正确大小
+        else:
+            # 英文：使用默认位图字体并放大
+            font = ImageFont.load_default()
+            scale_factor = max(1, font_size // 11)
+
+        # 创建临时画布来测量文本
+        temp_img = Image.new('RGBA', (1, 1))
+        temp_draw = ImageDraw.Draw(temp_img)
+        bbox = temp_draw.textbbox((0, 0), text, font=font)
+        base_text_width = bbox[2] - bbox[0]
+        base_text_height = bbox[3] - bbox[1]
+
+        if base_text_width <= 0 or base_text_height <= 0:
+            logger.info("文本大小无效: %dx%d", base_text_width, base_text_height)
+            return None
+
+        # 创建文本图层（留出足够空间）
+        text_layer = Image.new('RGBA', (base_text_width + 20, base_text_height + 20), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(text_layer)
+
+        # 颜色和透明度
+        r = int(color[1:3], 16)
+        g = int(color[3:5], 16)
+        b = int(color[5:7], 16)
+        alpha = int(opacity * 2.55)
+
+        # 绘制文本
+        draw.text((10, 10), text, font=font, fill=(r, g, b, alpha))
+
+        # 裁剪到实际内容
+        bbox = text_layer.getbbox()
+        if not bbox:
+            logger.info("文本bbox为空")
+            return None
+
+        text_layer = text_layer.crop(bbox)
+
+        # 如果是位图字体，需要放大
+        if scale_factor > 1:
+            scaled_width = text_layer.width * scale_factor
+            scaled_height = text_layer.height * scale_factor
+            if scaled_width > 0 and scaled_height > 0:
+                text_layer = text_layer.resize(
+                    (scaled_width, scaled_height),
+                    Image.Resampling.NEAREST
+                )
+
+        # 旋转：中文用BICUBIC，英文用NEAREST保持像素风格
+        resample = Image.Resampling.BICUBIC if has_cn else Image.Resampling.NEAREST
+        return rotate_layer(text_layer, rotation, resample)
+
+    def load_logo(self, path):
+        """读取水印图片（RGBA），按 (路径, 修改时间) 缓存；文件修改后自动重新读取
+
+        返回 (图片, 修改时间)；图片为共享对象，不可原地修改
+        """
+        mtime = os.stat(path).st_mtime_ns
+        key = (path, mtime)
+        watermark = self.logos.get(key)
+        if watermark is None:
+            with Image.open(path) as source:
+                watermark = source.convert('RGBA') if source.mode != 'RGBA' else source.copy()
+            self.logos.put(key, watermark)
+        return watermark, mtime
+
+    def image_layer(self, path, scale, opacity, rotation, logo=None):
+        """缩放、调整透明度并旋转后的图片水印图层（带缓存）
+
+        scale 为实际缩放比例（已乘预览缩放比例），opacity 为 0-100；
+        logo 为已读取的 (原图, 修改时间)（来自 RenderPlan），None 时用 load_logo 读取；
+        返回的图层为共享对象，不可原地修改
+        """
+        watermark, mtime = logo if logo is not None else self.load_logo(path)
+
+        # 缩放后的尺寸作为键，预览缩放比例略有变化时可复用
+        wm_width = int(watermark.width * scale)
+        wm_height = int(watermark.height * scale)
+        key = (path, mtime, wm_width, wm_height, opacity, rotation)
+        layer = self.image_layers.get(key)
+        if layer is None:
+            layer = _build_image_layer(watermark, (wm_width, wm_height), opacity, rotation)
+            self.image_layers.put(key, layer)
+        return layer
+
+
+def _build_image_layer(watermark, size, opacity, rotation):
+    """生成图片水印图层"""
+    # 缩放水印
+    watermark = watermark.resize(size, Image.Resampling.LANCZOS)
+
+    # 调整透明度
+    opacity = opacity / 100.0
+    alpha = watermark.split()[3]
+    alpha = alpha.point(lambda p: int(p * opacity))
+    watermark.putalpha(alpha)
+
+    # 旋转
+    if rotation != 0:
+        watermark = rotate_layer(watermark, rotation, Image.Resampling.BICUBIC)
+    return watermark
+
+
+def _build_tile_row(layer, fill, spacing, width):
+    """生成平铺水印的一行叠加层：单元格（水印加四周间距）只生成一次，再按倍增方式复制填满整行"""
+    pitch_x = layer.width + spacing
+    pitch_y = layer.height + spacing
+    cell = Image.new('RGBA', (pitch_x, pitch_y), fill)
+    cell.paste(layer, (spacing // 2, spacing // 2), layer)
+
+    row = Image.new('RGBA', (width, pitch_y))
+    row.paste(cell, (0, 0))
+    filled = pitch_x
+    while filled < width:
+        row.paste(row.crop((0, 0, filled, pitch_y)), (filled, 0))
+        filled *= 2
+    return row
+
+
+def _matching_plan(spec, scale_ratio):
+    """spec 为相同缩放比例的 RenderPlan 时返回它，否则返回 None"""
+    if isinstance(spec, RenderPlan) and spec.scale_ratio == scale_ratio:
+        return spec
+    return None
+
+
+_renderer = None
+_renderer_lock = threading.Lock()
+
+
+def get_renderer():
+    """进程内共享的渲染器（预览线程、串行导出和导出子进程各自复用缓存）"""
+    global _renderer
+    with _renderer_lock:
+        if _renderer is None:
+            _renderer = Renderer()
+        return _renderer
+
+
+def make_overlay(layer, fill):
+    """以水印自身为蒙版把它粘贴到 fill 颜色的透明底上，得到实际参与合成的叠加层"""
+    overlay = Image.new('RGBA', layer.size, fill)
+    overlay.paste(layer, (0, 0), layer)
+    return overlay
+
+
+def composite_layer(image, layer, position, fill=TEXT_FILL, prepared=None):
+    """把水印图层合成到 image（RGBA 或 RGB）上（原地修改 image 并返回）
+
+    只处理水印所在区域，不分配整幅透明图层；结果与“新建整幅 fill 颜色的透明图层、
+    以水印自身为蒙版粘贴、再整幅 alpha_composite”逐像素一致。
+    RGB 图片只把水印区域临时转为 RGBA 合成，等同于整幅转 RGBA 合成后再转回 RGB。
+    prepared 为该图层预先生成的 PreparedOverlay（见 Renderer.prepare）
+    """
+    x, y = int(position[0]), int(position[1])
+
+    # 水印完全在图片之外时不生成叠加层
+    if (x >= image.width or y >= image.height or
+            x + layer.width <= 0 or y + layer.height <= 0):
+        return image
+    if prepared is None:
+        prepared = PreparedOverlay(make_overlay(layer, fill))
+    return composite_overlay(image, prepared, (x, y))
+
+
+def composite_overlay(image, overlay, position):
+    """把叠加层在 position 处 alpha 合成到 image（RGBA 或 RGB）上，只处理相交区域（原地修改 image 并返回）
+
+    overlay 为 make_overlay 的结果或 PreparedOverlay；PreparedOverlay 带 numpy 数组时
+    RGB 图片用 numpy 混合（与 Pillow 合成的误差不超过 1）
+    """
+    prepared = overlay if isinstance(overlay, PreparedOverlay) else None
+    if prepared is not None:
+        overlay = prepared.image
+
+    x, y = int(position[0]), int(position[1])
+
+    # 叠加层与图片的相交区域（叠加层可能部分超出图片）
+    left, top = max(0, x), max(0, y)
+    right = min(image.width, x + overlay.width)
+    bottom = min(image.height, y + overlay.height)
+    if left >= right or top >= bottom:
+        return image
+
+    source = (left - x, top - y, right - x, bottom - y)
+    if prepared is not None and prepared.can_blend(image):
+        blend_rgb(image, prepared, (left, top, right, bottom), source)
+        return image
+
+    if image.mode == 'RGBA':
+        image.alpha_composite(overlay, dest=(left, top), source=source)
+    else:
+        box = (left, top, right, bottom)
+        region = image.crop(box).convert('RGBA')
+        region.alpha_composite(overlay, source=source)
+        image.paste(region.convert(image.mode), box)
+    return image
+
+
+# 预设位置（custom 为拖拽后的自定义位置）
+POSITIONS = ('top_left', 'top_center', 'top_right', 'middle_left', 'center', 'middle_right',
+             'bottom_left', 'bottom_center', 'bottom_right', 'custom')
+
+
+def calculate_position(spec, img_width, img_height, wm_width, wm_height, scale_ratio=1.0):
+    """计算水印在（缩放后）图片中的位置"""
+    position = spec.position
+
+    # 如果是自定义位置，使用原始图片坐标，然后根据缩放比例调整
+    if position == 'custom':
+        # 根据缩放比例调整位置（用于预览）
+        x = int(int(spec.offset_x) * scale_ratio)
+        y = int(int(spec.offset_y) * scale_ratio)
+
+        # 确保位置在图片范围内
+        x = max(0, min(x, img_width - max(1, wm_width)))
+        y = max(0, min(y, img_height - max(1, wm_height)))
+        return (x, y)
+
+    # 预设位置的偏移量需要根据缩放比例调整
+    offset_x = int(spec.offset_x * scale_ratio)
+    offset_y = int(spec.offset_y * scale_ratio)
+
+    positions = {
+        'top_left': (offset_x, offset_y),
+        'top_center': ((img_width - wm_width) // 2, offset_y),
+        'top_right': (img_width - wm_width - offset_x, offset_y),
+        'middle_left': (offset_x, (img_height - wm_height) // 2),
+        'center': ((img_width - wm_width) // 2, (img_height - wm_height) // 2),
+        'middle_right': (img_width - wm_width - offset_x, (img_height - wm_height) // 2),
+        'bottom_left': (offset_x, img_height - wm_height - offset_y),
+        'bottom_center': ((img_width - wm_width) // 2, img_height - wm_height - offset_y),
+        'bottom_right': (img_width - wm_width - offset_x, img_height - wm_height - offset_y),
+    }
+
+    return positions.get(position, positions['bottom_right'])
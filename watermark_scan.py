@@ -0,0 +1,59 @@
+"""
+Watermark Scan - 图片文件扫描
+基于 os.scandir 的流式递归扫描，每个目录只读取一次，边扫描边产出结果
+"""
+
+import os
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.tif')
+
+
+def is_image_file(path):
+    """按扩展名（不区分大小写）判断是否为支持的图片文件"""
+    return path.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def path_key(path):
+    """路径去重用的键（在不区分大小写的文件系统上统一大小写）"""
+    return os.path.normcase(os.path.abspath(path))
+
+
+def iter_image_files(folder, recursive=True):
+    """流式扫描目录中的图片文件，按文件名排序，子目录在当前目录的文件之后"""
+    try:
+        with os.scandir(folder) as it:
+            entries = sorted(it, key=lambda entry: entry.name.lower())
+    except OSError:
+        return
+
+    subfolders = []
+    for entry in entries:
+        try:
+            if entry.is_file():
+                if is_image_file(entry.name):
+                    yield entry.path
+            elif recursive and entry.is_dir(follow_symlinks=False):
+                subfolders.append(entry.path)
+        except OSError:
+            continue
+
+    for subfolder in subfolders:
+        yield from iter_image_files(subfolder, recursive)
+
+
+def relative_folder(path, root):
+    """图片所在文件夹相对扫描的根文件夹的路径（直接位于根文件夹中时为 ''）"""
+    folder = os.path.relpath(os.path.dirname(path), root)
+    return '' if folder == os.curdir else folder
+
+
+def iter_image_entries(paths, recursive=True):
+    """展开文件和文件夹列表，产出 (图片路径, 相对文件夹)：文件夹递归扫描，
+    其中的图片带相对该文件夹的子文件夹路径（导出时保持目录结构），直接给出的图片为 ''"""
+    for path in paths:
+        if os.path.isdir(path):
+            for image_path in iter_image_files(path, recursive):
+                yield image_path, relative_folder(image_path, path)
+        elif os.path.isfile(path) and is_image_file(path):
+            yield path, ''
+
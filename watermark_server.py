@@ -0,0 +1,416 @@
+"""
+Watermark Server - 本地 HTTP 水印服务
+其他程序（CMS 上传、电商流水线等）通过 HTTP 提交图片数据，返回加好水印的图片；
+进程常驻，字体、水印图片和渲染好的水印图层在请求之间保持缓存，
+请求分配到固定数量的工作线程，超出排队上限时立即返回 503
+
+示例:
+    python watermark_server.py --port 8765 --workers 4
+    curl --data-binary @photo.jpg "http://127.0.0.1:8765/watermark?template=版权" -o out.jpg
+    curl --data-binary @photo.jpg -H 'X-Watermark-Spec: {"text": "WM"}' \\
+         "http://127.0.0.1:8765/watermark?format=WEBP&profile=fast" -o out.webp
+    curl http://127.0.0.1:8765/metrics
+
+接口:
+    POST /watermark   请求体为原图数据；查询参数 template（模板名）或 spec（JSON 水印设置，
+                      也可放在 X-Watermark-Spec 请求头中，UTF-8 或百分号编码），format（默认与
+                      原图相同，不支持时为 PNG），profile（默认使用模板中的编码配置）；
+                      水印设置无效（含 image_path 指定的水印图片不存在或无法读取）时返回 400，
+                      模板不存在时返回 404
+    GET  /metrics     吞吐量、延迟 p50/p95/p99、各阶段耗时和缓存命中（JSON）
+    GET  /healthz     存活检查
+"""
+
+import argparse
+import io
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+from PIL import Image
+
+from watermark_encode import OUTPUT_FORMATS, get_profile
+from watermark_export import default_workers, encode_export
+from watermark_metrics import STAGES, collect, configure_logging, percentile
+from watermark_render import WatermarkSpec, get_renderer
+from watermark_templates import TEMPLATES_NAME, TemplateStore, validate_template
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+# 每个工作线程最多排队的请求数，超出时返回 503
+QUEUE_PER_WORKER = 2
+
+# 请求体大小上限（MB）
+MAX_BODY_MB = 200
+
+# 延迟统计保留最近多少个请求
+LATENCY_WINDOW = 1000
+
+# 吞吐量按最近多少秒计算
+THROUGHPUT_WINDOW = 60.0
+
+CONTENT_TYPES = {
+    'PNG': 'image/png',
+    'JPEG': 'image/jpeg',
+    'WEBP': 'image/webp',
+}
+
+logger = logging.getLogger(__name__)
+
+
+class RequestError(Exception):
+    """请求参数错误，status 为返回的 HTTP 状态码"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def guess_format(data):
+    """按文件头判断原图格式，作为默认输出格式（不是 JPEG/WebP 时为 PNG）"""
+    if data[:3] == b'\xff\xd8\xff':
+        return 'JPEG'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP' and 'WEBP' in OUTPUT_FORMATS:
+        return 'WEBP'
+    return 'PNG'
+
+
+def decode_spec_header(value):
+    """解码 X-Watermark-Spec 请求头：UTF-8 JSON，或经过百分号编码的 UTF-8 JSON
+
+    http.server 按 latin-1 解码请求头，这里还原为原始字节后按 UTF-8 解码，中文不会变成乱码
+    """
+    if not value:
+        return value
+    try:
+        value = value.encode('latin-1').decode('utf-8')
+    except UnicodeError:
+        raise RequestError(HTTPStatus.BAD_REQUEST, "X-Watermark-Spec 请求头不是 UTF-8 编码")
+    if not value.lstrip().startswith('{'):
+        value = unquote(value)
+    return value
+
+
+def inline_plan(config):
+    """请求中直接给出的（已校验的）水印设置：图片水印编译为 RenderPlan，水印图片不存在或无法读取时
+    抛出 RequestError(400)（错误信息不含服务器上的路径）；文本水印返回 WatermarkSpec"""
+    spec = WatermarkSpec.from_config(config)
+    if spec.type != 'image':
+        return spec
+    if not spec.image_path or not os.path.isfile(spec.image_path):
+        raise RequestError(HTTPStatus.BAD_REQUEST, "image_path 指定的水印图片不存在")
+    try:
+        return get_renderer().compile(spec)
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError):
+        raise RequestError(HTTPStatus.BAD_REQUEST, "image_path 指定的水印图片无法读取")
+
+
+class ServiceMetrics:
+    """服务统计：请求计数、最近请求的延迟和各阶段耗时、缓存命中（线程安全）"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.statuses = Counter()
+        self.rejected = 0
+        self.in_flight = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.completed = deque()  # 最近 THROUGHPUT_WINDOW 秒内完成的时间
+        self.stages = {name: deque(maxlen=LATENCY_WINDOW) for name in STAGES}
+        self.counters = Counter()
+        self._lock = threading.Lock()
+
+    def begin(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def end(self, status, seconds, metrics=None):
+        """记录一个处理完的请求；metrics 为 ImageMetrics（成功时）"""
+        now = time.monotonic()
+        with self._lock:
+            self.in_flight -= 1
+            self.statuses[int(status)] += 1
+            if metrics is None:
+                return
+            self.latencies.append(seconds)
+            self.completed.append(now)
+            for name, value in metrics.stages.items():
+                self.stages.setdefault(name, deque(maxlen=LATENCY_WINDOW)).append(value)
+            self.counters.update(metrics.counters)
+
+    def record(self, status):
+        """记录一个没有进入处理的请求（参数错误、排队已满）"""
+        with self._lock:
+            self.statuses[int(status)] += 1
+            if status == HTTPStatus.SERVICE_UNAVAILABLE:
+                self.rejected += 1
+
+    def snapshot(self):
+        """当前统计（/metrics 返回的 JSON），时间单位为毫秒"""
+        now = time.monotonic()
+        with self._lock:
+            while self.completed and now - self.completed[0] > THROUGHPUT_WINDOW:
+                self.completed.popleft()
+            window = min(THROUGHPUT_WINDOW, now - self.started) or 1.0
+            latencies = sorted(self.latencies)
+            stages = {name: sorted(values) for name, values in self.stages.items() if values}
+            return {
+                'uptime_seconds': round(now - self.started, 1),
+                'requests': sum(self.statuses.values()),
+                'statuses': {str(status): n for status, n in sorted(self.statuses.items())},
+                'rejected': self.rejected,
+                'in_flight': self.in_flight,
+                'throughput_per_second': round(len(self.completed) / window, 2),
+                'latency_ms': _percentiles(latencies),
+                'stages_ms': {name: _percentiles(values) for name, values in stages.items()},
+                'cache': dict(self.counters),
+            }
+
+
+def _percentiles(values):
+    return {f"p{p}": round(percentile(values, p) * 1000, 1) for p in (50, 95, 99)}
+
+
+class WatermarkService:
+    """水印服务的处理逻辑（不依赖 HTTP）：解析设置、在工作线程中渲染、记录统计
+
+    所有请求共用进程内的 get_renderer()，字体索引和各级图层缓存在请求之间保持；
+    模板请求直接使用模板库中编译好的 RenderPlan，不同模板交替请求也不必重新准备图层
+    """
+
+    def __init__(self, templates_file=None, workers=None, queue_per_worker=QUEUE_PER_WORKER):
+        self.templates = TemplateStore(templates_file)
+        self.workers = workers or default_workers()
+        self.capacity = self.workers * (1 + queue_per_worker)
+        self.pool = ThreadPoolExecutor(max_workers=self.workers,
+                                       thread_name_prefix='watermark-worker')
+        self.metrics = ServiceMetrics()
+        self._slots = threading.BoundedSemaphore(self.capacity)
+
+    def warm_up(self):
+        """提前加载字体索引并编译所有模板（第一个请求不必等待扫描系统字体和渲染图层）"""
+        get_renderer().fonts
+        for name, error in self.templates.compile_all().items():
+            logger.warning("模板 '%s' 编译失败: %s", name, error)
+
+    def resolve(self, query, headers):
+        """由查询参数和请求头得到 (WatermarkSpec 或 RenderPlan, EncoderProfile, 输出格式或 None)"""
+        template = query.get('template')
+        inline = query.get('spec') or decode_spec_header(headers.get('X-Watermark-Spec'))
+        if bool(template) == bool(inline):
+            raise RequestError(HTTPStatus.BAD_REQUEST, "需要 template 或 spec 参数之一")
+        try:
+            if template:
+                compiled = self.templates.template(template)
+                spec = compiled.plan
+                profile = get_profile(query['profile']) if query.get('profile') else compiled.profile
+            else:
+                # 与模板相同的校验，设置无效时返回 400 而不是原样返回图片
+                config = validate_template(json.loads(inline))
+                spec = inline_plan(config)
+                profile = get_profile(query.get('profile') or config['encoder_profile'])
+        except KeyError as e:
+            raise RequestError(HTTPStatus.NOT_FOUND, e.args[0])
+        except (OSError, ValueError, TypeError, OverflowError) as e:
+            raise RequestError(HTTPStatus.BAD_REQUEST, f"水印设置无效: {e}")
+
+        output_format = query.get('format', '').upper() or None
+        if output_format is not None and output_format not in OUTPUT_FORMATS:
+            raise RequestError(HTTPStatus.BAD_REQUEST,
+                               f"不支持的输出格式 '{output_format}'，可用格式: "
+                               f"{', '.join(OUTPUT_FORMATS)}")
+        return spec, profile, output_format
+
+    def acquire(self):
+        """占用一个处理名额（读取请求体之前调用，处理完后调用 release）；
+        排队的请求已达上限时抛出 RequestError(503)"""
+        if not self._slots.acquire(blocking=False):
+            raise RequestError(HTTPStatus.SERVICE_UNAVAILABLE, "服务繁忙，请稍后重试")
+
+    def release(self):
+        self._slots.release()
+
+    def process(self, data, spec, profile, output_format=None):
+        """在工作线程中加水印，返回 (编码后的数据, 输出格式)；调用前须先 acquire()"""
+        output_format = output_format or guess_format(data)
+        self.metrics.begin()
+        start = time.perf_counter()
+        status, metrics = HTTPStatus.OK, None
+        try:
+            result, metrics = self.pool.submit(self._render, data, spec, profile,
+                                               output_format).result()
+            return result, output_format
+        except (OSError, SyntaxError, Image.DecompressionBombError) as e:
+            # 无法识别、已截断或过大的图片
+            status = HTTPStatus.BAD_REQUEST
+            raise RequestError(status, f"无法读取图片: {e}")
+        except Exception:
+            status = HTTPStatus.INTERNAL_SERVER_ERROR
+            raise
+        finally:
+            self.metrics.end(status, time.perf_counter() - start, metrics)
+
+    @staticmethod
+    def _render(data, spec, profile, output_format):
+        with collect() as metrics:
+            result, _ = encode_export(io.BytesIO(data), output_format, spec, profile)
+        return result, metrics
+
+    def close(self):
+        self.pool.shutdown(wait=True)
+
+
+class WatermarkRequestHandler(BaseHTTPRequestHandler):
+    """HTTP 请求处理；server.service 为 WatermarkService"""
+
+    protocol_version = 'HTTP/1.1'
+    server_version = 'WatermarkServer/1.0'
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == '/metrics':
+            self._send_json(HTTPStatus.OK, self.server.service.metrics.snapshot())
+        elif path == '/healthz':
+            self._send_json(HTTPStatus.OK, {'status': 'ok'})
+        else:
+            self._send_json(HTTPStatus.NOT_FOUND, {'error': "未知路径"})
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path != '/watermark':
+            self._send_json(HTTPStatus.NOT_FOUND, {'error': "未知路径"})
+            return
+        service = self.server.service
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        try:
+            spec, profile, output_format = service.resolve(query, self.headers)
+            # 先占用处理名额再读取请求体：繁忙时立即返回 503，不必先接收完整个上传
+            service.acquire()
+        except RequestError as e:
+            service.metrics.record(e.status)
+            self._send_json(e.status, {'error': str(e)})
+            return
+
+        try:
+            try:
+                data = self._read_body()
+            except RequestError as e:
+                service.metrics.record(e.status)
+                raise
+            result, output_format = service.process(data, spec, profile, output_format)
+        except RequestError as e:
+            self._send_json(e.status, {'error': str(e)})
+            return
+        except Exception as e:
+            logger.exception("处理请求失败")
+            self._send_json(HTTPStatus.INTERNAL_SERVER_ERROR, {'error': str(e)})
+            return
+        finally:
+            service.release()
+
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', CONTENT_TYPES[output_format])
+        self.send_header('Content-Length', str(len(result)))
+        self.end_headers()
+        self.wfile.write(result)
+
+    def _read_body(self):
+        try:
+            length = int(self.headers.get('Content-Length', ''))
+        except ValueError:
+            raise RequestError(HTTPStatus.LENGTH_REQUIRED, "需要 Content-Length 请求头")
+        if length > MAX_BODY_MB * 1024 * 1024:
+            raise RequestError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                               f"图片超过 {MAX_BODY_MB} MB")
+        if length <= 0:
+            raise RequestError(HTTPStatus.BAD_REQUEST, "请求体为空")
+        return self.rfile.read(length)
+
+    def _send_json(self, status, payload):
+        if status >= 400 and self.command == 'POST':
+            # 出错时请求体可能还没读取，直接关闭连接
+            self.close_connection = True
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        if status == HTTPStatus.SERVICE_UNAVAILABLE:
+            self.send_header('Retry-After', '1')
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("%s %s", self.address_string(), format % args)
+
+
+class WatermarkServer(ThreadingHTTPServer):
+    """水印 HTTP 服务器，service 为处理请求的 WatermarkService"""
+
+    daemon_threads = True
+
+    def __init__(self, address, service):
+        super().__init__(address, WatermarkRequestHandler)
+        self.service = service
+
+    def server_close(self):
+        super().server_close()
+        self.service.close()
+
+
+def create_server(host=DEFAULT_HOST, port=DEFAULT_PORT, templates_file=None, workers=None):
+    """创建服务器（port 为 0 时自动选择空闲端口，实际地址见 server.server_address）"""
+    return WatermarkServer((host, port), WatermarkService(templates_file, workers))
+
+
+def start_server(host=DEFAULT_HOST, port=0, templates_file=None, workers=None):
+    """在后台线程中启动服务器并返回（嵌入其他程序或测试时使用）；
+    停止时调用 server.shutdown() 和 server.server_close()"""
+    server = create_server(host, port, templates_file, workers)
+    thread = threading.Thread(target=server.serve_forever, name='watermark-server', daemon=True)
+    thread.start()
+    return server
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='watermark_server',
+                                     description="图片水印工具 - 本地 HTTP 水印服务")
+    parser.add_argument('--host', default=DEFAULT_HOST, help=f"监听地址（默认 {DEFAULT_HOST}）")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT,
+                        help=f"监听端口（默认 {DEFAULT_PORT}）")
+    parser.add_argument('--templates',
+                        help=f"模板文件（默认为程序文件夹中的 {TEMPLATES_NAME}）")
+    parser.add_argument('-w', '--workers', type=int, default=default_workers(),
+                        help="工作线程数（默认 CPU 核心数）")
+    parser.add_argument('-v', '--verbose', action='count', default=0,
+                        help="输出更多日志（-v 信息，-vv 调试，包括每个请求）")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    configure_logging(args.verbose)
+    server = create_server(args.host, args.port, args.templates, args.workers)
+    server.service.warm_up()
+    host, port = server.server_address[:2]
+    print(f"水印服务已启动: http://{host}:{port}/（{server.service.workers} 个工作线程，Ctrl+C 停止）",
+          flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
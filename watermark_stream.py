@@ -0,0 +1,245 @@
+"""
+Watermark Stream - 超大图片分块导出
+按条带/瓦片读取 TIFF，只合成与水印相交的条带，边读边压缩写出 PNG；
+峰值内存只取决于条带大小，与图片像素数无关，结果与整幅加载导出逐像素一致
+"""
+
+import io
+import os
+import struct
+import time
+import zlib
+from PIL import Image, TiffImagePlugin
+from PIL.PngImagePlugin import putchunk
+
+from watermark_encode import EncodeStats
+from watermark_metrics import stage
+from watermark_render import get_renderer, spec_of
+
+# 像素数超过该值的 TIFF 导出 PNG 时分块处理
+STREAM_MIN_PIXELS = 64 * 1024 * 1024
+
+# 未压缩条带按该行数分块读取（单个条带可能就是整幅图片）
+UNCOMPRESSED_BAND_ROWS = 256
+
+# 可以逐块转换为 RGBA 的模式（逐像素转换，分块结果与整幅转换相同）
+STREAM_MODES = ('1', 'L', 'LA', 'P', 'RGB', 'RGBA', 'CMYK')
+
+TIFF_EXTENSIONS = ('.tif', '.tiff')
+
+# 解码单个条带时从原文件复制的 TIFF 标签（描述像素格式和压缩方式）
+FORMAT_TAGS = (
+    258,  # BitsPerSample
+    259,  # Compression
+    262,  # PhotometricInterpretation
+    266,  # FillOrder
+    277,  # SamplesPerPixel
+    284,  # PlanarConfiguration
+    317,  # Predictor
+    320,  # ColorMap
+    332,  # InkSet
+    338,  # ExtraSamples
+    339,  # SampleFormat
+    347,  # JPEGTables
+    529,  # YCbCrCoefficients
+    530,  # YCbCrSubSampling
+    532,  # ReferenceBlackWhite
+)
+
+
+class TiffStrips:
+    """按条带（或一行瓦片）逐块读取 TIFF
+
+    每个条带/瓦片的压缩数据单独包装成只有一个条带的小 TIFF 交给 Pillow（libtiff）解码，
+    因此支持 Pillow 能解码的全部压缩方式，且始终只有一个条带在内存中
+    """
+
+    def __init__(self, path, tiff):
+        self.path = path
+        self.size = tiff.size
+        self.mode = tiff.mode
+        self.info = tiff.info
+        self._tags = tiff.tag_v2
+        self._prefix = tiff.tag_v2.prefix
+        self._tiled = 322 in tiff.tag_v2
+
+    @classmethod
+    def open(cls, path):
+        """打开 TIFF 读取条带信息；不是 TIFF 或布局不支持分块读取时返回 None
+
+        直接使用 TiffImageFile 读取文件头，不经过 Image.open 的像素数上限检查
+        """
+        try:
+            with open(path, 'rb') as f:
+                tiff = TiffImagePlugin.TiffImageFile(f)
+                strips = cls(path, tiff)
+        except (OSError, SyntaxError, struct.error):
+            return None
+
+        tags = strips._tags
+        if strips.mode not in STREAM_MODES or tags.get(284, 1) != 1:
+            return None
+        if (324 if strips._tiled else 273) not in tags:
+            return None
+        return strips
+
+    def bands(self):
+        """依次产出 (y, RGBA 条带)，条带宽度为整幅图片宽度"""
+        with open(self.path, 'rb') as f:
+            if self._tiled:
+                yield from self._tile_bands(f)
+            else:
+                yield from self._strip_bands(f)
+
+    def _strip_bands(self, f):
+        width, height = self.size
+        tags = self._tags
+        rows_per_strip = min(tags.get(278, height), height)
+        offsets = tags[273]
+        counts = tags[279]
+
+        y = 0
+        for offset, count in zip(offsets, counts):
+            rows = min(rows_per_strip, height - y)
+            if rows <= 0:
+                break
+            if tags.get(259, 1) == 1:
+                # 未压缩：大条带再按行拆开读取
+                row_bytes = (width * sum(self._bits()) + 7) // 8
+                for start in range(0, rows, UNCOMPRESSED_BAND_ROWS):
+                    band_rows = min(UNCOMPRESSED_BAND_ROWS, rows - start)
+                    f.seek(offset + start * row_bytes)
+                    data = f.read(band_rows * row_bytes)
+                    yield y + start, self._decode(data, (width, band_rows)).convert('RGBA')
+            else:
+                f.seek(offset)
+                yield y, self._decode(f.read(count), (width, rows)).convert('RGBA')
+            y += rows
+
+    def _tile_bands(self, f):
+        width, height = self.size
+        tags = self._tags
+        tile_width, tile_height = tags[322], tags[323]
+        offsets = tags[324]
+        counts = tags[325]
+        across = (width + tile_width - 1) // tile_width
+
+        for row, y in enumerate(range(0, height, tile_height)):
+            rows = min(tile_height, height - y)
+            band = Image.new('RGBA', (width, rows))
+            for col in range(across):
+                index = row * across + col
+                f.seek(offsets[index])
+                tile = self._decode(f.read(counts[index]), (tile_width, tile_height))
+                # 边缘瓦片只取图片范围内的部分
+                x = col * tile_width
+                tile = tile.crop((0, 0, min(tile_width, width - x), rows))
+                band.paste(tile.convert('RGBA'), (x, 0))
+            yield y, band
+
+    def _bits(self):
+        bits = self._tags.get(258, (1,))
+        return bits if isinstance(bits, tuple) else (bits,)
+
+    def _decode(self, data, size):
+        """把一段条带数据包装成单条带 TIFF 并解码"""
+        ifd = TiffImagePlugin.ImageFileDirectory_v2(prefix=self._prefix)
+        for tag in FORMAT_TAGS:
+            if tag in self._tags:
+                ifd[tag] = self._tags[tag]
+                ifd.tagtype[tag] = self._tags.tagtype[tag]
+        ifd[256] = size[0]
+        ifd[257] = size[1]
+        ifd[278] = size[1]
+        ifd[273] = 0  # 相对于目录末尾：条带数据紧跟在目录之后
+        ifd[279] = len(data)
+
+        endian = '<' if self._prefix == b'II' else '>'
+        header = self._prefix + struct.pack(endian + 'HI', 42, 8)
+        buffer = io.BytesIO(header + ifd.tobytes(8) + data)
+
+        with stage('decode'):
+            strip = Image.open(buffer)
+            strip.load()
+        return strip
+
+
+class PngStreamWriter:
+    """逐条带写出 RGBA PNG：每行不做滤波，像素数据经 zlib 流式压缩后写成 IDAT 块"""
+
+    def __init__(self, fp, size, icc_profile=None, compress_level=zlib.Z_DEFAULT_COMPRESSION):
+        self.fp = fp
+        self.width, self.height = size
+        self.rows_written = 0
+        self.seconds = 0.0  # 累计编码耗时
+        self._compressor = zlib.compressobj(compress_level)
+
+        fp.write(b'\x89PNG\r\n\x1a\n')
+        putchunk(fp, b'IHDR', struct.pack('>IIBBBBB', self.width, self.height, 8, 6, 0, 0, 0))
+        if icc_profile:
+            # 与 Pillow 保存 PNG 时写入的 ICC 配置文件相同
+            putchunk(fp, b'iCCP', b'ICC Profile\0\0' + zlib.compress(icc_profile))
+
+    def write(self, band):
+        """写入一个 RGBA 条带（宽度与图片相同）"""
+        start = time.perf_counter()
+        data = memoryview(band.tobytes())
+        stride = self.width * 4
+        raw = b''.join(b'\0' + data[i:i + stride] for i in range(0, len(data), stride))
+        self._write_idat(self._compressor.compress(raw))
+        self.rows_written += band.height
+        self.seconds += time.perf_counter() - start
+
+    def close(self):
+        if self.rows_written != self.height:
+            raise ValueError(f"PNG 行数不完整: {self.rows_written}/{self.height}")
+        start = time.perf_counter()
+        self._write_idat(self._compressor.flush())
+        self.seconds += time.perf_counter() - start
+        putchunk(self.fp, b'IEND', b'')
+
+    def _write_idat(self, data):
+        if data:
+            putchunk(self.fp, b'IDAT', data)
+
+
+def open_stream_source(image_path, output_format):
+    """需要分块导出时返回 TiffStrips，否则返回 None（使用整幅加载的导出方式）"""
+    if output_format != 'PNG' or not image_path.lower().endswith(TIFF_EXTENSIONS):
+        return None
+    strips = TiffStrips.open(image_path)
+    if strips is None or strips.size[0] * strips.size[1] < STREAM_MIN_PIXELS:
+        return None
+    return strips
+
+
+def export_png_stream(strips, output_path, spec, profile):
+    """分块导出 PNG：只有与水印区域相交的条带参与合成（平铺水印时每个条带都合成），返回 EncodeStats
+
+    spec 为 WatermarkSpec 或 RenderPlan
+    """
+    renderer = get_renderer()
+    placement = renderer.place(strips.size, spec)
+
+    try:
+        with open(output_path, 'wb') as fp:
+            writer = PngStreamWriter(fp, strips.size, strips.info.get('icc_profile'),
+                                     profile.png_compress_level)
+            tiled = spec_of(spec).tiled
+            for y, band in strips.bands():
+                if tiled:
+                    renderer.composite_tiles(band, spec, top=y)
+                elif placement is not None:
+                    layer, (x, wm_y), fill = placement
+                    if wm_y < y + band.height and y < wm_y + layer.height:
+                        with stage('composite'):
+                            renderer.composite(band, layer, (x, wm_y - y), fill)
+                with stage('encode'):
+                    writer.write(band)
+            writer.close()
+    except BaseException:
+        # 不留下不完整的输出文件
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        raise
+    return EncodeStats(profile.name, 'PNG', writer.seconds, os.path.getsize(output_path))
@@ -0,0 +1,242 @@
+"""
+Watermark Templates - 模板库
+模板文件只在第一次使用和文件被修改后读取；每个模板读取时校验并补全为完整设置，
+使用时编译为不可变的 Template（WatermarkSpec、编码配置和 RenderPlan），按内容哈希缓存，
+切换模板时不需要重新解析字体、读取水印图片或渲染图层；保存时通过替换临时文件原子写入
+"""
+
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import sys
+import threading
+from dataclasses import dataclass
+
+from watermark_encode import ENCODER_PROFILES, EncoderProfile, get_profile
+from watermark_io import write_json_atomic
+from watermark_render import POSITIONS, RenderPlan, WatermarkSpec, get_renderer
+
+TEMPLATES_NAME = 'watermark_templates.json'
+LAST_CONFIG_NAME = 'last_config.json'
+
+# 模板中的水印设置取值范围
+SETTING_RANGES = {
+    'font_size': (1, 1000),
+    'opacity': (0, 100),
+    'img_opacity': (0, 100),
+    'wm_scale': (1, 1000),
+    'tile_spacing': (0, 10000),
+    'tile_stagger': (0, 100),
+}
+
+_COLOR_PATTERN = re.compile(r'^#[0-9a-fA-F]{6}$')
+
+logger = logging.getLogger(__name__)
+
+
+def app_dir():
+    """程序所在的文件夹（打包为 exe 后为 exe 所在文件夹）"""
+    if getattr(sys, 'frozen', False):
+        return os.path.dirname(os.path.abspath(sys.executable))
+    return os.path.dirname(os.path.abspath(__file__))
+
+
+def app_file(name):
+    """程序文件夹中的配置文件路径；程序文件夹中没有而当前目录中有时沿用当前目录中的文件"""
+    path = os.path.join(app_dir(), name)
+    if not os.path.exists(path) and os.path.exists(name):
+        return os.path.abspath(name)
+    return path
+
+
+def default_templates_path():
+    """默认模板文件（与图形界面、命令行和 HTTP 服务共用）"""
+    return app_file(TEMPLATES_NAME)
+
+
+def validate_template(config):
+    """校验模板设置，返回补全默认值后的完整设置（含 encoder_profile）；无效时抛出 ValueError"""
+    if not isinstance(config, dict):
+        raise ValueError("模板必须是 JSON 对象")
+    try:
+        spec = WatermarkSpec.from_config(config)
+    except (TypeError, ValueError, OverflowError) as e:
+        # OverflowError：JSON 中的 1e999 等超出范围的数值
+        raise ValueError(f"数值设置无效: {e}")
+    if spec.type not in ('text', 'image'):
+        raise ValueError(f"未知的水印类型 '{spec.type}'")
+    if not isinstance(spec.text, str) or not isinstance(spec.image_path, str):
+        raise ValueError("text 和 image_path 必须是字符串")
+    if not isinstance(spec.color, str) or not _COLOR_PATTERN.match(spec.color):
+        raise ValueError(f"颜色 '{spec.color}' 不是 #RRGGBB 格式")
+    if spec.position not in POSITIONS:
+        raise ValueError(f"未知的位置 '{spec.position}'")
+    for key in ('offset_x', 'offset_y'):
+        value = getattr(spec, key)
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError(f"{key} 必须是数字")
+        if not math.isfinite(value):
+            raise ValueError(f"{key} 必须是有限的数字（当前为 {value}）")
+    for key, (low, high) in SETTING_RANGES.items():
+        value = getattr(spec, key)
+        if not low <= value <= high:
+            raise ValueError(f"{key} 应在 {low}-{high} 之间（当前为 {value}）")
+
+    settings = spec.to_config()
+    profile = config.get('encoder_profile')
+    if profile is not None and (not isinstance(profile, str) or profile not in ENCODER_PROFILES):
+        raise ValueError(f"未知的编码配置 '{profile}'")
+    settings['encoder_profile'] = profile
+    return settings
+
+
+def settings_hash(settings):
+    """设置内容的哈希；图片水印包含水印图片的大小和修改时间，图片修改后哈希随之变化"""
+    content = dict(settings)
+    if settings.get('type') == 'image' and settings.get('image_path'):
+        try:
+            stat = os.stat(settings['image_path'])
+            content['logo'] = (stat.st_size, stat.st_mtime_ns)
+        except OSError:
+            content['logo'] = None
+    data = json.dumps(content, sort_keys=True, ensure_ascii=False).encode('utf-8')
+    return hashlib.sha256(data).hexdigest()
+
+
+@dataclass(frozen=True, eq=False)
+class Template:
+    """编译好的模板（不可变，内容相同的模板共用）：plan 可直接传给 Renderer.render / export_batch"""
+    digest: str
+    spec: WatermarkSpec
+    profile: EncoderProfile
+    plan: RenderPlan
+
+
+class TemplateStore:
+    """模板库：按名称读取、保存模板，并缓存编译结果（线程安全）
+
+    文件只在大小或修改时间变化时重新读取，无效的模板记录在 errors 中并跳过（保存时原样保留）；
+    编译结果按内容哈希缓存，内容相同的模板共用一份，文件重新读取后内容没变的模板不必重新编译
+    """
+
+    def __init__(self, path=None, renderer=None):
+        self.path = path or default_templates_path()
+        self.renderer = renderer
+        self.errors = {}        # 无效的模板名 -> 错误信息
+        self._raw = {}          # 文件中的原始内容（保存时写回）
+        self._settings = {}     # 有效的模板名 -> 完整设置
+        self._compiled = {}     # 内容哈希 -> Template
+        self._signature = None
+        self._lock = threading.RLock()
+
+    def refresh(self):
+        """文件有变化时重新读取，返回是否重新读取了"""
+        with self._lock:
+            signature = self._file_signature()
+            if signature == self._signature:
+                return False
+            raw = {}
+            if signature is not None:
+                try:
+                    with open(self.path, 'r', encoding='utf-8') as f:
+                        raw = json.load(f)
+                except (OSError, ValueError) as e:
+                    logger.warning("模板文件读取失败 %s: %s", self.path, e)
+                    raw = {}
+                if not isinstance(raw, dict):
+                    logger.warning("模板文件格式无效: %s", self.path)
+                    raw = {}
+            self._load(raw)
+            self._signature = signature
+            return True
+
+    def names(self):
+        """有效的模板名称（按文件中的顺序）"""
+        with self._lock:
+            self.refresh()
+            return list(self._settings)
+
+    def get(self, name):
+        """模板的完整设置（副本）；模板不存在或无效时抛出 KeyError"""
+        with self._lock:
+            self.refresh()
+            return dict(self._lookup(name))
+
+    def template(self, name):
+        """编译好的模板（按内容哈希缓存）；模板不存在或无效时抛出 KeyError，
+        水印图片无法读取时抛出 OSError"""
+        with self._lock:
+            self.refresh()
+            settings = self._lookup(name)
+            digest = settings_hash(settings)
+            compiled = self._compiled.get(digest)
+            if compiled is None:
+                compiled = self._compile(settings, digest)
+                self._compiled[digest] = compiled
+            return compiled
+
+    def compile_all(self):
+        """预先编译所有模板（如 HTTP 服务启动时），返回编译失败的 {名称: 错误信息}"""
+        failed = {}
+        for name in self.names():
+            try:
+                self.template(name)
+            except OSError as e:
+                failed[name] = str(e)
+        return failed
+
+    def save(self, name, config):
+        """校验并保存模板，返回完整设置；设置无效时抛出 ValueError，写入失败时抛出 OSError
+
+        保存前先读取文件的最新内容，其他程序同时保存的模板不会被覆盖
+        """
+        settings = validate_template(config)
+        with self._lock:
+            self.refresh()
+            raw = dict(self._raw)
+            raw[name] = settings
+            write_json_atomic(self.path, raw)
+            self._load(raw)
+            self._signature = self._file_signature()
+        return dict(settings)
+
+    def _load(self, raw):
+        previous_errors = self.errors
+        self._raw = raw
+        self._settings = {}
+        self.errors = {}
+        for name, config in raw.items():
+            try:
+                self._settings[name] = validate_template(config)
+            except (ValueError, TypeError, OverflowError) as e:
+                # 一个无效的模板不影响其他模板
+                self.errors[name] = str(e)
+                if previous_errors.get(name) != self.errors[name]:
+                    logger.warning("模板 '%s' 无效，已跳过: %s", name, e)
+        # 只保留仍在使用的编译结果
+        digests = {settings_hash(settings) for settings in self._settings.values()}
+        self._compiled = {digest: compiled for digest, compiled in self._compiled.items()
+                          if digest in digests}
+
+    def _lookup(self, name):
+        if name in self.errors:
+            raise KeyError(f"模板 '{name}' 无效: {self.errors[name]}")
+        if name not in self._settings:
+            raise KeyError(f"模板 '{name}' 不存在，可用模板: {', '.join(self._settings) or '无'}")
+        return self._settings[name]
+
+    def _compile(self, settings, digest):
+        renderer = self.renderer or get_renderer()
+        spec = WatermarkSpec.from_config(settings)
+        return Template(digest, spec, get_profile(settings['encoder_profile']),
+                        renderer.compile(spec))
+
+    def _file_signature(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
@@ -0,0 +1,182 @@
+"""
+Watermark Thumbnails - 缩略图缓存
+缩略图持久保存在磁盘上（按路径、文件大小和修改时间索引，超出容量按最近使用淘汰），
+再次打开同一批图片时无需解码原图；缩略图在后台线程生成
+"""
+
+import hashlib
+import logging
+import os
+import sys
+import threading
+from PIL import Image
+
+from watermark_preview import load_preview_base
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_SIZE = (96, 96)
+DEFAULT_THUMB_CACHE_MB = 200
+
+
+def default_cache_dir():
+    """缩略图缓存目录（按平台放在用户缓存目录下）"""
+    if sys.platform == 'win32':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    elif sys.platform == 'darwin':
+        base = os.path.join(os.path.expanduser('~'), 'Library', 'Caches')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'PhotoWatermark', 'thumbnails')
+
+
+class ThumbnailCache:
+    """磁盘缩略图缓存
+
+    缓存文件名由 (绝对路径, 文件大小, 修改时间, 缩略图尺寸) 的哈希决定，原图修改后自动失效；
+    读取命中时更新缓存文件的修改时间，超过容量时删除最久未使用的文件
+    """
+
+    def __init__(self, cache_dir=None, max_mb=DEFAULT_THUMB_CACHE_MB, size=THUMBNAIL_SIZE):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.size = size
+        self._total_bytes = None  # 第一次写入时统计
+        self._lock = threading.Lock()
+
+    def entry_path(self, image_path, stat=None):
+        """原图对应的缓存文件路径"""
+        stat = stat or os.stat(image_path)
+        key = f"{os.path.abspath(image_path)}|{stat.st_size}|{stat.st_mtime_ns}|{self.size[0]}x{self.size[1]}"
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], digest + '.jpg')
+
+    def get(self, image_path):
+        """获取缩略图（RGB），缓存未命中时降分辨率解码原图并写入缓存"""
+        entry = self.entry_path(image_path)
+        try:
+            with Image.open(entry) as cached:
+                cached.load()
+                thumbnail = cached.copy()
+            os.utime(entry)  # 记录最近使用时间
+            return thumbnail
+        except OSError:
+            pass
+
+        thumbnail, _ = load_preview_base(image_path, *self.size)
+        if thumbnail.mode != 'RGB':
+            thumbnail = thumbnail.convert('RGB')
+        try:
+            self._store(entry, thumbnail)
+        except OSError as e:
+            logger.warning("缩略图缓存写入失败: %s", e)
+        return thumbnail
+
+    def _store(self, entry, thumbnail):
+        """写入缓存文件（先写临时文件再替换，中断时不会留下损坏的缓存）"""
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        temp = f"{entry}.{os.getpid()}.{threading.get_ident()}.tmp"
+        thumbnail.save(temp, 'JPEG', quality=85)
+        os.replace(temp, entry)
+
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(size for _, size, _ in self._entries())
+            else:
+                self._total_bytes += os.path.getsize(entry)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        """列出缓存文件 (路径, 大小, 修改时间)"""
+        try:
+            folders = list(os.scandir(self.cache_dir))
+        except OSError:
+            return
+        for folder in folders:
+            if not folder.is_dir():
+                continue
+            try:
+                files = list(os.scandir(folder.path))
+            except OSError:
+                continue
+            for entry in files:
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                yield entry.path, stat.st_size, stat.st_mtime
+
+    def _evict(self):
+        """删除最久未使用的缓存文件，直到占用降到容量的 90%"""
+        entries = sorted(self._entries(), key=lambda item: item[2])
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.9
+        for path, size, _ in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                continue
+        self._total_bytes = total
+
+
+class ThumbnailLoader:
+    """后台生成缩略图
+
+    request() 用最新的可见范围替换尚未处理的请求，结果在 Tk 线程通过 on_ready(index, path, image) 回调
+    """
+
+    def __init__(self, root, cache, on_ready, poll_ms=30):
+        self.root = root
+        self.cache = cache
+        self.on_ready = on_ready
+        self.poll_ms = poll_ms
+        self._cond = threading.Condition()
+        self._pending = []    # 待生成的 (index, path)
+        self._results = []    # 已生成的 (index, path, image)
+        self._busy = False
+        self._poll_id = None
+        self._thread = threading.Thread(target=self._worker, name='thumbnail-loader', daemon=True)
+        self._thread.start()
+
+    def request(self, items):
+        """请求生成缩略图，items 为 (index, path) 列表（Tk 线程）"""
+        with self._cond:
+            self._pending = list(items)
+            self._cond.notify()
+        if self._poll_id is None:
+            self._poll_id = self.root.after(self.poll_ms, self._poll)
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                index, path = self._pending.pop(0)
+                self._busy = True
+
+            try:
+                image = self.cache.get(path)
+            except Exception:
+                logger.exception("缩略图错误 %s", path)
+                image = None
+
+            with self._cond:
+                if image is not None:
+                    self._results.append((index, path, image))
+                self._busy = False
+
+    def _poll(self):
+        self._poll_id = None
+        with self._cond:
+            results, self._results = self._results, []
+            working = self._busy or bool(self._pending)
+
+        for index, path, image in results:
+            self.on_ready(index, path, image)
+
+        if working:
+            self._poll_id = self.root.after(self.poll_ms, self._poll)
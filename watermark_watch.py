@@ -0,0 +1,455 @@
+"""
+Watermark Watch - 热文件夹监视
+持续监视文件夹，新出现或被修改的图片写入完成后按批导出到输出文件夹；
+Linux 上使用 inotify，其他系统和网络共享等不支持 inotify 的情况使用轮询扫描。
+已导出的文件记录在输出文件夹的导出清单中，重启后不会重复处理
+"""
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import signal
+import struct
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from watermark_export import export_batch, plan_jobs, process_context
+from watermark_manifest import ExportManifest, settings_digest
+from watermark_render import spec_of
+from watermark_scan import is_image_file, path_key, relative_folder
+
+# 文件大小和修改时间保持不变多久（秒）才认为已写入完成
+SETTLE_SECONDS = 2.0
+
+# 轮询扫描的间隔（秒）：只重新读取修改时间变化的目录
+POLL_INTERVAL = 2.0
+
+# 完整扫描的间隔（秒）：检查所有文件，发现原地覆盖写入的图片（不会改变目录修改时间）
+FULL_SCAN_INTERVAL = 60.0
+
+# 有等待写入完成的文件时检查的间隔（秒）
+CHECK_INTERVAL = 0.5
+
+# 第一张图片就绪后最多再等待多久（秒），让同时到达的图片合成一批
+BATCH_WINDOW = 1.0
+
+# 每批最多导出的图片数（启动时积压大量图片时，新到的图片不必等全部处理完）
+BATCH_SIZE = 100
+
+logger = logging.getLogger(__name__)
+
+
+def _list_folder(folder, exclude):
+    """读取一个目录：返回 ({图片路径: (大小, 修改时间)}, 子目录列表)，无法读取时都为空"""
+    files, subfolders = {}, []
+    try:
+        with os.scandir(folder) as it:
+            for entry in it:
+                try:
+                    if entry.is_file():
+                        if is_image_file(entry.name):
+                            stat = entry.stat()
+                            files[entry.path] = (stat.st_size, stat.st_mtime_ns)
+                    elif entry.is_dir(follow_symlinks=False):
+                        if path_key(entry.path) not in exclude:
+                            subfolders.append(entry.path)
+                except OSError:
+                    continue
+    except OSError:
+        pass
+    return files, subfolders
+
+
+def _folder_mtime(folder):
+    try:
+        return os.stat(folder).st_mtime_ns
+    except OSError:
+        return None
+
+
+class PollingWatcher:
+    """轮询扫描：记录每个目录的修改时间，目录有增删改名时才重新读取该目录；
+    每 FULL_SCAN_INTERVAL 秒完整扫描一次，发现大小或修改时间变化的文件"""
+
+    def __init__(self, folders, recursive=True, exclude=(), interval=POLL_INTERVAL):
+        self.roots = list(folders)
+        self.recursive = recursive
+        self.exclude = set(exclude)
+        self.interval = interval
+        self.folders = {}   # 目录 -> 修改时间
+        self.files = {}     # 图片路径 -> (大小, 修改时间)
+        self._polled_at = self._scanned_at = time.monotonic()
+
+    def scan(self):
+        """完整扫描，返回所有大小或修改时间与上次扫描不同的图片（首次为全部图片）"""
+        self.folders.clear()
+        changed = []
+        seen = set()
+        for root in self.roots:
+            changed += self._read_tree(root, seen)
+        for path in set(self.files) - seen:
+            del self.files[path]
+        self._polled_at = self._scanned_at = time.monotonic()
+        return changed
+
+    def changes(self, timeout):
+        """等待最多 timeout 秒，返回可能新增或变化的图片路径"""
+        time.sleep(timeout)
+        now = time.monotonic()
+        if now - self._scanned_at >= FULL_SCAN_INTERVAL:
+            return self.scan()
+        if now - self._polled_at < self.interval:
+            return []
+        self._polled_at = now
+
+        changed = []
+        for folder, mtime in list(self.folders.items()):
+            current = _folder_mtime(folder)
+            if current is None:
+                self._forget(folder)
+            elif current != mtime:
+                changed += self._read_folder(folder, current)
+        return changed
+
+    def close(self):
+        pass
+
+    def _read_tree(self, folder, seen=None):
+        """读取目录（递归时包括新发现的子目录），返回有变化的图片"""
+        changed = []
+        pending = [folder]
+        while pending:
+            folder = pending.pop()
+            mtime = _folder_mtime(folder)
+            if mtime is None:
+                continue
+            changed += self._read_folder(folder, mtime, pending, seen)
+        return changed
+
+    def _read_folder(self, folder, mtime, pending=None, seen=None):
+        self.folders[folder] = mtime
+        files, subfolders = _list_folder(folder, self.exclude)
+        changed = [path for path, signature in files.items()
+                   if self.files.get(path) != signature]
+        if seen is not None:
+            seen.update(files)
+        else:
+            # 只读取了这一个目录：清除其中已删除的文件
+            for path in [path for path in self.files
+                         if os.path.dirname(path) == folder and path not in files]:
+                del self.files[path]
+        self.files.update(files)
+
+        if self.recursive:
+            new_folders = [subfolder for subfolder in subfolders if subfolder not in self.folders]
+            if pending is not None:
+                pending.extend(new_folders)
+            else:
+                for subfolder in new_folders:
+                    changed += self._read_tree(subfolder)
+        return changed
+
+    def _forget(self, folder):
+        """目录已删除：不再检查它和它的子目录"""
+        prefix = os.path.join(folder, '')
+        for path in [path for path in self.folders if path == folder or path.startswith(prefix)]:
+            del self.folders[path]
+        for path in [path for path in self.files if path.startswith(prefix)]:
+            del self.files[path]
+
+
+# inotify 事件（见 inotify(7)）
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+_WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+_EVENT = struct.Struct('iIII')  # wd, mask, cookie, len，后接 len 字节的文件名
+
+
+def _load_libc():
+    """支持 inotify 的 libc，不支持时返回 None"""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class InotifyWatcher:
+    """inotify 监视：文件有写入、关闭、移入时立即得到通知，不需要反复扫描目录
+
+    新建的子目录自动加入监视（并扫描其中已有的图片）；事件队列溢出时完整扫描一次
+    """
+
+    def __init__(self, libc, folders, recursive=True, exclude=()):
+        self.libc = libc
+        self.roots = list(folders)
+        self.recursive = recursive
+        self.exclude = set(exclude)
+        self.watches = {}  # 监视描述符 -> 目录
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify 初始化失败")
+
+    def scan(self):
+        """加入监视并返回所有已有的图片"""
+        images = []
+        for root in self.roots:
+            images += self._watch_tree(root)
+        return images
+
+    def changes(self, timeout):
+        """等待最多 timeout 秒，返回有写入或新出现的图片路径"""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            buffer = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        changed = []
+        offset = 0
+        while offset + _EVENT.size <= len(buffer):
+            wd, mask, _, length = _EVENT.unpack_from(buffer, offset)
+            offset += _EVENT.size
+            name = os.fsdecode(buffer[offset:offset + length].rstrip(b'\0'))
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                logger.warning("inotify 事件队列溢出，重新扫描")
+                return self.scan()
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            folder = self.watches.get(wd)
+            if folder is None or not name:
+                continue
+            path = os.path.join(folder, name)
+            if mask & IN_ISDIR:
+                if (self.recursive and mask & (IN_CREATE | IN_MOVED_TO)
+                        and path_key(path) not in self.exclude):
+                    changed += self._watch_tree(path)
+            elif is_image_file(name):
+                changed.append(path)
+        return changed
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def _watch_tree(self, folder):
+        """监视目录（递归时包括子目录），返回其中已有的图片"""
+        images = []
+        pending = [folder]
+        while pending:
+            folder = pending.pop()
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(folder), _WATCH_MASK)
+            if wd < 0:
+                logger.warning("无法监视 %s: %s", folder, os.strerror(ctypes.get_errno()))
+                continue
+            self.watches[wd] = folder
+            # 先加监视再读取目录，两者之间出现的文件不会遗漏
+            files, subfolders = _list_folder(folder, self.exclude)
+            images += files
+            if self.recursive:
+                pending += subfolders
+        return images
+
+
+def create_watcher(folders, recursive=True, exclude=(), poll=False, interval=POLL_INTERVAL):
+    """创建监视器：支持 inotify 且没有要求轮询时使用 inotify，否则轮询扫描"""
+    libc = None if poll else _load_libc()
+    if libc is not None:
+        try:
+            return InotifyWatcher(libc, folders, recursive, exclude)
+        except OSError as e:
+            logger.warning("%s，改用轮询扫描", e)
+    return PollingWatcher(folders, recursive, exclude, interval)
+
+
+def _ignore_interrupt():
+    """进程池子进程忽略 Ctrl+C，由主进程保存清单后关闭进程池"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class HotFolder:
+    """热文件夹：监视 folders，把写入完成的图片按批导出到 output
+
+    spec 为 WatermarkSpec 或 RenderPlan；文件大小和修改时间 SETTLE_SECONDS 秒不变才认为写入完成；就绪的图片等待 BATCH_WINDOW 秒
+    合成一批后导出（workers > 1 时使用常驻进程池，跨批次复用）。
+    输出文件放在 output 中与监视文件夹相同的相对子文件夹里，与其他图片输出到同一个文件的图片跳过；
+    导出清单记录已导出的文件，重启后启动时的扫描会跳过它们；导出失败的文件变化后才重试
+    """
+
+    def __init__(self, folders, output, output_format, spec, profile, naming='suffix',
+                 affix='_wm', workers=1, recursive=True, settle=SETTLE_SECONDS,
+                 poll=False, interval=POLL_INTERVAL):
+        # 按长度倒序，嵌套的监视文件夹中的图片按最近的文件夹计算相对路径
+        self.roots = sorted(folders, key=len, reverse=True)
+        self.output = output
+        self.output_format = output_format
+        self.spec = spec
+        self.profile = profile
+        self.naming = naming
+        self.affix = affix
+        self.workers = workers
+        self.settle = settle
+        os.makedirs(output, exist_ok=True)
+        self.manifest = ExportManifest(output)
+        self.digest = settings_digest(spec_of(spec), output_format, profile)
+        # 输出文件夹在监视的文件夹中时不监视它，避免导出结果再被处理
+        self.watcher = create_watcher(folders, recursive, {path_key(output)}, poll, interval)
+        self.pool = self._create_pool()
+        self.pending = {}  # 等待写入完成的图片 -> ((大小, 修改时间), 该状态开始的时间)
+        self.failed = {}   # 导出失败的图片 -> 失败时的 (大小, 修改时间)
+
+    def run(self, stop, on_batch=None):
+        """监视直到 stop（threading.Event）被设置
+
+        每批导出后调用 on_batch(results, up_to_date)：results 为 ExportResult 列表，
+        up_to_date 为清单中已是最新而跳过的数量
+        """
+        logger.info("开始监视（%s）", type(self.watcher).__name__)
+        self._observe(self.watcher.scan())
+        ready = []
+        ready_since = None
+        while not stop.is_set():
+            timeout = CHECK_INTERVAL if self.pending or ready else 1.0
+            self._observe(self.watcher.changes(timeout))
+            ready += self._settled()
+            if not ready:
+                continue
+            now = time.monotonic()
+            if ready_since is None:
+                ready_since = now
+            if len(ready) >= BATCH_SIZE or now - ready_since >= BATCH_WINDOW:
+                batch, ready = ready[:BATCH_SIZE], ready[BATCH_SIZE:]
+                ready_since = now if ready else None
+                results, up_to_date = self.export(batch)
+                if on_batch is not None:
+                    on_batch(results, up_to_date)
+
+    def export(self, paths):
+        """导出一批图片，返回 (ExportResult 列表, 已是最新的数量)"""
+        entries = [(image_path, self._subfolder(image_path)) for image_path in paths]
+        jobs, conflicts = plan_jobs(entries, self.output, self.output_format,
+                                    self.naming, self.affix)
+        # 之前的批次中已有另一张（仍然存在的）图片导出到同一个输出文件
+        for image_path, output_path in jobs:
+            source = self.manifest.source_of(output_path)
+            if (source is not None and path_key(source) != path_key(image_path)
+                    and os.path.exists(source)):
+                conflicts.append((image_path, f"与 {source} 的输出文件相同"))
+        skipped = {image_path for image_path, _ in conflicts}
+        for image_path, reason in conflicts:
+            logger.warning("跳过 %s: %s", image_path, reason)
+            self._mark_failed(image_path)
+        jobs = [job for job in jobs if job[0] not in skipped]
+        jobs, up_to_date = self.manifest.pending(jobs, self.digest)
+
+        results = []
+        try:
+            for result in export_batch(jobs, self.output_format, self.spec, self.workers,
+                                       self.profile, fingerprint=True, pool=self.pool):
+                results.append(result)
+                if result.error is None:
+                    self.failed.pop(result.image_path, None)
+                    self.manifest.record(result.image_path, result.output_path, self.digest,
+                                         result.fingerprint)
+                    self.manifest.save_if_due()
+                else:
+                    self._mark_failed(result.image_path)
+        finally:
+            self.manifest.save()
+        if any(result.error for result in results):
+            self._check_pool()
+        return results, up_to_date
+
+    def close(self):
+        """停止监视：保存清单，关闭进程池"""
+        self.manifest.save()
+        self.watcher.close()
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+
+    def _create_pool(self):
+        """常驻进程池（workers <= 1 时为 None，在当前进程内导出）"""
+        if self.workers <= 1:
+            return None
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=process_context(),
+                                   initializer=_ignore_interrupt)
+
+    def _check_pool(self):
+        """子进程异常退出（内存不足被杀、解码时崩溃）后进程池不再可用：关闭并重新创建，
+        这一批中失败的图片已记录，文件变化前不会重试，不会反复导致子进程崩溃"""
+        if self.pool is None:
+            return
+        try:
+            self.pool.submit(os.getpid).result()
+        except BrokenProcessPool:
+            logger.warning("导出进程异常退出，重新创建进程池")
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = self._create_pool()
+
+    def _subfolder(self, path):
+        """图片相对所在监视文件夹的子文件夹（导出时在输出文件夹中保持目录结构）"""
+        for root in self.roots:
+            if path.startswith(os.path.join(root, '')):
+                return relative_folder(path, root)
+        return ''
+
+    def _mark_failed(self, path):
+        """记录失败（或跳过）的图片，文件变化前不再重试"""
+        signature = self._signature(path)
+        if signature is not None:
+            self.failed[path] = signature
+
+    def _observe(self, paths):
+        """记录可能有变化的图片，等待写入完成"""
+        now = time.monotonic()
+        for path in paths:
+            if path not in self.pending:
+                self.pending[path] = (None, now)
+
+    def _settled(self):
+        """检查等待中的图片，返回写入完成（一段时间内大小和修改时间不变）的图片"""
+        now = time.monotonic()
+        wall = time.time()
+        ready = []
+        for path, (previous, since) in list(self.pending.items()):
+            signature = self._signature(path)
+            if signature is None:
+                del self.pending[path]  # 已删除或移走
+            elif signature != previous:
+                # 第一次看到或仍在写入；修改时间早于等待时长的旧文件再确认一次即可
+                age = wall - signature[1] / 1e9
+                self.pending[path] = (signature, now if previous is not None or age < self.settle
+                                      else now - self.settle)
+            elif signature[0] > 0 and now - since >= self.settle:
+                del self.pending[path]
+                if self.failed.get(path) != signature:
+                    ready.append(path)
+        return ready
+
+    @staticmethod
+    def _signature(path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_size, stat.st_mtime_ns